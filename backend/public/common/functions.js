@@ -13,3 +13,15 @@ function timingDisplay(timing) {
   return `${Math.round(timing * 1000) / 1000}s`;
 } // function timingDisplay(timing)
 
+
+function stabilityDisplay(stability) {
+  console.assert(stability.captures > 1, `Stability ${stability} has too few captures`);
+
+  // The stability was measured by capturing the final state of the test repeatedly
+  const text = `${stability.differing} of ${stability.captures} repeated captures differed`;
+  if (stability.maxError == null) {
+    return text;
+  }
+  return `${text}, up to ${diffDisplay(stability.maxError)}`;
+} // function stabilityDisplay(stability)
+
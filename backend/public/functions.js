@@ -153,6 +153,8 @@ function createRows(record, ul) {
       img.src = `/api/result/${type}-thumbnail/${record.group}/${record.name}/${record.hardware}`;
       img.className = "overview";
       img.loading = "lazy";
+      // Tests that failed before they were ever run successfully have no images
+      img.alt = "No image";
       a.appendChild(img);
       return div;
     }
@@ -163,7 +165,15 @@ function createRows(record, ul) {
     const status = document.createElement("div");
     const errorClass = classForDiff(data.pixelError);
     status.className = `cell status ${errorClass}`;
-    status.appendChild(document.createTextNode(diffDisplay(data.pixelError)));
+    // Tests that did not run to completion have no image of their own
+    if (data.failure != null) {
+      status.title = data.failure;
+    }
+    else if (data.stability != null) {
+      status.title = stabilityDisplay(data.stability);
+    }
+    const statusText = data.failure != null ? "Failed" : diffDisplay(data.pixelError);
+    status.appendChild(document.createTextNode(statusText));
     divHead.appendChild(status);
 
     const group = document.createElement("div");
@@ -222,6 +232,8 @@ function createRows(record, ul) {
       const img = document.createElement("img");
       img.src = `/api/result/${type}-thumbnail/${record.group}/${record.name}/${record.hardware}/${timestamp}`;
       img.loading = "lazy";
+      // Tests that failed before they were ever run successfully have no images
+      img.alt = "No image";
       a.appendChild(img);
       return td;
     }
@@ -259,7 +271,14 @@ function createRows(record, ul) {
     for (const data of testData) {
       const td = document.createElement("td");
       td.className = "diff";
-      td.appendChild(document.createTextNode(diffDisplay(data.pixelError)));
+      if (data.failure != null) {
+        td.title = data.failure;
+      }
+      else if (data.stability != null) {
+        td.title = stabilityDisplay(data.stability);
+      }
+      const text = data.failure != null ? "Failed" : diffDisplay(data.pixelError);
+      td.appendChild(document.createTextNode(text));
       trDiff.appendChild(td);
     }
     table.appendChild(trDiff);
@@ -30,8 +30,12 @@ import {
   latestTestPath, logFile, referenceImage, referenceImagePath, temporaryPath,
   testDataPath, testPath, thumbnailForImage, updateReferencePointer } from "./globals";
 import { createThumbnail, generateComparisonImage, saveComparisonImage } from "./image";
-import { addTestData, loadTestRecord, regenerateTestResults, reloadTestResults,
-  saveTestData, TestData, TestRecords } from "./testrecords";
+import { pixelHash, removePixelHash, storePixelHash } from "./pixelhash";
+import { addTestData, findComparison, findTestRecords, loadTestRecord, PhasesSchema,
+  regenerateTestResults, reloadTestResults, saveTestData, StabilitySchema, TestData,
+  TestRecords } from "./testrecords";
+import { abandonTest, finishTest, LeaseDuration, leaseTest, registerRunner,
+  renewLease } from "./workqueue";
 import bodyParser from "body-parser";
 import express from "express";
 import fs from "fs";
@@ -71,6 +75,26 @@ export function registerRoutes(app: express.Application) {
     bodyParser.raw({ type: [ "application/json"] }),
     handleUpdateReference
   );
+  app.post(
+    "/api/queue/register",
+    bodyParser.raw({ type: [ "application/json"] }),
+    handleQueueRegister
+  );
+  app.post(
+    "/api/queue/next",
+    bodyParser.raw({ type: [ "application/json"] }),
+    handleQueueNext
+  );
+  app.post(
+    "/api/queue/renew",
+    bodyParser.raw({ type: [ "application/json"] }),
+    handleQueueRenew
+  );
+  app.post(
+    "/api/queue/abandon",
+    bodyParser.raw({ type: [ "application/json"] }),
+    handleQueueAbandon
+  );
 }
 
 
@@ -100,7 +124,13 @@ function handleApi(req: express.Request, res: express.Response) {
     },
     {
       path: "/api/test-records",
-      description: "Returns all of the tests results as a JSON object"
+      description: `Returns all of the tests results as a JSON object. The optional query
+        parameters 'group' and 'hardware' only return the records for that group or
+        hardware, and 'since' only returns test results newer than the provided
+        timestamp. If 'limit' or 'cursor' is provided, the results are returned in pages
+        of at most 'limit' records as an object with the 'records' of the page and the
+        'next' cursor, which has to be passed as the 'cursor' to request the next page.
+        'next' is null on the last page`
     },
     {
       path: "/api/diff-threshold",
@@ -119,7 +149,26 @@ function handleApi(req: express.Request, res: express.Response) {
         server. The body of message must contain a 'runnerID', 'hardware', 'group',
         'name', 'timestamp', 'timing', and 'commitHash'. The 'runnerID' must be one of the
         allowed runners setup for this server. Furthermore, there needs to be the
-        candidate file as a multipart encoded file`
+        candidate file as a multipart encoded file. Submitting the same 'group', 'name',
+        'hardware', and 'timestamp' again is accepted but does not change the results.
+        The optional 'pixelHash' is the SHA-256 of the string '{width}x{height}' and a
+        newline followed by the image's 8-bit RGBA pixel values. If an image with the
+        same hash was submitted for the test before, the image is not decoded again. The
+        optional 'nErrors' is the number of non-empty lines in the log, which otherwise is
+        calculated from the submitted log. The optional 'phases' is a JSON object with the
+        number of seconds spent in the individual phases of the test run. The optional
+        'test' is the 'group/name' of the test that took the image if the test took
+        multiple images. The optional 'run' is the name of the work queue run that the
+        test was leased from, which finishes the test in that run. The optional
+        'stability' is a JSON object with the number of 'captures' that were taken of the
+        final state of the test, how many of them were 'differing' from the first, and
+        their 'maxError'. The optional 'failure'
+        is the reason why the test failed before the image was taken, in which case no
+        candidate file is needed and the images of the previous result are shown. The
+        candidate file can also be omitted if a 'pixelHash' is provided, which succeeds if
+        an image with the same hash was submitted for the test before and otherwise fails
+        with 409 and the list of accepted 'formats'. The optional 'format' of the
+        candidate file must be one of these formats and defaults to 'png'`
     },
     {
       path: "/api/run-test",
@@ -134,6 +183,40 @@ function handleApi(req: express.Request, res: express.Response) {
         as invalid and instead use the latest test as a reference instead. In addition to
         the admin token, the JSON object contained in the body must provide the
         'hardware', 'group', and 'name' for test whose reference should be invalidated.`
+    },
+    {
+      path: "/api/queue/register",
+      description: `(Requires runner) Registers a runner for a test run that is shared by
+        multiple runners with the same hardware. The JSON object in the body must contain
+        the 'runnerID', 'hardware', the name of the 'run', and the 'tests' the runner
+        wants to run as a list of 'group/name' strings. The tests of all runners that
+        register for the same run and hardware are added to a common queue. Returns the
+        number of tests that are 'remaining' and the 'leaseDuration' in seconds`
+    },
+    {
+      path: "/api/queue/next",
+      description: `(Requires runner) Leases the next test of a run to the runner. The
+        JSON object in the body must contain the 'runnerID', 'hardware', and 'run'.
+        Returns the 'test' as 'group/name', the 'lease', and when it 'expires'. If no
+        test is available, 'test' is null and 'remaining' is the number of tests that are
+        leased to other runners, which are returned to the queue if their lease expires.
+        A test is finished when a result for it is submitted through /api/submit-test
+        with the name of the 'run'`
+    },
+    {
+      path: "/api/queue/renew",
+      description: `(Requires runner) Extends a lease returned by /api/queue/next. The
+        JSON object in the body must contain the 'runnerID', 'hardware', 'run', and
+        'lease'. Returns when the lease 'expires', or 404 if the lease has expired or the
+        test has been finished`
+    },
+    {
+      path: "/api/queue/abandon",
+      description: `(Requires runner) Gives up a test leased through /api/queue/next whose
+        result could not be delivered, so that it is not handed out again. The JSON
+        object in the body must contain the 'runnerID', 'hardware', 'run', and 'lease'.
+        Returns the 'test' that was given up, or 404 if the lease has expired or the
+        test has been finished`
     }
   ]);
 }
@@ -190,6 +273,15 @@ async function handleResult(req: express.Request, res: express.Response) {
     }
   }
 
+  if (type != "log") {
+    // A test that failed before it ever took an image has no images to return
+    const data = loadTestRecord(`${basePath}/data.json`);
+    if (data.candidateImage == null) {
+      res.status(404).end();
+      return;
+    }
+  }
+
   let path = "";
   let isThumbnail = false;
   switch (type) {
@@ -262,6 +354,13 @@ async function handleCompare(req: express.Request, res: express.Response) {
   let img1;
   let img2;
   if (type == "reference") {
+    if (!hasReferenceImage(group, name, hardware1) ||
+        !hasReferenceImage(group, name, hardware2))
+    {
+      res.status(400).json({ error: "Missing reference image" });
+      return;
+    }
+
     img1 = referenceImage(group, name, hardware1);
     img2 = referenceImage(group, name, hardware2);
   }
@@ -294,11 +393,71 @@ async function handleCompare(req: express.Request, res: express.Response) {
 
 
 /**
- * Returns a full list of the test records to the API caller. This API call has no further
- * parameters.
+ * Returns the test records to the API caller. Without any query parameters, the full list
+ * of test records is returned. The optional query parameters are:
+ *  - `group`: Only the records of this group are returned
+ *  - `hardware`: Only the records of this hardware are returned
+ *  - `since`: Only the test results that are newer than this timestamp are returned
+ *  - `limit`: The maximum number of records that are returned in a single page
+ *  - `cursor`: The `next` value of the previous page
+ *
+ * If either `limit` or `cursor` is provided, the result is an object that contains the
+ * `records` of the requested page and the `next` cursor, which is `null` on the last
+ * page.
+ * The cursor is the key of the last record of a page, so records that are added while
+ * the pages are being requested do not cause other records to be skipped or repeated.
+ * Every query parameter can only be provided once.
  */
 function handleTestRecords(req: express.Request, res: express.Response) {
-  res.status(200).json(TestRecords);
+  const MaxPageSize = 1000;
+
+  const query: any = req.query;
+  if (Object.keys(query).length == 0) {
+    res.status(200).json(TestRecords);
+    return;
+  }
+
+  for (const [key, value] of Object.entries(query)) {
+    // Repeated parameters are parsed into arrays, which can not be used as filters
+    if (typeof value !== "string") {
+      res.status(400).json({ error: `Query parameter '${key}' must be a single value` });
+      return;
+    }
+  }
+
+  let since = undefined;
+  if (query.since != null) {
+    since = new Date(query.since);
+    if (isNaN(since.getTime())) {
+      res.status(400).json({ error: `Invalid timestamp ${query.since} provided` });
+      return;
+    }
+  }
+
+  if (query.limit == null && query.cursor == null) {
+    const all = findTestRecords(query.group, query.hardware, since, undefined, Infinity);
+    res.status(200).json(all.records);
+    return;
+  }
+
+  let limit = MaxPageSize;
+  if (query.limit != null) {
+    limit = Number(query.limit);
+    if (!Number.isInteger(limit) || limit <= 0) {
+      res.status(400).json({ error: `Invalid limit ${query.limit} provided` });
+      return;
+    }
+    limit = Math.min(limit, MaxPageSize);
+  }
+
+  let after = undefined;
+  if (query.cursor != null) {
+    after = Buffer.from(query.cursor, "base64url").toString();
+  }
+
+  const page = findTestRecords(query.group, query.hardware, since, after, limit);
+  const next = page.next != null ? Buffer.from(page.next).toString("base64url") : null;
+  res.status(200).json({ records: page.records, next: next });
 }
 
 
@@ -344,6 +503,10 @@ async function handleChangeThreshold(req: express.Request, res: express.Response
 
 
 
+/// The formats in which runners can submit candidate images. Images are compared and
+/// served as PNG images, so only lossless formats that are read as PNG are accepted
+const SubmitFormats = [ "png" ];
+
 /**
  * This API call is made when a new test result is submitted. The necessary test
  * information is passed along as a JSON-encoded body, and test-related files are included
@@ -358,8 +521,33 @@ async function handleChangeThreshold(req: express.Request, res: express.Response
  *   - `timing`: The number of seconds that it took to run the test
  *   - `commitHash`: The commit hash of the code that was used to generated the candidate
  *
+ * Optionally, the body can contain:
+ *   - `pixelHash`: The hash of the candidate image's pixels as computed by `pixelHash`
+ *   - `nErrors`: The number of non-empty lines in the log. If this value is not provided,
+ *                the lines of the submitted log are counted instead
+ *   - `phases`: A JSON-encoded object with the number of seconds that were spent in the
+ *               individual phases of the test run, such as starting OpenSpace
+ *   - `test`: The test that took the image in the form `group/name`, if it is different
+ *             from `group` and `name`
+ *   - `run`: The name of the work queue run from which the test was leased. The test is
+ *            finished in the queue of that run
+ *   - `stability`: A JSON-encoded object with the number of `captures` that the runner
+ *                  took of the state at the end of the test, how many of them were
+ *                  `differing` from the first capture, and their largest pixel error as
+ *                  `maxError`, which is `null` if the runner could not compute it
+ *   - `failure`: The reason why the test failed before the image was taken, for example
+ *                because OpenSpace crashed or did not finish in time. In this case, no
+ *                candidate file is submitted and the images of the previous result for
+ *                the test are shown instead, which requires that there is one
+ *   - `format`: The format of the candidate file, which has to be one of the
+ *               `SubmitFormats`. If this value is not provided, the file is a PNG image
+ *
  * For the files, the following are needed:
- *   - file: The generated candidate file
+ *   - file: The generated candidate file. It can be omitted if a `failure` is provided or
+ *           if a candidate image with the `pixelHash` has already been submitted for the
+ *           test. If the server does not have that image, it answers with 409 and the
+ *           list of accepted `formats`, after which the file has to be submitted
+ *   - log: The log of the test run
  */
 async function handleSubmitTest(req: express.Request, res: express.Response) {
   const runner = req.body.runnerID;
@@ -409,17 +597,80 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
     return;
   }
 
+  let nErrors = null;
+  if (req.body.nErrors != null) {
+    nErrors = Number(req.body.nErrors);
+    if (!Number.isInteger(nErrors) || nErrors < 0) {
+      res.status(400).json({ error: `Invalid value ${req.body.nErrors} for 'nErrors'` });
+      return;
+    }
+  }
+
+  // Tests that take multiple screenshots submit each of them with a different group and
+  // name than the test itself
+  const test = req.body.test ?? `${group}/${name}`;
+  const run = req.body.run;
+
+  let phases = undefined;
+  if (req.body.phases != null) {
+    let parsed = null;
+    try {
+      parsed = PhasesSchema.safeParse(JSON.parse(req.body.phases));
+    }
+    catch (e: any) {
+      // Invalid JSON is reported in the same way as an invalid object below
+    }
+    if (parsed == null || !parsed.success) {
+      res.status(400).json({ error: `Invalid value ${req.body.phases} for 'phases'` });
+      return;
+    }
+    phases = parsed.data;
+  }
+
+  let stability = undefined;
+  if (req.body.stability != null) {
+    let parsed = null;
+    try {
+      parsed = StabilitySchema.safeParse(JSON.parse(req.body.stability));
+    }
+    catch (e: any) {
+      // Invalid JSON is reported in the same way as an invalid object below
+    }
+    if (parsed == null || !parsed.success) {
+      res.status(400).json(
+        { error: `Invalid value ${req.body.stability} for 'stability'` }
+      );
+      return;
+    }
+    stability = parsed.data;
+  }
+
+  // Tests that failed before taking their image, for example because OpenSpace crashed,
+  // are submitted with the reason for the failure instead of a candidate file
+  const failure: string | undefined = req.body.failure ?? undefined;
+
   if (req.files == null) {
     res.status(400).json({ error: "Missing files" });
     return;
   }
 
+  const format = req.body.format ?? "png";
+  if (!SubmitFormats.includes(format)) {
+    res.status(415).json(
+      { error: `Unsupported format '${format}'`, formats: SubmitFormats }
+    );
+    return;
+  }
+
+  // Runners that know the hash of their image first submit the result without the image
+  // and only send the image if the server does not have it yet
   const files: any = req.files!;
-  if (files.file == null || files.file.length == 0) {
+  const hasFile = files.file != null && files.file.length > 0;
+  if (failure == null && !hasFile && req.body.pixelHash == null) {
     res.status(400).json({ error: "Missing field 'file'" });
     return;
   }
-  const file = files.file[0];
+  const file = failure == null && hasFile ? files.file[0] : null;
 
   if (files.log == null || files.log.length == 0) {
     res.status(400).json({ error: "Missing field 'log'" });
@@ -427,20 +678,58 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
   }
   const log = files.log[0];
 
+  // Runners resubmit results from their spool if they did not receive an answer, so the
+  // same test might arrive more than once. If the data file for the test already exists,
+  // an earlier submission was successful and there is nothing left to do
+  if (fs.existsSync(testDataPath(group, name, hardware, timeStamp))) {
+    const ts = timeStamp.toISOString();
+    printAudit(`Ignoring repeated result for (${group}/${name}/${hardware}/${ts})`);
+    if (run != null) {
+      finishTest(hardware, run, test);
+    }
+    res.status(200).end();
+    return;
+  }
 
+  if (failure != null) {
+    handleSubmitFailure(req, res, failure, log, phases, nErrors, test, run);
+    return;
+  }
 
-  try {
-    const png = PNG.sync.read(file.buffer);
-    if (png.width != Config.size.width || png.height != Config.size.height) {
-      const w = Config.size.width
-      const h = Config.size.height
-      res.status(400).json({ error: `Image has the wrong size. Expected (${w}, ${h})`});
+
+
+  // The runner can provide the hash of the image's pixels. If an image with the same
+  // pixels has been submitted for this test before, the image does not have to be decoded
+  // as it is already known to be valid
+  let hash: string | null = req.body.pixelHash ?? null;
+  let candidateMatch: Date | null = null;
+  if (hash) {
+    candidateMatch = findMatchingCandidateImage(group, name, hardware, hash);
+  }
+  if (!candidateMatch) {
+    if (file == null) {
+      res.status(409).json(
+        { error: "Image is not known, submit the file", formats: SubmitFormats }
+      );
+      return;
+    }
+
+    try {
+      const png = PNG.sync.read(file.buffer);
+      if (png.width != Config.size.width || png.height != Config.size.height) {
+        const w = Config.size.width
+        const h = Config.size.height
+        res.status(400).json({ error: `Image has the wrong size. Expected (${w}, ${h})`});
+        return;
+      }
+
+      hash = pixelHash(png);
+      candidateMatch = findMatchingCandidateImage(group, name, hardware, hash);
+    }
+    catch (e: any) {
+      res.status(400).json({ error: `Error loading image: ${e}`});
       return;
     }
-  }
-  catch (e: any) {
-    res.status(400).json({ error: `Error loading image: ${e}`});
-    return;
   }
 
 
@@ -456,7 +745,9 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
   const logPath = logFile(group, name, hardware, timeStamp);
   let logContent: string = log.buffer.toString();
   logContent = logContent.split("\n").filter(line => line.trim() !== "").join("\n");
-  const nLogLines = logContent.split("\n").length;
+  // The runner counts the lines while capturing the log, which includes the lines that it
+  // did not send as the log was too long. Older runners don't send this value
+  const nLogLines = nErrors != null ? nErrors : logContent.split("\n").length;
   fs.writeFileSync(logPath, logContent);
 
 
@@ -464,8 +755,14 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
     printAudit("  No reference image found");
     // We are either the first, or someone has marked the previous reference as not valid
     const p = updateReferencePointer(group, name, hardware, timeStamp);
-    // Write the current candidate image as the reference image
-    fs.writeFileSync(p, file.buffer);
+    // Write the current candidate image as the reference image, which might be an image
+    // that was submitted before if the runner did not send it again
+    if (file != null) {
+      fs.writeFileSync(p, file.buffer);
+    }
+    else {
+      fs.copyFileSync(candidateImage(group, name, hardware, candidateMatch!), p);
+    }
     createThumbnail(p);
   }
 
@@ -473,40 +770,59 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
   let candidate = candidateImage(group, name, hardware, timeStamp);
   let difference = differenceImage(group, name, hardware, timeStamp);
 
-  fs.writeFileSync(candidate, file.buffer);
-
   // Check if a previous test has already created this file. If that is the case, we don't
   // have to store it a second time
-  const candidateMatch = findMatchingCandidateImage(group, name, hardware, candidate);
   if (candidateMatch) {
-    // The candidate image we have received already exists, so we can remove the new one
-    fs.unlinkSync(candidate);
-    // and use the old one instead
+    // The candidate image we have received already exists, so we use the old one instead
     candidate = candidateImage(group, name, hardware, candidateMatch);
   }
   else {
+    fs.writeFileSync(candidate, file.buffer);
     // The candidate image is new and thus doesn't have a thumbnail yet
     createThumbnail(candidate);
+    storePixelHash("candidate", group, name, hardware, timeStamp, p, hash!);
   }
 
-  const nPixels = await saveComparisonImage(reference, candidate, difference);
-  if (nPixels == null) {
-    // The image comparison has failed, which means that the candidate image had the wrong
-    // size
-    res.status(400).json(
-      { error: "Could not compare images. Candidate image has wrong size" }
-    );
-    return;
+  // If the same candidate image has already been compared against the current reference
+  // image, the result of that comparison can be reused
+  const previous = candidateMatch ?
+    findComparison(group, name, hardware, candidateMatch, path.basename(reference)) :
+    null;
+
+  let nPixels: number | null = null;
+  let differenceMatch: Date | null = null;
+  if (previous) {
+    printAudit("  Reusing previous comparison");
+    nPixels = previous.pixelError;
+    differenceMatch = previous.differenceImage ?? null;
+  }
+  else {
+    nPixels = await saveComparisonImage(reference, candidate, difference);
+    if (nPixels == null) {
+      // The image comparison has failed, which means that the candidate image had the
+      // wrong size
+      res.status(400).json(
+        { error: "Could not compare images. Candidate image has wrong size" }
+      );
+      return;
+    }
+
+    const diffHash = pixelHash(PNG.sync.read(fs.readFileSync(difference)));
+    differenceMatch = findMatchingDifferenceImage(group, name, hardware, diffHash);
+    if (differenceMatch) {
+      // The difference image we calculated already existed, so we can remove this one.
+      // The `saveComparisonImage` will also generate a thumbnail already, so we have to
+      // delete that file, too
+      fs.unlinkSync(difference);
+      fs.unlinkSync(thumbnailForImage(difference));
+    }
+    else {
+      storePixelHash("difference", group, name, hardware, timeStamp, p, diffHash);
+    }
   }
 
-  const differenceMatch = findMatchingDifferenceImage(group, name, hardware, difference);
   if (differenceMatch) {
-    // The difference image we calculated already existed, so we can remove this one. The
-    // `saveComparisonImage` will also generate a thumbnail already, so we have to delete
-    // that file, too
-    fs.unlinkSync(difference);
-    fs.unlinkSync(thumbnailForImage(difference));
-    // and use the old one instead
+    // Use the existing difference image instead
     difference = differenceImage(group, name, hardware, differenceMatch);
   }
 
@@ -516,6 +832,8 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
     timeStamp: timeStamp,
     timing: Number(timing),
     nErrors: nLogLines,
+    phases: phases,
+    stability: stability,
     commitHash: commitHash,
     referenceImage: path.basename(reference),
     candidateImage: candidateMatch ? candidateMatch : timeStamp,
@@ -524,6 +842,82 @@ async function handleSubmitTest(req: express.Request, res: express.Response) {
 
   saveTestData(testData, testDataPath(group, name, hardware, timeStamp));
   addTestData(group, name, hardware, testData);
+  if (run != null) {
+    finishTest(hardware, run, test);
+  }
+  res.status(200).end();
+}
+
+
+
+/**
+ * Stores the result of a test that failed before it took its image, which is part of the
+ * `/api/submit-test` call. As there is no candidate image, the result refers to the
+ * candidate and difference images of the previous result for the same test and is marked
+ * with the maximum pixel error. If the test has never been run successfully before or has
+ * no reference image, the result is stored without any images. The fields of the request have already been validated by
+ * `handleSubmitTest`.
+ *
+ * @param req The request of the `/api/submit-test` call
+ * @param res The response of the `/api/submit-test` call
+ * @param failure The reason why the test failed
+ * @param log The submitted log file of the test run
+ * @param phases The number of seconds spent in the phases of the test run, if provided
+ * @param nErrors The number of non-empty lines in the log, if provided
+ * @param test The test in the form `group/name` that is finished in the work queue
+ * @param run The name of the work queue run from which the test was leased, if any
+ */
+function handleSubmitFailure(req: express.Request, res: express.Response,
+                             failure: string, log: any,
+                             phases: Record<string, number> | undefined,
+                             nErrors: number | null, test: string,
+                             run: string | undefined)
+{
+  const hardware = req.body.hardware;
+  const group = req.body.group;
+  const name = req.body.name;
+  const timeStamp = new Date(req.body.timestamp);
+
+  const latest = latestTestPath(group, name, hardware);
+  const hasPrevious = latest != null && hasReferenceImage(group, name, hardware);
+  const previous = hasPrevious ? loadTestRecord(`${latest}/data.json`) : null;
+
+  printAudit(
+    `Submitting failure for (${group}/${name}/${hardware}/${timeStamp.toISOString()})`
+  );
+  printAudit(`  ${failure}`);
+
+  const p = testPath(group, name, hardware, timeStamp);
+  if (!fs.existsSync(p)) {
+    fs.mkdirSync(p, { recursive: true });
+  }
+
+  let logContent: string = log.buffer.toString();
+  logContent = logContent.split("\n").filter(line => line.trim() !== "").join("\n");
+  const nLogLines = nErrors != null ? nErrors : logContent.split("\n").length;
+  fs.writeFileSync(logFile(group, name, hardware, timeStamp), logContent);
+
+  const testData: TestData = {
+    pixelError: 1,
+    timeStamp: timeStamp,
+    timing: Number(req.body.timing),
+    nErrors: nLogLines,
+    phases: phases,
+    failure: failure,
+    // The commit is not known if OpenSpace failed while starting up
+    commitHash: req.body.commitHash != "" ? req.body.commitHash : "unknown"
+  };
+  if (previous != null && previous.candidateImage != null) {
+    testData.referenceImage = path.basename(referenceImage(group, name, hardware));
+    testData.candidateImage = previous.candidateImage;
+    testData.differenceImage = previous.differenceImage;
+  }
+
+  saveTestData(testData, testDataPath(group, name, hardware, timeStamp));
+  addTestData(group, name, hardware, testData);
+  if (run != null) {
+    finishTest(hardware, run, test);
+  }
   res.status(200).end();
 }
 
@@ -657,6 +1051,10 @@ async function handleUpdateReference(req: express.Request, res: express.Response
 
   const dataPath = testDataPath(group, name, hardware);
   const data: TestData = JSON.parse(fs.readFileSync(dataPath).toString());
+  if (data.candidateImage == null) {
+    res.status(400).json({ error: "Latest test has no image to use as reference" });
+    return;
+  }
 
   // Get the new file name for the reference image. First get the old reference image,
   // extract the folder name from it, and create a new file name based on the timestamp
@@ -677,6 +1075,8 @@ async function handleUpdateReference(req: express.Request, res: express.Response
   // out of date
   const difference = differenceImage(group, name, hardware, new Date(data.timeStamp));
   const diff = await saveComparisonImage(newReference, candidate, difference);
+  // The difference image has changed, so its pixel hash is computed again on reload
+  removePixelHash("difference", path.dirname(difference));
 
   // The diff cannot be `null` as `newReference` and `candidate` are the same image
   data.pixelError = diff!;
@@ -684,3 +1084,154 @@ async function handleUpdateReference(req: express.Request, res: express.Response
   saveTestData(data, testDataPath(group, name, hardware, new Date(data.timeStamp)));
   reloadTestResults();
 }
+
+
+
+/**
+ * Parses the JSON body of a work queue request and verifies the fields that are common to
+ * all of them. If the body is invalid, the error is sent as the response and `null` is
+ * returned.
+ *
+ * @param req The request whose body should be parsed
+ * @param res The response to which an error is sent
+ * @returns The parsed body or `null` if it was invalid
+ */
+function parseQueueRequest(req: express.Request, res: express.Response): any {
+  let body = null;
+  try {
+    body = JSON.parse(req.body);
+  }
+  catch (e: any) {
+    res.status(400).json({ error: `Invalid JSON: ${e}` });
+    return null;
+  }
+
+  if (body.runnerID == null) {
+    res.status(400).json({ error: "Missing key 'runnerID'" });
+    return null;
+  }
+  if (!Config.runners.includes(body.runnerID)) {
+    res.status(401).end();
+    return null;
+  }
+
+  if (body.hardware == null) {
+    res.status(400).json({ error: "Missing key 'hardware'" });
+    return null;
+  }
+
+  if (body.run == null) {
+    res.status(400).json({ error: "Missing key 'run'" });
+    return null;
+  }
+
+  return body;
+}
+
+
+
+/**
+ * Registers a runner for a test run that is shared with other runners of the same
+ * hardware. The payload of this call must be a JSON object with the following values:
+ *   - `runnerID`: One of the allowed runners that are provided in the configuration file
+ *   - `hardware`: The hardware of the runner
+ *   - `run`: The name of the test run, which is the same for all participating runners
+ *   - `tests`: The list of tests that the runner wants to run as `group/name` strings
+ */
+function handleQueueRegister(req: express.Request, res: express.Response) {
+  const body = parseQueueRequest(req, res);
+  if (body == null) {
+    return;
+  }
+
+  const tests = body.tests;
+  if (!Array.isArray(tests) || !tests.every((t) => typeof t === "string")) {
+    res.status(400).json({ error: "Key 'tests' must be a list of strings" });
+    return;
+  }
+
+  const remaining = registerRunner(body.runnerID, body.hardware, body.run, tests);
+  res.status(200).json({ remaining: remaining, leaseDuration: LeaseDuration });
+}
+
+
+
+/**
+ * Leases the next test of a test run to a runner. The payload of this call must be a JSON
+ * object with the following values:
+ *   - `runnerID`: One of the allowed runners that are provided in the configuration file
+ *   - `hardware`: The hardware of the runner
+ *   - `run`: The name of the test run for which the runner has registered
+ */
+function handleQueueNext(req: express.Request, res: express.Response) {
+  const body = parseQueueRequest(req, res);
+  if (body == null) {
+    return;
+  }
+
+  const next = leaseTest(body.runnerID, body.hardware, body.run);
+  if (next == null) {
+    res.status(404).json({ error: `No test run '${body.run}' for '${body.hardware}'` });
+    return;
+  }
+  res.status(200).json(next);
+}
+
+
+
+/**
+ * Renews the lease of a test that was returned from the next API call. The payload of
+ * this call must be a JSON object with the following values:
+ *   - `runnerID`: One of the allowed runners that are provided in the configuration file
+ *   - `hardware`: The hardware of the runner
+ *   - `run`: The name of the test run for which the runner has registered
+ *   - `lease`: The lease that was returned when the test was leased
+ */
+function handleQueueRenew(req: express.Request, res: express.Response) {
+  const body = parseQueueRequest(req, res);
+  if (body == null) {
+    return;
+  }
+
+  if (body.lease == null) {
+    res.status(400).json({ error: "Missing key 'lease'" });
+    return;
+  }
+
+  const expires = renewLease(body.runnerID, body.hardware, body.run, body.lease);
+  if (expires == null) {
+    res.status(404).json({ error: `Lease '${body.lease}' is not valid anymore` });
+    return;
+  }
+  res.status(200).json({ expires: expires });
+}
+
+
+
+/**
+ * Gives up a test that was returned from the next API call, because the runner holding
+ * its lease could not deliver the result. The payload of this call must be a JSON object
+ * with the following values:
+ *   - `runnerID`: One of the allowed runners that are provided in the configuration file
+ *   - `hardware`: The hardware of the runner
+ *   - `run`: The name of the test run for which the runner has registered
+ *   - `lease`: The lease that was returned when the test was leased
+ */
+function handleQueueAbandon(req: express.Request, res: express.Response) {
+  const body = parseQueueRequest(req, res);
+  if (body == null) {
+    return;
+  }
+
+  if (body.lease == null) {
+    res.status(400).json({ error: "Missing key 'lease'" });
+    return;
+  }
+
+  const test = abandonTest(body.runnerID, body.hardware, body.run, body.lease);
+  if (test == null) {
+    res.status(404).json({ error: `Lease '${body.lease}' is not valid anymore` });
+    return;
+  }
+  res.status(200).json({ test: test });
+}
@@ -24,7 +24,7 @@
 
 import { assert } from "./assert";
 import { Config } from "./configuration";
-import { imagesAreEqual } from "./image";
+import { findPixelHash } from "./pixelhash";
 import { loadTestRecord } from "./testrecords";
 import fs from "fs";
 import path from "path";
@@ -221,7 +221,9 @@ export function candidateImage(group: string, name: string, hardware: string,
   const path = testDataPath(group, name, hardware, timestamp);
   if (fs.existsSync(path)) {
     const data = loadTestRecord(path);
-    return `${testPath(group, name, hardware, data.candidateImage)}/candidate.png`;
+    // A failed test without any previous test has no image, so its path does not exist
+    const image = data.candidateImage ?? data.timeStamp;
+    return `${testPath(group, name, hardware, image)}/candidate.png`;
   }
   else {
     // The data path might not exist yet, if this is the first time the test is run
@@ -253,7 +255,9 @@ export function differenceImage(group: string, name: string, hardware: string,
   const path = testDataPath(group, name, hardware, timestamp);
   if (fs.existsSync(path)) {
     const data = loadTestRecord(path);
-    return `${testPath(group, name, hardware, data.differenceImage)}/difference.png`;
+    // A failed test without any previous test has no image, so its path does not exist
+    const image = data.differenceImage ?? data.timeStamp;
+    return `${testPath(group, name, hardware, image)}/difference.png`;
   }
   else {
     // The data path might not exist yet, if this is the first time the test is run
@@ -341,85 +345,43 @@ export function temporaryPath(): string {
 
 
 /**
- * Inspects all available candidate images for the test identified by `group`, `name`, and
- * `hardware` and checks if any of the candidate images are identical to the image
- * provided by `image`. If that is the case, the timestamp of the test in which the
- * already existing candidate image is located will be returned.
+ * Checks if any of the available candidate images for the test identified by `group`,
+ * `name`, and `hardware` has the same pixels as an image with the provided pixel `hash`.
+ * If that is the case, the timestamp of the test in which the already existing candidate
+ * image is located will be returned.
  *
  * @param group The name of the group for which to check all candidate images
  * @param name The name of the test for which to check all candidate images
  * @param hardware The hardware identifier of the test for which to check candidate images
- * @param image The path to the image for which we want to find a duplicate
+ * @param hash The pixel hash of the image for which we want to find a duplicate
  * @returns The timestamp of the test in which to find the already existing candidate
- *          file if a duplicate was found or `null` if the `image` does not have any
+ *          file if a duplicate was found or `null` if the image does not have any
  *          duplicates
  */
 export function findMatchingCandidateImage(group: string, name: string,
-                                           hardware: string, image: string): Date | null
+                                           hardware: string, hash: string): Date | null
 {
-  const base = `${Config.data}/tests/${hardware}/${group}/${name}`;
-  const runs = fs.readdirSync(base);
-  assert(runs.length > 0, `Could not find test folders for ${hardware}/${group}/${name}`);
-
-  for (const run of runs) {
-    const path = `${base}/${run}/candidate.png`;
-
-    // We don't want to compare the image with itself
-    if (path == image)  continue;
-
-    if (fs.existsSync(path)) {
-      const equal = imagesAreEqual(image, path);
-      if (equal) {
-        // We have found our winner
-        const data = loadTestRecord(`${base}/${run}/data.json`);
-        return data.timeStamp;
-      }
-    }
-  }
-
-  // If we get this far, we have tested all images and not found a match
-  return null;
+  return findPixelHash("candidate", group, name, hardware, hash);
 }
 
 
 
 /**
- * Inspects all available difference images for the test identified by `group`, `name`,
- * and `hardware` and checks if any of the difference images are identical to the image
- * provided by `image`. If that is the case, the timestamp of the test in which the
- * already existing difference image is located will be returned.
+ * Checks if any of the available difference images for the test identified by `group`,
+ * `name`, and `hardware` has the same pixels as an image with the provided pixel `hash`.
+ * If that is the case, the timestamp of the test in which the already existing difference
+ * image is located will be returned.
  *
  * @param group The name of the group for which to check all difference images
  * @param name The name of the test for which to check all difference images
  * @param hardware The hardware id of the test for which to check difference images
- * @param image The path to the image for which we want to find a duplicate
+ * @param hash The pixel hash of the image for which we want to find a duplicate
  * @returns The timestamp of the test in which to find the already existing difference
- *          file if a duplicate was found or `null` if the `image` does not have any
+ *          file if a duplicate was found or `null` if the image does not have any
  *          duplicates
  */
 export function findMatchingDifferenceImage(group: string, name: string,
-  hardware: string, image: string): Date | null
+                                            hardware: string, hash: string): Date | null
 {
-  const base = `${Config.data}/tests/${hardware}/${group}/${name}`;
-  const runs = fs.readdirSync(base);
-  assert(runs.length > 0, `Could not find test folders for ${hardware}/${group}/${name}`);
-
-  for (const run of runs) {
-    const path = `${base}/${run}/difference.png`;
-
-    // We don't want to compare the image with itself
-    if (path == image)  continue;
-
-    if (fs.existsSync(path)) {
-      const equal = imagesAreEqual(image, path);
-      if (equal) {
-        // We have found our winner
-        const data = loadTestRecord(`${base}/${run}/data.json`);
-        return data.timeStamp;
-      }
-    }
-  }
-
-  // If we get this far, we have tested all iamges and not found a match
-  return null;
+  return findPixelHash("difference", group, name, hardware, hash);
 }
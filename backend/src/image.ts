@@ -82,31 +82,6 @@ export function generateComparisonImage(reference: string,
 
 
 
-/**
- * Runs an image comparison to compare the `path1` image with the `path2` image and return
- * whether those two images are pixel-identical. Both images have to exist and be readable
- * PNG files.
- *
- * @param path1 The first image to test
- * @param path2 The second image to test
- * @returns `true` if `path1 == path2`, `false` otherwise
- */
-export function imagesAreEqual(path1: string, path2: string): boolean {
-  assert(fs.existsSync(path1), `No image ${path1}`);
-  assert(fs.existsSync(path2), `No image ${path2}`);
-
-  const i1 = PNG.sync.read(fs.readFileSync(path1));
-  const i2 = PNG.sync.read(fs.readFileSync(path2));
-  if (i1.width != i2.width || i1.height != i2.height) {
-    // The images are considered different if they have a difference resolution
-    return false;
-  }
-
-  const diff = pixelmatch(i1.data, i2.data, null, i1.width, i1.height, { threshold: 0 });
-  return diff == 0;
-}
-
-
 /**
  * Runs an image comparison to compare the `reference` image with the `candidate` image.
  * The result is stored in the `difference` image. Both the `reference` and `candidate`
@@ -0,0 +1,207 @@
+/*****************************************************************************************
+ *                                                                                       *
+ * OpenSpace Visual Testing                                                              *
+ *                                                                                       *
+ * Copyright (c) 2024                                                                    *
+ *                                                                                       *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this  *
+ * software and associated documentation files (the "Software"), to deal in the Software *
+ * without restriction, including without limitation the rights to use, copy, modify,    *
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to    *
+ * permit persons to whom the Software is furnished to do so, subject to the following   *
+ * conditions:                                                                           *
+ *                                                                                       *
+ * The above copyright notice and this permission notice shall be included in all copies *
+ * or substantial portions of the Software.                                              *
+ *                                                                                       *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,   *
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A         *
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT    *
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF  *
+ * CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE  *
+ * OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                         *
+ ****************************************************************************************/
+
+import { printAudit } from "./audit";
+import crypto from "crypto";
+import fs from "fs";
+import { PNG } from "pngjs";
+
+
+
+/// The kinds of images in a test run folder for which pixel hashes are kept
+export type PixelHashType = "candidate" | "difference";
+
+/// An in-memory index of the pixel hashes of all candidate and difference images. For
+/// each test and each type of image, it maps the hash of an image's pixels to the
+/// timestamp of the test run in whose folder the image is stored. The index is persisted
+/// as a `candidate.hash` and `difference.hash` file next to each image, from which it is
+/// recreated at startup
+let PixelHashes = new Map<string, Map<string, Date>>();
+
+
+
+/**
+ * Computes the hash of the pixels of the provided decoded image. The hash is the SHA-256
+ * of the image size in the form `{width}x{height}` and a newline, followed by the RGBA
+ * values of all pixels with 8 bits per channel. This does not depend on how the PNG file
+ * was encoded, so two files with identical pixels have the same hash. The runner computes
+ * the same hash before submitting an image.
+ *
+ * @param png The decoded image for which to calculate the hash
+ * @returns The hexadecimal representation of the hash
+ */
+export function pixelHash(png: PNG): string {
+  const hash = crypto.createHash("sha256");
+  hash.update(`${png.width}x${png.height}\n`);
+  hash.update(png.data);
+  return hash.digest("hex");
+}
+
+
+
+/**
+ * Returns the key under which the hashes of one type of image are stored for a test.
+ */
+function indexKey(type: PixelHashType, group: string, name: string,
+                  hardware: string): string
+{
+  return `${type}/${hardware}/${group}/${name}`;
+}
+
+
+
+/**
+ * Adds the `hash` of an image in the test run with the provided `timestamp` to the index.
+ * If an identical image exists in multiple test runs, the earliest one that was added is
+ * kept.
+ */
+function addToIndex(type: PixelHashType, group: string, name: string, hardware: string,
+                    timestamp: Date, hash: string)
+{
+  const key = indexKey(type, group, name, hardware);
+  if (!PixelHashes.has(key)) {
+    PixelHashes.set(key, new Map<string, Date>());
+  }
+  const hashes = PixelHashes.get(key)!;
+  if (!hashes.has(hash)) {
+    hashes.set(hash, timestamp);
+  }
+}
+
+
+
+/**
+ * Returns the timestamp of the test run that contains an image of the provided `type`
+ * whose pixels have the provided `hash` for the test identified by `group`, `name`, and
+ * `hardware`.
+ *
+ * @param type The type of image that is looked for
+ * @param group The name of the group of the test
+ * @param name The name of the test
+ * @param hardware The hardware of the test
+ * @param hash The pixel hash of the image as returned by `pixelHash`
+ * @returns The timestamp of the test run that contains a matching image or `null` if no
+ *          such image exists
+ */
+export function findPixelHash(type: PixelHashType, group: string, name: string,
+                              hardware: string, hash: string): Date | null
+{
+  const hashes = PixelHashes.get(indexKey(type, group, name, hardware));
+  return hashes?.get(hash) ?? null;
+}
+
+
+
+/**
+ * Stores the `hash` of the image of the provided `type` that is located in the test run
+ * folder `folder` and adds it to the index. If the folder already had a hash for this
+ * type of image, for example because the difference image was regenerated, the old hash
+ * is removed from the index.
+ *
+ * @param type The type of the image whose hash is stored
+ * @param group The name of the group of the test
+ * @param name The name of the test
+ * @param hardware The hardware of the test
+ * @param timestamp The timestamp of the test run
+ * @param folder The folder of the test run that contains the image
+ * @param hash The pixel hash of the image as returned by `pixelHash`
+ */
+export function storePixelHash(type: PixelHashType, group: string, name: string,
+                               hardware: string, timestamp: Date, folder: string,
+                               hash: string)
+{
+  const hashFile = `${folder}/${type}.hash`;
+  if (fs.existsSync(hashFile)) {
+    const previous = fs.readFileSync(hashFile).toString().trim();
+    const hashes = PixelHashes.get(indexKey(type, group, name, hardware));
+    if (hashes?.get(previous)?.getTime() == timestamp.getTime()) {
+      hashes!.delete(previous);
+    }
+  }
+
+  fs.writeFileSync(hashFile, hash);
+  addToIndex(type, group, name, hardware, timestamp, hash);
+}
+
+
+
+/**
+ * Adds the candidate and difference images in the test run folder `folder` to the index.
+ * If the pixel hash of an image has been stored before, it is read from disk. Otherwise
+ * the image is decoded once to compute the hash, which is then stored for the next time.
+ *
+ * @param group The name of the group of the test
+ * @param name The name of the test
+ * @param hardware The hardware of the test
+ * @param timestamp The timestamp of the test run
+ * @param folder The folder of the test run
+ */
+export function indexTestRun(group: string, name: string, hardware: string,
+                             timestamp: Date, folder: string)
+{
+  const types: PixelHashType[] = [ "candidate", "difference" ];
+  for (const type of types) {
+    const image = `${folder}/${type}.png`;
+    if (!fs.existsSync(image)) {
+      // Images that were identical to an image in an earlier run are not stored again
+      continue;
+    }
+
+    const hashFile = `${folder}/${type}.hash`;
+    if (fs.existsSync(hashFile)) {
+      const hash = fs.readFileSync(hashFile).toString().trim();
+      addToIndex(type, group, name, hardware, timestamp, hash);
+    }
+    else {
+      printAudit(`Computing pixel hash for ${image}`);
+      const hash = pixelHash(PNG.sync.read(fs.readFileSync(image)));
+      storePixelHash(type, group, name, hardware, timestamp, folder, hash);
+    }
+  }
+}
+
+
+
+/**
+ * Removes all entries from the pixel hash index. The hash files on disk are kept.
+ */
+export function clearPixelHashes() {
+  PixelHashes = new Map<string, Map<string, Date>>();
+}
+
+
+
+/**
+ * Removes the stored hash of the image of the provided `type` in the test run `folder`,
+ * which causes it to be computed again the next time the folder is indexed.
+ *
+ * @param type The type of the image whose hash is removed
+ * @param folder The folder of the test run
+ */
+export function removePixelHash(type: PixelHashType, folder: string) {
+  const hashFile = `${folder}/${type}.hash`;
+  if (fs.existsSync(hashFile)) {
+    fs.unlinkSync(hashFile);
+  }
+}
@@ -28,6 +28,7 @@ import { Config } from "./configuration";
 import { candidateImage, differenceImage, referenceImagePath,
   thumbnailForImage } from "./globals";
 import { createThumbnail, saveComparisonImage } from "./image";
+import { clearPixelHashes, indexTestRun, removePixelHash } from "./pixelhash";
 import fs from "fs";
 import { globSync } from "glob";
 import path from "path";
@@ -48,15 +49,26 @@ type TestRecord = {
 
 
 
+export const PhasesSchema = z.record(z.string(), z.number().nonnegative());
+
+export const StabilitySchema = z.object({
+  captures: z.number().int().min(2),
+  differing: z.number().int().nonnegative(),
+  maxError: z.number().min(0).max(1).nullable()
+});
+
 const TestDataSchema = z.object({
   pixelError: z.number().min(0).max(1),
   timeStamp: z.coerce.date(),
   timing: z.number().min(0),
-  nErrors: z.number().int().positive(),
+  nErrors: z.number().int().nonnegative(),
+  phases: z.optional(PhasesSchema),
+  stability: z.optional(StabilitySchema),
+  failure: z.optional(z.string()),
   commitHash: z.string().min(1),
-  referenceImage: z.string().min(1),
-  candidateImage: z.coerce.date(),
-  differenceImage: z.coerce.date()
+  referenceImage: z.optional(z.string().min(1)),
+  candidateImage: z.optional(z.coerce.date()),
+  differenceImage: z.optional(z.coerce.date())
 });
 
 
@@ -74,26 +86,66 @@ export type TestData = {
   /// The number of error lines in the log file
   nErrors: number;
 
+  /// The number of seconds spent in the individual phases of the test run, such as
+  /// starting OpenSpace or running the instructions of a specific type. This value is
+  /// only available if it was provided by the runner
+  phases?: Record<string, number> | undefined;
+
+  /// How often the state at the end of the test rendered differently when it was captured
+  /// repeatedly in the same run. `captures` is the number of images that were taken,
+  /// `differing` the number of them that differed from the first image, and `maxError`
+  /// the largest pixel error among them, if the runner could compute it. This value is
+  /// only available if the runner was asked to measure the stability of the test
+  stability?: {
+    captures: number;
+    differing: number;
+    maxError: number | null;
+  } | undefined;
+
+  /// The reason why the test did not run to completion, for example because OpenSpace
+  /// crashed or did not finish in time. A failed test has no images of its own, so the
+  /// images of the previous test are used and the pixel error is 1
+  failure?: string | undefined;
+
   /// The commit hash of the OpenSpace repository that was used to generate this image
   commitHash: string;
 
-  /// Path to the reference image that was used for this test
-  referenceImage: string;
+  /// Path to the reference image that was used for this test. Only a failed test that
+  /// has no previous test whose images could be used has no images
+  referenceImage?: string | undefined;
 
   /// The timestamp of the test whose candidate image that was used for this test
-  candidateImage: Date;
+  candidateImage?: Date | undefined;
 
   /// The timestamp for the test whose difference image that was used for this test
-  differenceImage: Date;
+  differenceImage?: Date | undefined;
 }
 
 
 
+/**
+ * A page of test records as returned by `findTestRecords`.
+ */
+export type TestRecordPage = {
+  /// The test records of this page
+  records: TestRecord[];
+
+  /// The key of the last record of this page, or `null` if this is the last page
+  next: string | null;
+};
+
+
+
 /// An in-memory data storage of test records. The array gets created at startup time by
 /// parsing the 'data' folder and continuously updated as new test data comes in. This
 /// array is not stored on disk, but instead recreated from files that are kept instead
 export let TestRecords: TestRecord[] = [];
 
+/// The test records together with their keys as returned by `testRecordKey`, sorted by
+/// these keys. It is created when the records are first requested in order and discarded
+/// whenever a new record is added, so that the keys are not computed for every request
+let SortedRecords: { key: string; record: TestRecord }[] | null = null;
+
 
 
 /**
@@ -128,6 +180,145 @@ export function saveTestData(data: TestData, path: string) {
 
 
 
+/**
+ * Returns the key that identifies a test record and by which the records are ordered
+ * when they are requested in pages. The key is a JSON array of the group, name, and
+ * hardware of the record, which also makes it usable as a cursor.
+ *
+ * @param group The group of the test record
+ * @param name The name of the test record
+ * @param hardware The hardware of the test record
+ * @returns The key of the test record
+ */
+export function testRecordKey(group: string, name: string, hardware: string): string {
+  return JSON.stringify([group, name, hardware]);
+}
+
+
+
+/**
+ * Returns the test records sorted by their keys as returned by `testRecordKey`. The
+ * sorted list is kept until a new record is added.
+ *
+ * @returns The list of all test records together with their keys
+ */
+function sortedTestRecords(): { key: string; record: TestRecord }[] {
+  if (SortedRecords == null) {
+    SortedRecords = TestRecords.map(record => ({
+      key: testRecordKey(record.group, record.name, record.hardware),
+      record: record
+    }));
+    SortedRecords.sort((a, b) => a.key < b.key ? -1 : (a.key > b.key ? 1 : 0));
+  }
+  return SortedRecords;
+}
+
+
+
+/**
+ * Returns the test records that match all of the provided filters, ordered by their
+ * keys as returned by `testRecordKey`. All filters are optional. If `since` is provided,
+ * only the test data that was generated after that time is included in the returned
+ * records and records without any such data are left out. Only the records whose key is
+ * larger than `after` are returned, of which at most `limit` are returned. The returned
+ * records are copies, so modifying them does not change the stored records.
+ *
+ * @param group If provided, only the records of this group are returned
+ * @param hardware If provided, only the records of this hardware are returned
+ * @param since If provided, only the test data newer than this time is returned
+ * @param after If provided, only the records with a larger key are returned
+ * @param limit The maximum number of records that are returned
+ * @returns The page of matching test records
+ */
+export function findTestRecords(group: string | undefined, hardware: string | undefined,
+                                since: Date | undefined, after: string | undefined,
+                                limit: number): TestRecordPage
+{
+  const sorted = sortedTestRecords();
+
+  // Binary search for the first record whose key is larger than `after`
+  let start = 0;
+  if (after != null) {
+    let end = sorted.length;
+    while (start < end) {
+      const middle = Math.floor((start + end) / 2);
+      if (sorted[middle]!.key <= after) {
+        start = middle + 1;
+      }
+      else {
+        end = middle;
+      }
+    }
+  }
+
+  let records: TestRecord[] = [];
+  let last: string | null = null;
+  for (let i = start; i < sorted.length; i++) {
+    const { key, record } = sorted[i]!;
+    if ((group && record.group != group) || (hardware && record.hardware != hardware)) {
+      continue;
+    }
+
+    let data = record.data;
+    if (since) {
+      data = data.filter(d => d.timeStamp.getTime() > since.getTime()) as [ TestData ];
+      if (data.length == 0) {
+        continue;
+      }
+    }
+
+    if (records.length == limit) {
+      // There is at least one more matching record after the last returned one
+      return { records: records, next: last };
+    }
+    records.push({ ...record, data: data });
+    last = key;
+  }
+
+  return { records: records, next: null };
+}
+
+
+
+/**
+ * Finds a previous test run of the test identified by `group`, `name`, and `hardware`
+ * that used the candidate image of the test run at `candidate` and was compared against
+ * the `reference` image. As the comparison only depends on these two images, its result
+ * can be reused for a new test run with the same candidate image.
+ *
+ * @param group The group of the test
+ * @param name The name of the test
+ * @param hardware The hardware of the test
+ * @param candidate The timestamp of the test run whose candidate image was used
+ * @param reference The name of the reference image that was compared against
+ * @returns The test data of the matching test run or `null` if there is none
+ */
+export function findComparison(group: string, name: string, hardware: string,
+                               candidate: Date, reference: string): TestData | null
+{
+  for (const record of TestRecords) {
+    if (record.group != group || record.name != name || record.hardware != hardware) {
+      continue;
+    }
+
+    for (const data of record.data) {
+      // Failed tests show the images of an earlier test, but were never compared
+      if (data.failure != null || data.candidateImage == null) {
+        continue;
+      }
+
+      if (data.candidateImage.getTime() == candidate.getTime() &&
+          data.referenceImage == reference)
+      {
+        return data;
+      }
+    }
+  }
+  return null;
+}
+
+
+
 /**
  * Add a new test data to the internal list of records that are being kept. If the
  * `group`, `name`, or `hardware` did not exist before in the record, they will be created
@@ -156,6 +347,7 @@ export function addTestData(group: string, name: string, hardware: string, data:
 
   // If we get here, it's a new record
   printAudit("Creating new test record");
+  SortedRecords = null;
   TestRecords.push({
     group: group,
     name: name,
@@ -199,6 +391,10 @@ export function verifyDataFolder() {
           assert(fs.existsSync(`${p}/data.json`), `Missing 'data.json' in ${p}`);
 
           const data = loadTestRecord(`${p}/data.json`);
+          if (data.candidateImage == null || data.differenceImage == null) {
+            // A failed test without a previous test has no images to verify
+            continue;
+          }
 
           // Verify reference image existence
           const reference = data.referenceImage;
@@ -263,6 +459,7 @@ export function loadTestResults() {
 
           const data = loadTestRecord(`${p}/data.json`);
           addTestData(group, name, hardware, data);
+          indexTestRun(group, name, hardware, data.timeStamp, p);
         }
       }
     }
@@ -293,6 +490,11 @@ export async function regenerateTestResults() {
           const p = `${base}/${group}/${name}/${run}`;
 
           const data = loadTestRecord(`${p}/data.json`);
+          if (data.failure != null) {
+            // Failed tests have no images of their own and always have the maximum error
+            continue;
+          }
+
           const folder = referenceImagePath(group, name, hardware);
           const diff = await saveComparisonImage(
             `${folder}/${data.referenceImage}`,
@@ -307,6 +509,9 @@ export async function regenerateTestResults() {
           // And regenerate it
           createThumbnail(`${p}/difference.png`);
 
+          // The pixel hash of the new difference image is computed when reloading
+          removePixelHash("difference", p);
+
           data.pixelError = diff!;
           saveTestData(data, `${p}/data.json`);
         }
@@ -326,5 +531,7 @@ export async function regenerateTestResults() {
  */
 export function reloadTestResults() {
   TestRecords = [];
+  SortedRecords = null;
+  clearPixelHashes();
   loadTestResults();
 }
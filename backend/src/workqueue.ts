@@ -0,0 +1,266 @@
+/*****************************************************************************************
+ *                                                                                       *
+ * OpenSpace Visual Testing                                                              *
+ *                                                                                       *
+ * Copyright (c) 2024                                                                    *
+ *                                                                                       *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy of this  *
+ * software and associated documentation files (the "Software"), to deal in the Software *
+ * without restriction, including without limitation the rights to use, copy, modify,    *
+ * merge, publish, distribute, sublicense, and/or sell copies of the Software, and to    *
+ * permit persons to whom the Software is furnished to do so, subject to the following   *
+ * conditions:                                                                           *
+ *                                                                                       *
+ * The above copyright notice and this permission notice shall be included in all copies *
+ * or substantial portions of the Software.                                              *
+ *                                                                                       *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,   *
+ * INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A         *
+ * PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT    *
+ * HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF  *
+ * CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE  *
+ * OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                         *
+ ****************************************************************************************/
+
+import { printAudit } from "./audit";
+import crypto from "crypto";
+
+
+
+/// The number of seconds for which a test is leased to a runner. A runner has to renew
+/// its lease before it expires, otherwise the test is given to the next runner asking
+export const LeaseDuration = 5 * 60;
+
+/// The number of times a test is leased before it is given up. A test whose lease keeps
+/// expiring, for example because it crashes OpenSpace, would otherwise block the queue
+const MaxAttempts = 3;
+
+/// The number of seconds after the last request for a queue after which it is removed
+const QueueLifetime = 24 * 60 * 60;
+
+
+
+/**
+ * The state of a single test in a work queue.
+ */
+type WorkItem = {
+  /// The test, in the form `group/name`
+  test: string;
+
+  /// The number of times the test has been leased to a runner
+  attempts: number;
+
+  /// The lease of the runner that is currently running the test, or `null` if no runner
+  /// is running the test
+  lease: string | null;
+
+  /// The runner that currently holds the lease
+  runner: string | null;
+
+  /// The time at which the current lease expires
+  expires: Date | null;
+
+  /// Whether a result for the test has been submitted
+  done: boolean;
+};
+
+/**
+ * The tests of a single test run that are distributed among all runners of the same
+ * hardware that take part in the run.
+ */
+type WorkQueue = {
+  /// The hardware of the runners that take part in the run
+  hardware: string;
+
+  /// The tests of the run in the order in which they are handed out
+  items: WorkItem[];
+
+  /// The time at which the queue was last used by any runner
+  lastUsed: Date;
+};
+
+/// All work queues, keyed by the hardware and the name of the run. The queues are only
+/// kept in memory, as the runners register their tests again if the server restarts
+let WorkQueues = new Map<string, WorkQueue>();
+
+
+
+/**
+ * Returns the queue for the provided `hardware` and `run`, or `undefined` if no runner
+ * has registered for the run yet. Expired leases of the queue are returned to the queue.
+ */
+function findQueue(hardware: string, run: string): WorkQueue | undefined {
+  const now = new Date();
+  for (const [key, queue] of WorkQueues) {
+    if (now.getTime() - queue.lastUsed.getTime() > QueueLifetime * 1000) {
+      WorkQueues.delete(key);
+    }
+  }
+
+  const queue = WorkQueues.get(`${hardware}/${run}`);
+  if (queue == null) {
+    return undefined;
+  }
+
+  queue.lastUsed = now;
+  for (const item of queue.items) {
+    if (item.lease != null && item.expires! < now) {
+      printAudit(`Lease of ${item.runner} for ${item.test} expired`);
+      item.lease = null;
+      item.runner = null;
+      item.expires = null;
+    }
+  }
+  return queue;
+}
+
+
+
+/**
+ * Registers a runner for the test run `run` on the provided `hardware`. The first runner
+ * that registers for a run creates its queue, and the `tests` of all runners are added
+ * to it if they are not already part of it. This means that all runners that take part
+ * in the same run can register with the tests they have found.
+ *
+ * @param runner The identifier of the runner that registers for the run
+ * @param hardware The hardware of the runner
+ * @param run The name of the test run, which is shared by all runners taking part in it
+ * @param tests The list of tests in the form `group/name` that should be run
+ * @returns The number of tests in the queue that have not been finished yet
+ */
+export function registerRunner(runner: string, hardware: string, run: string,
+                               tests: string[]): number
+{
+  let queue = findQueue(hardware, run);
+  if (queue == null) {
+    queue = { hardware: hardware, items: [], lastUsed: new Date() };
+    WorkQueues.set(`${hardware}/${run}`, queue);
+    printAudit(`Creating work queue for ${hardware}, ${run}`);
+  }
+
+  const known = new Set(queue.items.map((item) => item.test));
+  for (const test of tests) {
+    if (!known.has(test)) {
+      queue.items.push({
+        test: test, attempts: 0, lease: null, runner: null, expires: null, done: false
+      });
+      known.add(test);
+    }
+  }
+  printAudit(`Runner ${runner} registered ${tests.length} tests for ${hardware}, ${run}`);
+  return queue.items.filter((item) => !item.done).length;
+}
+
+
+
+/**
+ * Leases the next test of the run `run` on the provided `hardware` to the `runner`. The
+ * result contains the leased `test`, the `lease` that has to be used to renew the lease,
+ * and the time at which it `expires`. If there is no test to lease, `test` is `null` and
+ * `remaining` contains the number of tests that are leased to other runners. Their tests
+ * will be returned to the queue if their leases expire, so the runner should ask again
+ * later until `remaining` is 0.
+ *
+ * @param runner The identifier of the runner that wants to run the next test
+ * @param hardware The hardware of the runner
+ * @param run The name of the test run
+ * @returns The leased test, or `undefined` if the run does not exist
+ */
+export function leaseTest(runner: string, hardware: string, run: string) {
+  const queue = findQueue(hardware, run);
+  if (queue == null) {
+    return undefined;
+  }
+
+  const item = queue.items.find((item) =>
+    !item.done && item.lease == null && item.attempts < MaxAttempts
+  );
+  if (item == null) {
+    const remaining = queue.items.filter((item) => !item.done && item.lease != null);
+    return { test: null, remaining: remaining.length };
+  }
+
+  item.attempts += 1;
+  item.lease = crypto.randomUUID();
+  item.runner = runner;
+  item.expires = new Date(Date.now() + LeaseDuration * 1000);
+  return { test: item.test, lease: item.lease, expires: item.expires };
+}
+
+
+
+/**
+ * Extends the lease of a test for another `LeaseDuration` seconds.
+ *
+ * @param runner The identifier of the runner that holds the lease
+ * @param hardware The hardware of the runner
+ * @param run The name of the test run
+ * @param lease The lease that was returned by `leaseTest`
+ * @returns The time at which the lease now expires, or `undefined` if the lease has
+ *          expired or the test has been finished
+ */
+export function renewLease(runner: string, hardware: string, run: string,
+                           lease: string): Date | undefined
+{
+  const queue = findQueue(hardware, run);
+  const item = queue?.items.find((item) => item.lease == lease && item.runner == runner);
+  if (item == null) {
+    return undefined;
+  }
+
+  item.expires = new Date(Date.now() + LeaseDuration * 1000);
+  return item.expires;
+}
+
+
+
+/**
+ * Marks the `test` as finished in the queue of the provided `hardware` and `run`. This is
+ * called whenever a result for the test is submitted as part of the run, independent of
+ * which runner submitted it or whether it still holds the lease.
+ *
+ * @param hardware The hardware for which the result was submitted
+ * @param run The name of the test run for which the result was submitted
+ * @param test The test for which the result was submitted in the form `group/name`
+ */
+export function finishTest(hardware: string, run: string, test: string) {
+  const queue = WorkQueues.get(`${hardware}/${run}`);
+  const item = queue?.items.find((item) => item.test == test);
+  if (item != null) {
+    item.done = true;
+    item.lease = null;
+    item.runner = null;
+    item.expires = null;
+  }
+}
+
+
+
+/**
+ * Gives up a test whose result the runner holding the `lease` could not deliver, for
+ * example because the server refused it. The test is marked as finished, as running it
+ * again on another runner would not lead to a different result.
+ *
+ * @param runner The identifier of the runner that holds the lease
+ * @param hardware The hardware of the runner
+ * @param run The name of the test run
+ * @param lease The lease that was returned by `leaseTest`
+ * @returns The test that was given up, or `undefined` if the lease has expired or the
+ *          test has been finished
+ */
+export function abandonTest(runner: string, hardware: string, run: string,
+                            lease: string): string | undefined
+{
+  const queue = findQueue(hardware, run);
+  const item = queue?.items.find((item) => item.lease == lease && item.runner == runner);
+  if (item == null) {
+    return undefined;
+  }
+
+  printAudit(`Runner ${runner} abandoned ${item.test} for ${hardware}, ${run}`);
+  item.done = true;
+  item.lease = null;
+  item.runner = null;
+  item.expires = null;
+  return item.test;
+}
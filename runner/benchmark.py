@@ -0,0 +1,391 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+import zlib
+from testsuite.constants import test_base_dir
+from testsuite.openspace import run_parallel, run_single_test, run_test_session
+from testsuite.image import Png_Signature, png_chunk
+from testsuite.spool import Spool
+from testsuite.test import Screenshot, TestResult
+from testsuite.trace import tracer
+from testsuite.upload import Uploader
+from testsuite.worker import Worker
+
+
+
+# The instructions that the generated tests cycle through before taking their screenshot
+Benchmark_Instructions = [
+  { "type": "property", "value": { "property": "Scene.Earth.Renderable.Enabled",
+                                   "value": True } },
+  { "type": "time", "value": "2024-01-01T12:00:00" },
+  { "type": "pause", "value": True },
+  { "type": "deltatime", "value": 1.0 },
+  { "type": "script", "value": "openspace.printInfo('Benchmark')" }
+]
+
+
+
+def setup_argparse():
+  """
+  Creates and sets up a parser for commandline arguments. This function returns the parsed
+  arguments as a dictionary.
+  """
+  parser = argparse.ArgumentParser(
+    description="Measures the overhead of the test runner by running generated tests "
+      "against the mock OpenSpace executable in the 'mock' folder, which needs neither "
+      "OpenSpace nor a GPU. The waits after instructions that are not acknowledged are "
+      "disabled in the generated tests, so the measured times are the time spent in the "
+      "runner and in the communication with the mock. If a 'config.json' is provided, "
+      "the throughput of submitting images to its server can be measured as well."
+  )
+  parser.add_argument(
+    "-n", "--tests",
+    dest="tests",
+    type=int,
+    help="The number of tests that are generated and run.",
+    required=False,
+    default=10
+  )
+  parser.add_argument(
+    "-m", "--instructions",
+    dest="instructions",
+    type=int,
+    help="The number of instructions that every test runs before taking its screenshot.",
+    required=False,
+    default=8
+  )
+  parser.add_argument(
+    "-s", "--session",
+    dest="session",
+    help="Runs all tests in the same instance of the mock, see 'main.py --session'.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "-j", "--jobs",
+    dest="jobs",
+    type=int,
+    help="The number of mock instances that run tests at the same time.",
+    required=False,
+    default=1
+  )
+  parser.add_argument(
+    "-l", "--latency",
+    dest="latency",
+    type=float,
+    help="The number of seconds the mock waits before answering a message. The other "
+      "latencies of the mock can be set with the 'OPENSPACE_MOCK_*' environment "
+      "variables that are described in 'mock/bin/OpenSpace'.",
+    required=False,
+    default=0.0
+  )
+  parser.add_argument(
+    "--submissions",
+    dest="submissions",
+    type=int,
+    help="The number of images that are submitted to the server in the 'config.json' to "
+      "measure the submission throughput. The throughput is measured once for images "
+      "that the server does not have yet and once for the same image that the server "
+      "only recognizes by its hash. The images are submitted to the group 'benchmark', "
+      "so this should only be used with a local server.",
+    required=False,
+    default=0
+  )
+  parser.add_argument(
+    "-o", "--output",
+    dest="output",
+    type=str,
+    help="The path to a JSON file into which the measurements are written. This file can "
+      "be used as the '--baseline' of later runs.",
+    required=False
+  )
+  parser.add_argument(
+    "-b", "--baseline",
+    dest="baseline",
+    type=str,
+    help="The path to the measurements of an earlier run. If any of the durations is "
+      "larger, or any of the throughputs is smaller, than the baseline by more than the "
+      "'--tolerance', the benchmark fails.",
+    required=False
+  )
+  parser.add_argument(
+    "--tolerance",
+    dest="tolerance",
+    type=float,
+    help="The ratio by which a measurement may be worse than the '--baseline'.",
+    required=False,
+    default=0.25
+  )
+
+  args = parser.parse_args()
+  return args
+
+
+
+def create_openspace_folder(folder: str, tests: int, instructions: int) -> list[str]:
+  """
+  Creates an OpenSpace folder in `folder` whose executable is the mock and that contains
+  the requested number of generated `tests`, each of which runs `instructions`
+  instructions before taking a screenshot. Returns the paths to the generated tests.
+  """
+  os.makedirs(f"{folder}/bin")
+  runner_folder = os.path.dirname(os.path.abspath(__file__))
+  mock = os.path.join(runner_folder, "mock", "bin", "OpenSpace")
+  os.symlink(mock, f"{folder}/bin/OpenSpace")
+
+  test_folder = f"{folder}/{test_base_dir}/benchmark"
+  os.makedirs(test_folder)
+  paths = []
+  for i in range(tests):
+    commands = [
+      Benchmark_Instructions[j % len(Benchmark_Instructions)] for j in range(instructions)
+    ]
+    path = f"{test_folder}/test-{i:04}.ostest"
+    with open(path, "w") as f:
+      content = {
+        "profile": "default",
+        "delay": 0.0,
+        "commands": commands + [{ "type": "screenshot" }]
+      }
+      json.dump(content, f, indent=2)
+    paths.append(path)
+  return paths
+
+
+
+def span_durations() -> dict[str, list[float]]:
+  """
+  Returns the durations in seconds of all spans that the tracer recorded, by their name.
+  """
+  durations = {}
+  for event in tracer.events:
+    durations.setdefault(event["name"], []).append(event["dur"] / 1e6)
+  return durations
+
+
+
+def distinct_image(data: bytes, salt: bytes) -> bytes:
+  """
+  Returns a copy of the PNG image with the encoded `data` whose first row is changed by
+  the `salt`, so that images with different salts have different pixels and the server
+  can not recognize them by their pixel hash.
+  """
+  chunks = []
+  idat = []
+  offset = len(Png_Signature)
+  while offset + 12 <= len(data):
+    length = int.from_bytes(data[offset:offset + 4], "big")
+    type = data[offset + 4:offset + 8]
+    body = data[offset + 8:offset + 8 + length]
+    offset = offset + 12 + length
+    if type == b"IDAT":
+      if len(idat) == 0:
+        chunks.append((type, None))
+      idat.append(body)
+    else:
+      chunks.append((type, body))
+
+  # The first byte of a row is its filter type, which is kept so the image stays valid
+  pixels = bytearray(zlib.decompress(b"".join(idat)))
+  for i, value in enumerate(salt):
+    pixels[1 + i] ^= value
+  compressed = zlib.compress(pixels)
+
+  result = [Png_Signature]
+  for type, body in chunks:
+    result.append(png_chunk(type, compressed if type == b"IDAT" else body))
+  return b"".join(result)
+
+
+
+def measure_submissions(image: str, count: int, deduplicated: bool) -> float:
+  """
+  Submits `count` images to the server in the 'config.json' and returns the number of
+  submissions per second. If `deduplicated` is `False`, every submission is a different
+  variation of the `image` that has to be uploaded. Otherwise, the `image` itself is
+  submitted every time after it has been submitted once before the measurement, so that
+  the server recognizes it by its pixel hash and the image is never uploaded.
+  """
+  with open("config.json") as f:
+    config = json.load(f)
+
+  with open(image, "rb") as f:
+    data = f.read()
+  # The salt makes the images of every benchmark run different from those of earlier runs
+  run_salt = os.urandom(4)
+
+  folder = tempfile.mkdtemp(prefix="openspace-benchmark-spool-")
+  try:
+    spool = Spool(folder)
+    entries = []
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # The first entry of a deduplicated measurement is only used to upload the image
+    for i in range(count + 1 if deduplicated else count):
+      result = TestResult()
+      result.group = "benchmark"
+      result.name = "submission"
+      result.timestamp = (now + datetime.timedelta(milliseconds=i)).isoformat()
+      # Every entry gets its own file as the spool takes ownership of the image
+      with open(f"{folder}/{i}.png", "wb") as f:
+        if deduplicated:
+          f.write(data)
+        else:
+          f.write(distinct_image(data, run_salt + i.to_bytes(4, "big")))
+      result.screenshots = [Screenshot(result.group, result.name, f"{folder}/{i}.png")]
+      result.timing = 0.0
+      result.phases = {}
+      result.commit = "benchmark"
+      entries.append(spool.add(result, result.screenshots[0], config["hardware"]))
+
+    uploader = Uploader(f"{config['url']}/api/submit-test", config["id"], spool)
+    if deduplicated:
+      uploader.submit(entries.pop(0))
+      uploader.flush()
+
+    start_time = time.perf_counter()
+    for entry in entries:
+      uploader.submit(entry)
+    failed = uploader.close()
+    end_time = time.perf_counter()
+    if len(failed) > 0:
+      raise Exception(f"{len(failed)} submissions failed")
+    return count / (end_time - start_time)
+  finally:
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+
+def compare_baseline(measurements: dict, baseline: dict, tolerance: float) -> list[str]:
+  """
+  Returns a description of every measurement that is worse than in the `baseline` by more
+  than the `tolerance`. Durations are worse if they are larger, throughputs if they are
+  smaller. Durations that are less than a millisecond longer are never considered worse.
+  """
+  regressions = []
+  for key, value in baseline["durations"].items():
+    current = measurements["durations"].get(key)
+    # Differences below a millisecond are within the noise of the measurements
+    if current is not None and current > max(value * (1.0 + tolerance), value + 0.001):
+      regressions.append(f"{key}: {current * 1000:.2f}ms (baseline {value * 1000:.2f}ms)")
+  for key, value in baseline["throughput"].items():
+    current = measurements["throughput"].get(key)
+    if current is not None and current < value * (1.0 - tolerance):
+      regressions.append(f"{key}: {current:.2f}/s (baseline {value:.2f}/s)")
+  return regressions
+
+
+
+args = setup_argparse()
+if args.submissions > 0 and not os.path.exists("config.json"):
+  raise Exception("Measuring the submissions requires a 'config.json'")
+
+# The mock reads its latencies from the environment, which it inherits from the runner
+os.environ["OPENSPACE_MOCK_LATENCY"] = str(args.latency)
+
+folder = tempfile.mkdtemp(prefix="openspace-benchmark-")
+try:
+  tests = create_openspace_folder(folder, args.tests, args.instructions)
+  executable = f"{folder}/bin/OpenSpace"
+  image = f"{folder}/image.png"
+
+  print(f"Running {len(tests)} tests with {args.instructions} instructions each")
+  start_time = time.perf_counter()
+  # The same kind of worker is used as by 'main.py'
+  worker = Worker() if args.jobs == 1 else None
+  if worker is not None:
+    worker.create()
+  if args.jobs > 1:
+    results = run_parallel(tests, executable, args.jobs, args.session)
+  elif args.session:
+    results = run_test_session(tests, executable, worker)
+  else:
+    results = (run_single_test(test, executable, worker) for test in tests)
+
+  for result in results:
+    # Keep one of the images for measuring the submissions and remove the others
+    if not os.path.exists(image):
+      shutil.copy(result.screenshots[0].file, image)
+    result.remove_images()
+  end_time = time.perf_counter()
+  if worker is not None:
+    worker.destroy()
+
+  spans = span_durations()
+  durations = {
+    "test.total": (end_time - start_time) / len(tests)
+  }
+  for name, values in spans.items():
+    durations[name] = statistics.mean(values)
+  # The instructions of a batch are sent together, so the time of a batch is shared by
+  # all instructions in it
+  instruction_spans = [e for e in tracer.events if e["cat"] == "instruction"]
+  instruction_time = sum([
+    e["dur"] / 1e6 for e in instruction_spans
+    if e["name"] not in ["screenshot", "screenshot wait", "delay"]
+  ])
+  durations["instruction"] = instruction_time / (len(tests) * args.instructions)
+
+  throughput = {}
+  if args.submissions > 0:
+    print(f"Submitting {args.submissions} images")
+    throughput["submissions"] = measure_submissions(image, args.submissions, False)
+    print(f"Submitting {args.submissions} images that the server already has")
+    throughput["submissions.deduplicated"] = measure_submissions(
+      image, args.submissions, True
+    )
+finally:
+  shutil.rmtree(folder, ignore_errors=True)
+
+
+measurements = { "durations": durations, "throughput": throughput }
+print("Mean durations:")
+for key, value in sorted(durations.items()):
+  print(f"  {key:20} {value * 1000:10.2f}ms")
+for key, value in sorted(throughput.items()):
+  print(f"Throughput of {key}: {value:.2f}/s")
+
+if args.output is not None:
+  with open(args.output, "w") as f:
+    json.dump(measurements, f, indent=2)
+
+if args.baseline is not None:
+  with open(args.baseline) as f:
+    baseline = json.load(f)
+  regressions = compare_baseline(measurements, baseline, args.tolerance)
+  if len(regressions) > 0:
+    print("Measurements that are worse than the baseline:")
+    for regression in regressions:
+      print(f"  {regression}")
+    exit(-1)
+  print("No measurement is worse than the baseline")
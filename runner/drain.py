@@ -0,0 +1,87 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+
+import argparse
+import json
+import os
+import time
+from testsuite.spool import Spool
+from testsuite.upload import Uploader
+
+
+
+def setup_argparse():
+  """
+  Creates and sets up a parser for commandline arguments. This function returns the parsed
+  arguments as a dictionary.
+  """
+  parser = argparse.ArgumentParser(
+    description="Submits the test results that are waiting in the spool to the server "
+      "that is specified in the 'config.json'."
+  )
+  parser.add_argument(
+    "-i", "--interval",
+    dest="interval",
+    type=float,
+    help="If this value is provided, the spool is checked again after this many seconds "
+      "until it is empty, instead of only trying to submit the waiting results once.",
+    required=False
+  )
+
+  args = parser.parse_args()
+  return args
+
+
+
+args = setup_argparse()
+
+if not os.path.exists("config.json"):
+  raise Exception("Could not find 'config.json'")
+
+with open("config.json") as f:
+  config = json.load(f)
+  submit_url = f"{config['url']}/api/submit-test"
+  runner_id = config["id"]
+
+spool = Spool(os.path.join(os.path.dirname(os.path.abspath("config.json")), "spool"))
+
+while True:
+  entries = spool.entries()
+  print(f"Submitting {len(entries)} spooled results")
+
+  uploader = Uploader(submit_url, runner_id, spool)
+  for entry in entries:
+    uploader.submit(entry)
+  failed = uploader.close()
+
+  if len(failed) == 0 or args.interval is None:
+    break
+
+  print(f"{len(failed)} results could not be submitted. Retrying in {args.interval}s")
+  time.sleep(args.interval)
+
+if len(failed) > 0:
+  print(f"Failed to submit {len(failed)} results: {failed}")
+  exit(-1)
@@ -3,8 +3,12 @@
 # updates
 
 import argparse
+import concurrent.futures
+import datetime
 import json
+import os
 import requests
+import threading
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -29,60 +33,221 @@ parser.add_argument(
     "existing test records as new tests",
   required=True
 )
+parser.add_argument(
+  "-w", "--workers",
+  dest="workers",
+  type=int,
+  help="The number of tests whose results are copied at the same time. The results of "
+    "a single test are always copied one after another",
+  required=False,
+  default=8
+)
+parser.add_argument(
+  "-c", "--checkpoint",
+  dest="checkpoint",
+  type=str,
+  help="The file in which the results that were copied successfully are remembered "
+    "together with the destination server. If the script is interrupted, running it "
+    "again with the same checkpoint file skips these results if they are copied to the "
+    "same destination",
+  required=False,
+  default="copy_server.checkpoint"
+)
+parser.add_argument(
+  "--delta",
+  dest="delta",
+  help="Only copies the results that are newer than the latest result that the "
+    "destination server already has for the same test",
+  required=False,
+  action="store_true",
+  default=False
+)
 args = parser.parse_args()
 
 
-# Request the records from the source server
-res = requests.get(f"{args.source}/api/test-records")
-if res.status_code != 200:
-  print(f"Image submission failed with error {res.status_code}")
-  print(res.text)
-  exit(-1)
-records = json.loads(res.text)
-
-# and then resubmit it as a new test to the destination server
-for record in records:
-  group = record["group"]
-  name = record["name"]
-  hardware = record["hardware"]
-  print(f"Processing {group}/{name}/{hardware}")
-
-  i = 0
-  for data in record["data"]:
-    timestamp = data["timeStamp"]
-    image_url = f"{args.source}/api/result/candidate/{group}/{name}/{hardware}/{timestamp}"
-    log_url = f"{args.source}/api/result/log/{group}/{name}/{hardware}/{timestamp}"
-    print(f"  {i}")
-
-    print(f"    Downloading image: {image_url}")
-    img = requests.get(image_url)
+
+# Every thread keeps its own session so that connections to both servers are reused
+thread_data = threading.local()
+
+def session():
+  if not hasattr(thread_data, "session"):
+    thread_data.session = requests.Session()
+  return thread_data.session
+
+
+
+def parse_time(timestamp):
+  return datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+
+def request_records(url):
+  """
+  Requests the test records from the server at `url` one page at a time and yields the
+  individual records. Servers that do not support pages return all records at once.
+  """
+  params = { "limit": 100 }
+  while True:
+    res = session().get(f"{url}/api/test-records", params=params)
+    if res.status_code != 200:
+      raise Exception(f"Requesting test records failed with error {res.status_code}")
+    page = json.loads(res.text)
+    if isinstance(page, list):
+      yield from page
+      return
+
+    yield from page["records"]
+    if page["next"] is None:
+      return
+    params["cursor"] = page["next"]
+
+
+
+def copy_result(group, name, hardware, data):
+  """
+  Downloads the candidate image and the log of a single test result from the source
+  server and submits them to the destination server. A result of a test that failed
+  before taking its image refers to the image of an earlier result, so it is submitted
+  as a failure without an image instead. Raises an exception if any of the requests
+  fails.
+  """
+  timestamp = data["timeStamp"]
+  image_url = f"{args.source}/api/result/candidate/{group}/{name}/{hardware}/{timestamp}"
+  log_url = f"{args.source}/api/result/log/{group}/{name}/{hardware}/{timestamp}"
+
+  log = session().get(log_url)
+  if log.status_code != 200:
+    raise Exception(f"Downloading log {log_url} failed with error {log.status_code}")
+  files = { "log": log.content }
+
+  if data.get("failure") is None:
+    img = session().get(image_url)
     if img.status_code != 200:
-      print(f"Error with {res.status_code}")
-      exit(-1)
-
-    print(f"    Downloading log: {log_url}")
-    log = requests.get(log_url)
-    if log.status_code != 200:
-      print(f"Error with {res.status_code}")
-      exit(-1)
-
-
-    print("    Submitting")
-    res = requests.post(
-      f"{args.destination}/api/submit-test",
-      data = {
-        "group": group,
-        "name": name,
-        "hardware": hardware,
-        "runnerID": args.runner,
-        "timestamp": timestamp,
-        "timing": data["timing"],
-        "commitHash": data["commitHash"]
-      },
-      files = {
-        "file": img.content,
-        "log": log.content
-      }
-    )
-
-    i = i + 1
+      raise Exception(
+        f"Downloading image {image_url} failed with error {img.status_code}"
+      )
+    files["file"] = img.content
+
+  body = {
+    "group": group,
+    "name": name,
+    "hardware": hardware,
+    "runnerID": args.runner,
+    "timestamp": timestamp,
+    "timing": data["timing"],
+    "commitHash": data["commitHash"]
+  }
+  if data.get("failure") is not None:
+    body["failure"] = data["failure"]
+  if data.get("phases") is not None:
+    body["phases"] = json.dumps(data["phases"])
+  if data.get("stability") is not None:
+    body["stability"] = json.dumps(data["stability"])
+
+  res = session().post(f"{args.destination}/api/submit-test", data=body, files=files)
+  if res.status_code != 200:
+    raise Exception(f"Submitting failed with error {res.status_code}: {res.text}")
+
+
+
+def copy_record(results):
+  """
+  Copies the `results` of a single test one after another in the order of their
+  timestamps, as the destination server compares each result against the reference image
+  that the earlier results have set. Stops at the first result that could not be copied,
+  as the later results would otherwise be compared against a different reference. Returns
+  the number of results that were not copied.
+  """
+  global copied
+  results = sorted(results, key=lambda result: parse_time(result[4]["timeStamp"]))
+  for i, (key, group, name, hardware, data) in enumerate(results):
+    try:
+      copy_result(group, name, hardware, data)
+    except Exception as e:
+      with lock:
+        print(f"  Error copying {key}: {e}")
+        if i + 1 < len(results):
+          print(f"  Skipping the {len(results) - i - 1} later results of the same test")
+      return len(results) - i
+
+    with lock:
+      copied = copied + 1
+      print(f"  ({copied}) Copied {key}")
+      checkpoint.write(f"{args.destination}\t{key}\n")
+      checkpoint.flush()
+  return 0
+
+
+
+def record_finished(future):
+  """
+  Called when the results of a test have been copied, which makes room for the next
+  test to be copied.
+  """
+  global failed
+  try:
+    with lock:
+      failed = failed + future.result()
+  finally:
+    slots.release()
+
+
+
+# Load the results that have already been copied to the same destination by a previous
+# run of this script
+done = set()
+if os.path.exists(args.checkpoint):
+  with open(args.checkpoint) as f:
+    for line in f:
+      destination, _, key = line.strip().partition("\t")
+      if destination == args.destination and key != "":
+        done.add(key)
+  print(f"Skipping {len(done)} results that were copied previously")
+
+# In delta mode, find the latest result the destination already has for each test
+latest = {}
+if args.delta:
+  for record in request_records(args.destination):
+    if len(record["data"]) > 0:
+      key = (record["group"], record["name"], record["hardware"])
+      latest[key] = max([parse_time(data["timeStamp"]) for data in record["data"]])
+
+
+# Request the records from the source server and resubmit their results as new tests to
+# the destination server as soon as they arrive. Different tests are copied at the same
+# time, but the results of a single test are copied in order. Only a limited number of
+# tests wait to be copied, so that the next page of records is requested while the
+# results of the previous page are copied. A test that could not be copied is reported
+# but does not stop the others, and since only successful results are written to the
+# checkpoint, running the script again retries the failed ones
+found = 0
+failed = 0
+copied = 0
+lock = threading.Lock()
+slots = threading.BoundedSemaphore(2 * args.workers)
+with open(args.checkpoint, "a") as checkpoint:
+  with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers) as executor:
+    for record in request_records(args.source):
+      group = record["group"]
+      name = record["name"]
+      hardware = record["hardware"]
+      results = []
+      for data in record["data"]:
+        key = f"{group}/{name}/{hardware}/{data['timeStamp']}"
+        if key in done:
+          continue
+        newest = latest.get((group, name, hardware))
+        if newest is not None and parse_time(data["timeStamp"]) <= newest:
+          continue
+        results.append((key, group, name, hardware, data))
+      if len(results) == 0:
+        continue
+
+      found = found + len(results)
+      slots.acquire()
+      executor.submit(copy_record, results).add_done_callback(record_finished)
+
+print(f"Copied {copied} of {found} results")
+if failed > 0:
+  print(f"{failed} results could not be copied")
+  exit(-1)
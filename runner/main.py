@@ -23,64 +23,64 @@
 ##########################################################################################
 
 import argparse
-import datetime
+import atexit
 import glob
 import json
 import os
-import requests
 import shutil
+import sys
+import threading
 import time
-from testsuite.constants import test_base_dir
-from testsuite.openspace import write_configuration_overwrite, run_single_test
-from testsuite.test import TestResult
+from testsuite.cache import Cache
+from testsuite.constants import (comparison_threshold, instruction_timeout,
+  test_base_dir, test_timeout, thumbnail_scale)
+from testsuite.display import DisplayPool
+from testsuite.history import History, order_tests, predict_duration
+from testsuite.image import can_compare_images, compare_images
+from testsuite.manifest import Manifest, executable_fingerprint, test_fingerprint
+from testsuite.openspace import (Timeouts, write_configuration_overwrite, prewarm,
+  restore_configuration_overwrite, run_parallel, run_single_test, run_test_session)
+from testsuite.test import Screenshot, Test
+from testsuite.spool import Spool
+from testsuite.trace import tracer
+from testsuite.upload import Uploader
+from testsuite.worker import Worker
+from testsuite.workqueue import WorkQueue
 
 
 
-# TODO: Retry openspace api connection until it works
-# TODO: 'screenshot' command has optional argument to determine sub-test name
-# TODO: Instead of waiting a fixed amount of time when starting OpenSpace, we can listen
-#       to the finished loading event instead
-
-def submit_image(result: TestResult, hardware: str, timestamp: str, file: str,
-                 runner: str, url: str):
+def store_image(screenshot: Screenshot) -> float | None:
   """
-  Submits a new candidate image to the provided URL. This function logs a method
-  indicating whether the image submission succeeded
+  Stores the provided `Screenshot` locally by creating the necessary folders if they
+  don't exist and then moving the image there. Only the latest test result are stored.
+  The first image that is stored for a test is also kept as the test's reference image
+  against which all later images are compared. The resulting difference image is stored
+  next to the image and the ratio of differing pixels is returned. If the packages
+  required for the comparison are not installed, `None` is returned instead.
   """
-  res = requests.post(
-    url,
-    data = {
-      "group": result.group,
-      "name": result.name,
-      "hardware": hardware,
-      "runnerID": runner,
-      "timestamp": timestamp,
-      "timing": result.timing,
-      "commitHash": result.commit
-    },
-    files = {
-      "file": open(file, "rb"),
-      "log": result.error
-    }
-  )
-  if res.status_code != 200:
-    print(f"Image submission failed with error {res.status_code}")
-    print(res.text)
-  else:
-    print("Image submitted successfully")
+  file = screenshot.file
+  dest_folder = f"tests/{screenshot.group}"
+  os.makedirs(dest_folder, exist_ok=True)
+  destination = f"{dest_folder}/{screenshot.name}.png"
+  print(f"Moving file {file} -> {destination}")
+  shutil.move(file, destination)
 
+  reference = f"{dest_folder}/{screenshot.name}-reference.png"
+  if not os.path.exists(reference):
+    print(f"Using {destination} as the reference image")
+    shutil.copy(destination, reference)
 
+  if not can_compare_images():
+    return None
 
-def store_image(result: TestResult, file: str):
-  """
-  Stores the images of the provided `TestResult` locally by creating the necessary folders
-  if they don't exist and then saving the image. Only the latest test result are stored.
-  """
-  dest_folder = f"tests/{result.group}"
-  os.makedirs(dest_folder, exist_ok=True)
-  destination = f"{dest_folder}/{result.name}.png"
-  print(f"Copying file {file} -> {destination}")
-  shutil.copy(file, destination)
+  difference = f"{dest_folder}/{screenshot.name}-difference.png"
+  error = compare_images(reference, destination, difference, comparison_threshold,
+    thumbnail_scale)
+  if error is None:
+    print(f"Image has a different size than the reference image {reference}")
+    return 1.0
+  print(f"Pixel error: {error:.4%}")
+  return error
 
 
 
@@ -127,6 +127,151 @@ def setup_argparse():
     action="store_true",
     default=False
   )
+  parser.add_argument(
+    "-s", "--session",
+    dest="session",
+    help="Groups the tests by the profile they require and runs all tests of a group in "
+      "the same OpenSpace instance instead of starting a new instance for every test. "
+      "OpenSpace is reset between tests, but tests that change state beyond their time, "
+      "camera, assets, and the common settings might influence the tests that follow.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "-j", "--jobs",
+    dest="jobs",
+    type=int,
+    help="The number of OpenSpace instances that run tests at the same time. Each "
+      "instance uses its own ports, window configuration, and screenshot folder.",
+    required=False,
+    default=1
+  )
+  parser.add_argument(
+    "--repeat",
+    dest="repeat",
+    type=int,
+    help="The number of images that are taken of the state at the end of each test to "
+      "measure whether the test renders the same image every time. The images are "
+      "compared locally and only the test's own screenshots are submitted, together with "
+      "the stability of the test.",
+    required=False,
+    default=1
+  )
+  parser.add_argument(
+    "--order",
+    dest="order",
+    type=str,
+    choices=["default", "longest", "failed"],
+    help="Determines the order in which the tests are run. 'default' keeps the order in "
+      "which the tests were found or provided. 'longest' runs the tests that took the "
+      "longest previously first, which is useful when running multiple jobs. 'failed' "
+      "runs the tests that did not finish or whose last image differed from the "
+      "reference first, the most recent failures first. The previous results are "
+      "requested from the server or, if no 'config.json' is provided, taken from a "
+      "'history.json' file.",
+    required=False,
+    default="default"
+  )
+  parser.add_argument(
+    "-i", "--incremental",
+    dest="incremental",
+    help="Only runs the tests whose inputs have changed since they were last run "
+      "successfully. The inputs of a test are its test file, its profile, the assets "
+      "that are loaded by the profile and the test, and the OpenSpace executable. They "
+      "are remembered in a 'manifest.json' next to the 'config.json'.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "-f", "--force",
+    dest="force",
+    help="Runs all selected tests even if '--incremental' is provided, but still updates "
+      "the manifest with the inputs of the tests that ran successfully.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "-q", "--queue",
+    dest="queue",
+    type=str,
+    help="The name of a test run whose tests are shared with other runners of the same "
+      "hardware, for example the date of a nightly run. Instead of running all selected "
+      "tests, the runner registers them with the server and then runs the tests that the "
+      "server hands out until all tests of the run have been finished by any runner. "
+      "Requires a 'config.json' and can not be combined with '--session'.",
+    required=False
+  )
+  parser.add_argument(
+    "--prewarm",
+    dest="prewarm",
+    help="Starts OpenSpace once with every profile that is used by the selected tests "
+      "before running them, so that the data that is downloaded while loading a profile "
+      "is already cached and does not count towards the timing of the tests.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "--cache-budget",
+    dest="cache_budget",
+    type=float,
+    help="The maximum number of gigabytes that the MRF cache in the '--overwrite' folder "
+      "can take up. After the tests have run, the least recently used tiles are removed "
+      "until the cache fits into this budget. Requires '--overwrite'.",
+    required=False
+  )
+  parser.add_argument(
+    "--timeout",
+    dest="timeout",
+    type=float,
+    help="The number of seconds after which a test that has not finished is considered "
+      "to hang. OpenSpace is then killed, the test is reported as failed together with "
+      "its log, and the next test is run. Tests can overwrite this value with 'timeout'.",
+    required=False,
+    default=test_timeout
+  )
+  parser.add_argument(
+    "--instruction-timeout",
+    dest="instruction_timeout",
+    type=float,
+    help="The number of seconds after which a single instruction that has not finished "
+      "is considered to hang, which is handled the same as '--timeout'. Wait "
+      "instructions additionally get the time they wait. Tests can overwrite this value "
+      "with 'instructionTimeout' and instructions with 'timeout'.",
+    required=False,
+    default=instruction_timeout
+  )
+  parser.add_argument(
+    "--headless",
+    dest="headless",
+    help="Runs OpenSpace on virtual X displays with software rendering instead of the "
+      "current display and GPU. Each instance gets its own display, which requires "
+      "'Xvfb' and Mesa's 'llvmpipe' driver. Only supported on Linux.",
+    required=False,
+    action="store_true",
+    default=False
+  )
+  parser.add_argument(
+    "--llvmpipe-threads",
+    dest="llvmpipe_threads",
+    type=int,
+    help="The number of threads that each instance uses for software rendering in "
+      "'--headless' mode. Defaults to the number of cores divided by the number of jobs.",
+    required=False
+  )
+  parser.add_argument(
+    "--trace",
+    dest="trace",
+    type=str,
+    help="The path to a file into which the timing of the individual phases of the test "
+      "run is written, such as starting OpenSpace, running each instruction, and "
+      "uploading the images. The file uses the Chrome trace event format and can be "
+      "opened with 'chrome://tracing' or 'https://ui.perfetto.dev'.",
+    required=False
+  )
 
   args = parser.parse_args()
   return args
@@ -134,6 +279,8 @@ def setup_argparse():
 
 
 global_start = time.perf_counter()
+# The spool and the files that are kept between runs are stored next to the configuration
+runner_folder = os.path.dirname(os.path.abspath("config.json"))
 if os.path.exists("config.json"):
   submit_images = True
   with open("config.json") as f:
@@ -142,6 +289,8 @@ if os.path.exists("config.json"):
     submit_url = f"{url}/api/submit-test"
     hardware = config["hardware"]
     runner_id = config["id"]
+  # Images are written to the spool before they are submitted
+  spool = Spool(os.path.join(runner_folder, "spool"))
 else:
   print("No 'config.json' provided. Test results will be stored locally instead")
   submit_images = False
@@ -160,52 +309,282 @@ else:
 if not os.path.exists(executable):
   raise Exception(f"Could not find executable '{executable}'")
 
+if args.cache_budget is not None and args.overwrite_path is None:
+  raise Exception("'--cache-budget' requires the '--overwrite' folder")
 
-if args.overwrite_path != None:
-  write_configuration_overwrite(args.dir, args.overwrite_path)
+if args.repeat < 1:
+  raise Exception("'--repeat' has to be at least 1")
 
+if args.headless:
+  if not sys.platform.startswith("linux"):
+    raise Exception("'--headless' is only supported on Linux")
+  # The images rendered in software differ from those rendered by a GPU, so they are
+  # reported under their own hardware to be compared against their own references
+  if submit_images:
+    hardware = config.get("headlessHardware", f"{hardware}-llvmpipe")
+  threads = args.llvmpipe_threads or max(1, (os.cpu_count() or 1) // args.jobs)
+  displays = DisplayPool(threads)
+  print(f"Rendering on virtual displays with {threads} llvmpipe threads per instance")
+elif args.llvmpipe_threads is not None:
+  raise Exception("'--llvmpipe-threads' requires '--headless'")
+else:
+  displays = None
 
+if args.queue is not None:
+  if not submit_images:
+    raise Exception("Running the tests of a queue requires a 'config.json'")
+  if args.session:
+    raise Exception("Running the tests of a queue can not be combined with '--session'")
 
-# Running the tests
+
+# The ports and the screenshot folder that belong to the runner are passed to OpenSpace
+# through the override file, so it is written even if no caching folder is provided. The
+# override file that the developer might have had before is put back when the runner exits
+write_configuration_overwrite(args.dir, args.overwrite_path)
+atexit.register(restore_configuration_overwrite, args.dir)
+
+
+
+# Collecting the tests
 if args.test is None:
   print("Running all tests in OpenSpace folder")
   files = glob.glob(f"{args.dir}/{test_base_dir}/**/*.ostest", recursive=True)
-  for file in files:
-    # Normalize the path endings to always do forward slashes
-    file = file.replace(os.sep, "/")
-    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    if args.dry_run:
-      print(f"Test: '{file}' run against executable '{executable}'")
-      continue
-
-    result = run_single_test(file, executable)
-    for file in result.files:
-      if submit_images:
-        submit_image(result, hardware, timestamp, file, runner_id, submit_url)
-      else:
-        store_image(result, file)
-    time.sleep(0.5)
+  # Normalize the path endings to always do forward slashes
+  tests = [file.replace(os.sep, "/") for file in files]
 else:
-  tests = args.test.split(",")
-  print(f"Running tests: {tests}")
-  for test in tests:
+  tests = []
+  for test in args.test.split(","):
     path = f"{args.dir}/{test_base_dir}/{test}.ostest"
     if not os.path.isfile(path):
       raise Exception(f"Could not find test '{path}'")
+    tests.append(path)
+  print(f"Running tests: {tests}")
 
-    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+# The group and name of each test, which is how the manifest and history refer to it
+keys = {}
+# The test to which each screenshot belongs, as the server knows the screenshots by the
+# group and name of the screenshot instead of those of the test
+screenshot_keys = {}
+for test in tests:
+  t = Test(test)
+  keys[test] = f"{t.group}/{t.name}"
+  for instruction in t.instructions:
+    if instruction.is_screenshot():
+      screenshot = t.screenshot_result(instruction, None)
+      screenshot_keys[f"{screenshot.group}/{screenshot.name}"] = keys[test]
 
-    if args.dry_run:
-      print(f"Test: '{path}' run against executable '{executable}'")
-      continue
+# Remove the tests whose inputs have not changed since they last ran successfully
+if args.incremental or args.force:
+  manifest = Manifest(os.path.join(runner_folder, "manifest.json"))
+  executable_hash = executable_fingerprint(executable)
+  fingerprints = {}
+  for test in tests:
+    fingerprints[keys[test]] = test_fingerprint(Test(test), args.dir)
 
-    result = run_single_test(path, executable)
-    for file in result.files:
-      if submit_images:
-        submit_image(result, hardware, timestamp, file, runner_id, submit_url)
+  if not args.force:
+    changed = []
+    for test in tests:
+      if manifest.is_current(keys[test], fingerprints[keys[test]], executable_hash):
+        print(f"Skipping unchanged test '{keys[test]}'")
       else:
-        store_image(result, file)
-    time.sleep(0.5)
+        changed.append(test)
+    tests = changed
+else:
+  manifest = None
+
+# Order the tests based on how long they took and whether they failed previously
+history = History(os.path.join(runner_folder, "history.json"))
+# The previous results are only requested from the server if they are used, as all of
+# the records of the hardware have to be downloaded
+if submit_images and (args.order != "default" or args.dry_run):
+  history.load_server(url, hardware, screenshot_keys)
+tests = order_tests(tests, [keys[test] for test in tests], history, args.order)
+
+
+# The tests that did not run to completion or whose images were not all delivered, which
+# are not recorded in the manifest
+failed_tests = set()
+
+def test_succeeded(key: str, commit: str):
+  """
+  Records in the manifest that the test identified by `key` was run successfully on the
+  OpenSpace `commit`.
+  """
+  if manifest is not None:
+    manifest.update(key, fingerprints[key], executable_hash, commit)
+
+
+
+# The number of screenshots of each test that have not been delivered to the server yet
+pending = {}
+pending_lock = threading.Lock()
+
+def submission_delivered(entry):
+  """
+  Called by the uploader for every spool `entry` that was accepted by the server. A test
+  has succeeded once all of its screenshots have been delivered, unless it failed.
+  """
+  # Entries that were spooled before tests could take multiple screenshots have no test
+  key = entry.metadata.get("test", f"{entry.metadata['group']}/{entry.metadata['name']}")
+  with pending_lock:
+    pending[key] = pending.get(key, 1) - 1
+    if pending[key] > 0:
+      return
+    del pending[key]
+
+  if key not in failed_tests:
+    test_succeeded(key, entry.metadata["commitHash"])
+  if work_queue is not None:
+    # The server has finished the test when it accepted the result
+    work_queue.finish(key)
+
+
+def submission_abandoned(entry):
+  """
+  Called by the uploader for every spool `entry` that was refused by the server or could
+  not be delivered. The test can not succeed anymore and, if it was leased from a work
+  queue, it is given up so that it is neither run again nor blocks the queue.
+  """
+  key = entry.metadata.get("test", f"{entry.metadata['group']}/{entry.metadata['name']}")
+  failed_tests.add(key)
+  if work_queue is not None:
+    work_queue.abandon(key)
+
+
+if args.dry_run:
+  for test in tests:
+    print(f"Test: '{test}' run against executable '{executable}'")
+  duration = predict_duration([keys[test] for test in tests], history, args.jobs)
+  print(f"Predicted duration: {duration:.2f}s")
+  exit()
+
+
+# The caches are only kept between runs if they are stored in the '--overwrite' folder
+if args.overwrite_path is not None:
+  cache = Cache(args.overwrite_path)
+  cache_before = cache.scan()
+else:
+  cache = None
+
+if args.prewarm:
+  prewarm_worker = Worker()
+  prewarm_worker.create(displays.acquire() if displays is not None else None)
+  try:
+    prewarm(tests, executable, prewarm_worker)
+  finally:
+    if prewarm_worker.display is not None:
+      displays.release(prewarm_worker.display)
+    prewarm_worker.destroy()
+  if cache is not None:
+    # The usage of the caches by the tests is reported separately from the prewarming
+    cache_prewarmed = cache.scan()
+    cache.report(cache_before, cache_prewarmed, "after prewarming")
+    cache_before = cache_prewarmed
+
+# With a queue, the tests are leased from the server one at a time while they are run
+if args.queue is not None:
+  work_queue = WorkQueue(url, runner_id, hardware, args.queue)
+  remaining = work_queue.register([keys[test] for test in tests])
+  print(f"Registered for run '{args.queue}' with {remaining} remaining tests")
+  tests = work_queue.tests({ keys[test]: test for test in tests })
+else:
+  work_queue = None
+
+# Running the tests
+timeouts = Timeouts(args.timeout, args.instruction_timeout)
+if args.jobs > 1:
+  worker = None
+  results = run_parallel(tests, executable, args.jobs, args.session, timeouts, displays,
+    args.repeat)
+else:
+  # A single instance also writes its screenshots into a folder that belongs to the
+  # runner and is cleared before every test, instead of OpenSpace's screenshot folder
+  # that keeps the images of all earlier runs
+  worker = Worker()
+  worker.create(displays.acquire() if displays is not None else None)
+  if args.session:
+    results = run_test_session(tests, executable, worker, timeouts, args.repeat)
+  else:
+    results = (
+      run_single_test(test, executable, worker, timeouts, args.repeat) for test in tests
+    )
+
+# The errors of the images that were stored and compared locally
+errors = {}
+# The stability of the tests whose final state was captured repeatedly
+stabilities = {}
+
+# Images are uploaded in the background while the next tests are running
+if submit_images:
+  uploader = Uploader(submit_url, runner_id, spool, delivered=submission_delivered,
+    abandoned=submission_abandoned)
+try:
+  for result in results:
+    phases = ", ".join([f"{k}: {v:.2f}s" for k, v in result.phases.items()])
+    print(f"Test timing: {phases}")
+    print(f"Test log: {result.log_lines} lines, {result.log_errors} errors, "
+      f"{result.log_warnings} warnings")
+    key = f"{result.group}/{result.name}"
+    # Whether the test failed or, for local results, any of its images differed
+    test_failed = result.failure != ""
+    if result.failure != "":
+      print(f"Test failed: {result.failure}")
+      failed_tests.add(key)
+    if result.stability is not None:
+      stabilities[key] = result.stability
+    if submit_images:
+      with pending_lock:
+        pending[key] = len(result.screenshots)
+      for screenshot in result.screenshots:
+        uploader.submit(spool.add(result, screenshot, hardware, args.queue))
+    else:
+      for screenshot in result.screenshots:
+        if screenshot.file is None:
+          # A screenshot that was never taken differs entirely from its reference
+          errors[f"{screenshot.group}/{screenshot.name}"] = 1.0
+          continue
+        error = store_image(screenshot)
+        errors[f"{screenshot.group}/{screenshot.name}"] = error
+        test_failed = test_failed or (error is not None and error > 0.0)
+      if result.failure == "":
+        test_succeeded(key, result.commit)
+    history.add(key, result.timing, result.timestamp if test_failed else None)
+    # The images have been moved into the spool or the local results by now
+    result.remove_images()
+finally:
+  if submit_images:
+    print("Waiting for remaining image submissions")
+    failed = uploader.close()
+    if len(failed) > 0:
+      print(f"Failed to submit {len(failed)} images: {failed}")
+      print(f"They are kept in '{spool.folder}' and can be submitted with 'drain.py'")
+  if work_queue is not None:
+    work_queue.close()
+  if worker is not None:
+    worker.destroy()
+  if displays is not None:
+    displays.close()
+  if cache is not None:
+    cache.report(cache_before, cache.scan(), "after running the tests")
+    if args.cache_budget is not None:
+      files, size = cache.evict(int(args.cache_budget * 1e9))
+      print(f"Removed {files} files ({size / 1e6:.1f} MB) from the MRF cache")
+  if manifest is not None:
+    manifest.save()
+  history.save()
+  if args.trace is not None:
+    tracer.save(args.trace)
+    print(f"Trace written to '{args.trace}'")
+
+if len(errors) > 0 and can_compare_images():
+  print("Local comparison results, sorted by the pixel error:")
+  for key, error in sorted(errors.items(), key=lambda e: e[1], reverse=True):
+    print(f"  {error:8.4%}  {key}")
+
+if len(stabilities) > 0:
+  print("Stability of the tests, sorted by their score:")
+  for key, stability in sorted(stabilities.items(), key=lambda s: s[1].score()):
+    print(f"  {stability}  {key}")
 
 global_end = time.perf_counter()
 print(f"Total time for all tests: {global_end - global_start}")
@@ -0,0 +1,149 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+
+import os
+
+
+
+class CacheArea:
+  """
+  The state of one of the cache folders at the time it was scanned. It has the following
+  members:
+    - `folder`: The folder that was scanned
+    - `files`: The size, the time of the last access, and the time of the last
+               modification of every file in the folder, keyed by its path
+  """
+  def __init__(self, folder: str):
+    self.folder = folder
+    self.files = {}
+    for root, _, names in os.walk(folder):
+      for name in names:
+        path = os.path.join(root, name)
+        try:
+          stat = os.stat(path)
+        except OSError:
+          # The file might have been removed while we were scanning the folder
+          continue
+        self.files[path] = (stat.st_size, stat.st_atime, stat.st_mtime)
+
+
+  def size(self) -> int:
+    """
+    Returns the number of bytes of all files in this area.
+    """
+    return sum([size for size, _, _ in self.files.values()])
+
+
+  def changes(self, earlier) -> tuple[int, int, int]:
+    """
+    Compares this scan against an `earlier` scan of the same folder and returns the number
+    of files that were missing from the cache, the number of bytes that were added to the
+    cache, and the number of files that were served from the cache in the meantime. A
+    file was missing if it was created or grew, as OpenSpace had to download its
+    contents. A file was served from the cache if it existed before and was read without
+    being changed, which can only be detected if the file system records access times.
+    """
+    misses = 0
+    added = 0
+    hits = 0
+    for path, (size, atime, mtime) in self.files.items():
+      before = earlier.files.get(path)
+      if before is None or size > before[0]:
+        misses = misses + 1
+        added = added + size - (before[0] if before is not None else 0)
+      elif atime > before[1]:
+        hits = hits + 1
+    return misses, added, hits
+
+
+
+class Cache:
+  """
+  The folders in which OpenSpace keeps downloaded data between test runs, which are set
+  up by `write_configuration_overwrite` inside the `--overwrite` folder. These are the
+  `sync` folder with the synchronized files and the `mrf` folder with the cached tiles of
+  the GlobeBrowsing layers.
+
+   - `folder`: The base folder that contains the cache folders
+  """
+  def __init__(self, folder: str):
+    self.folders = {
+      "sync": f"{folder}/sync",
+      "mrf": f"{folder}/mrf"
+    }
+
+
+  def scan(self) -> dict[str, CacheArea]:
+    """
+    Returns the current state of all cache folders, keyed by the name of the folder.
+    """
+    return { name: CacheArea(folder) for name, folder in self.folders.items() }
+
+
+  def report(self, before: dict[str, CacheArea], after: dict[str, CacheArea], title: str):
+    """
+    Prints the size of the cache folders in the scan `after` and how the caches were used
+    since the scan `before`, see `CacheArea.changes`.
+    """
+    print(f"Cache {title}:")
+    for name, area in after.items():
+      misses, added, hits = area.changes(before[name])
+      print(f"  {name}: {len(area.files)} files, {area.size() / 1e6:.1f} MB, "
+        f"{misses} misses ({added / 1e6:.1f} MB added), {hits} hits")
+
+
+  def evict(self, budget: int) -> tuple[int, int]:
+    """
+    Removes the least recently used MRF tiles until the `mrf` folder takes up at most
+    `budget` bytes. The tiles of a layer are stored together in a set of files with the
+    same name, such as the `.mrf` header, the `.idx` index, and the data file, which can
+    only be removed together. A set was last used when any of its files was last
+    accessed or modified. Returns the number of removed files and their bytes.
+    """
+    area = CacheArea(self.folders["mrf"])
+    total = area.size()
+    if total <= budget:
+      return 0, 0
+
+    sets = {}
+    for path, (size, atime, mtime) in area.files.items():
+      key = os.path.splitext(path)[0]
+      files, last_use = sets.get(key, ([], 0.0))
+      sets[key] = (files + [(path, size)], max(last_use, atime, mtime))
+
+    removed_files = 0
+    removed_bytes = 0
+    for files, _ in sorted(sets.values(), key=lambda s: s[1]):
+      if total <= budget:
+        break
+      for path, size in files:
+        try:
+          os.remove(path)
+        except OSError:
+          continue
+        total = total - size
+        removed_files = removed_files + 1
+        removed_bytes = removed_bytes + size
+    return removed_files, removed_bytes
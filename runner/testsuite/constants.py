@@ -1 +1,66 @@
 test_base_dir = "tests/visual"
+
+# The port on which OpenSpace accepts connections from the Python API
+api_port = 4681
+
+# The port on which the SGCT node of OpenSpace's window configuration is listening
+sgct_port = 20401
+
+# The maximum number of seconds that starting OpenSpace and loading a profile can take
+startup_timeout = 600
+
+# The maximum number of seconds that OpenSpace can take to shut down before it is killed
+shutdown_timeout = 30
+
+# The maximum number of seconds that writing a single screenshot can take
+screenshot_timeout = 30
+
+# The default maximum number of seconds that a single test can take, excluding the time
+# to start OpenSpace. Can be overwritten by the `timeout` of a test file
+test_timeout = 900
+
+# The default maximum number of seconds that a single instruction can take in addition to
+# the time it waits on purpose. Can be overwritten by `instructionTimeout` of a test file
+# or the `timeout` of an instruction
+instruction_timeout = 120
+
+# The number of seconds that OpenSpace has to exit after being terminated before it is
+# killed
+terminate_timeout = 10
+
+# The size of the virtual displays that are used when running without a GPU, which has to
+# fit the window of the window configuration
+headless_screen_size = (1920, 1080)
+
+# The number of images that are uploaded to the server at the same time
+upload_workers = 2
+
+# The maximum number of images that are waiting to be uploaded before the tests are paused
+upload_queue_size = 16
+
+# The number of times an upload is retried after a connection or server error
+upload_retries = 5
+
+# The number of test records that are requested from the server at once
+records_page_size = 100
+
+# The threshold for two pixels to be considered different when comparing images locally.
+# This should match the `comparisonThreshold` of the regression server
+comparison_threshold = 0.1
+
+# The factor by which the difference image is reduced in size for its thumbnail
+thumbnail_scale = 6
+
+# The maximum number of characters of OpenSpace's error stream that are kept for each test
+log_buffer_size = 1024 * 1024
+
+# The maximum number of characters of a single line of OpenSpace's error stream that are
+# kept, so that output without any newlines does not use an unbounded amount of memory
+log_line_size = 64 * 1024
+
+# The zlib compression level with which images are compressed again before they are
+# uploaded, as OpenSpace favors speed over size when writing its screenshots. This is
+# zlib's default level. For 1920x1080 screenshots, level 7 only makes the images 1-4%
+# smaller while taking 30-50% longer, and levels 8 and 9 take 3-8 times as long for
+# another 1-4%, which takes longer than uploading the difference on a local network
+png_compression_level = 6
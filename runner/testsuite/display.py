@@ -0,0 +1,140 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+
+import subprocess
+import threading
+from .constants import headless_screen_size, terminate_timeout
+
+
+
+class Display:
+  """
+  A virtual X display that is provided by an Xvfb process, in which OpenSpace renders
+  with Mesa's llvmpipe software renderer instead of a GPU. The display number is chosen by
+  Xvfb, so that it does not conflict with other displays on the same machine.
+
+   - `threads`: The number of threads that llvmpipe uses for rendering
+  """
+  def __init__(self, threads: int):
+    self.threads = threads
+    width, height = headless_screen_size
+    self.process = subprocess.Popen(
+      [
+        "Xvfb",
+        "-displayfd", "1",
+        "-screen", "0", f"{width}x{height}x24",
+        "-nolisten", "tcp"
+      ],
+      stdout=subprocess.PIPE,
+      stderr=subprocess.DEVNULL
+    )
+    # Xvfb writes the number of the display once it accepts connections
+    line = self.process.stdout.readline()
+    if line.strip() == b"":
+      self.process.wait()
+      raise Exception(f"Xvfb exited with code {self.process.returncode}")
+    self.number = int(line)
+
+
+  def __repr__(self):
+    return f":{self.number}"
+
+
+  def environment(self) -> dict[str, str]:
+    """
+    Returns the environment variables that make OpenSpace use this display and render
+    with llvmpipe using the number of `threads` of this display.
+    """
+    return {
+      "DISPLAY": f":{self.number}",
+      # Prevent the vendor-neutral GL dispatch from picking a GPU driver
+      "__GLX_VENDOR_LIBRARY_NAME": "mesa",
+      "LIBGL_ALWAYS_SOFTWARE": "1",
+      "GALLIUM_DRIVER": "llvmpipe",
+      "LP_NUM_THREADS": str(self.threads)
+    }
+
+
+  def stop(self):
+    """
+    Stops the Xvfb process of this display.
+    """
+    self.process.terminate()
+    try:
+      self.process.wait(timeout=terminate_timeout)
+    except subprocess.TimeoutExpired:
+      self.process.kill()
+      self.process.wait()
+
+
+
+class DisplayPool:
+  """
+  The virtual displays that are used to run OpenSpace on machines without a GPU or a
+  real display. Every OpenSpace instance that runs at the same time gets a display of its
+  own, and displays are reused by later instances instead of starting a new Xvfb process.
+
+   - `threads`: The number of threads that llvmpipe uses for each OpenSpace instance
+  """
+  def __init__(self, threads: int):
+    self.threads = threads
+    self.displays = []
+    self.free = []
+    self.lock = threading.Lock()
+
+
+  def acquire(self) -> Display:
+    """
+    Returns a display that is not used by another OpenSpace instance, starting a new one
+    if all existing displays are in use.
+    """
+    with self.lock:
+      if len(self.free) > 0:
+        return self.free.pop()
+
+    display = Display(self.threads)
+    print(f"Started virtual display {display}")
+    with self.lock:
+      self.displays.append(display)
+    return display
+
+
+  def release(self, display: Display):
+    """
+    Returns a `display` that was `acquire`d to the pool once its instance has finished.
+    """
+    with self.lock:
+      self.free.append(display)
+
+
+  def close(self):
+    """
+    Stops all displays of this pool.
+    """
+    with self.lock:
+      for display in self.displays:
+        display.stop()
+      self.displays = []
+      self.free = []
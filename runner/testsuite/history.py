@@ -0,0 +1,192 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import json
+import os
+import requests
+import threading
+from .constants import records_page_size
+
+
+
+def request_test_records(url: str, **filters):
+  """
+  Requests the test records from the regression server at `url` one page at a time and
+  yields the individual records. The `filters` are passed as query parameters and can be
+  `group`, `hardware`, or `since`. Servers that do not support pages return all records
+  at once, without applying the filters.
+  """
+  params = filters | { "limit": records_page_size }
+  with requests.Session() as session:
+    while True:
+      res = session.get(f"{url}/api/test-records", params=params)
+      if res.status_code != 200:
+        raise Exception(f"Request failed with error {res.status_code}: {res.text}")
+      page = res.json()
+      if isinstance(page, list):
+        yield from page
+        return
+
+      yield from page["records"]
+      if page["next"] is None:
+        return
+      params["cursor"] = page["next"]
+
+
+
+class History:
+  """
+  The timing and the failures of previous runs of each test, which are used to decide in
+  which order the tests are run. The history is either loaded from the regression server
+  or from a local file to which every test run is added. Every test is identified by its
+  group and name, joined by a `/`.
+
+   - `path`: The path to the JSON file in which the local history is stored
+  """
+  def __init__(self, path: str):
+    self.path = path
+    # The number of seconds that the last run of each test took
+    self.timing = {}
+    # The timestamp of the last failed run of each test whose last run failed
+    self.failed = {}
+    self.lock = threading.Lock()
+    if os.path.isfile(path):
+      with open(path) as f:
+        history = json.load(f)
+      if "timing" in history and isinstance(history["timing"], dict):
+        self.timing = history["timing"]
+        self.failed = history.get("failed", {})
+      else:
+        # Earlier versions only stored the timing of each test
+        self.timing = history
+
+
+  def load_server(self, url: str, hardware: str, screenshots: dict[str, str] = {}):
+    """
+    Replaces the history with the test records that were submitted to the regression
+    server at `url` for the provided `hardware`. A test has failed if its last image was
+    not identical to the reference image. The images of tests that take multiple
+    screenshots are submitted under the group and name of the screenshot, which are
+    mapped to the test they belong to by `screenshots`. A test with multiple screenshots
+    has failed if any of them failed. If the server can not be reached, the local history
+    is kept.
+    """
+    timing = {}
+    failed = {}
+    try:
+      for record in request_test_records(url, hardware=hardware):
+        if record["hardware"] != hardware or len(record["data"]) == 0:
+          continue
+
+        key = f"{record['group']}/{record['name']}"
+        key = screenshots.get(key, key)
+        latest = record["data"][-1]
+        timing[key] = max(timing.get(key, 0.0), latest["timing"])
+        if latest["pixelError"] > 0:
+          failed[key] = max(failed.get(key, ""), latest["timeStamp"])
+    except Exception as e:
+      print(f"Could not load test records, using local history instead: {e}")
+      return
+
+    self.timing = timing
+    self.failed = failed
+
+
+  def add(self, key: str, timing: float, failed: str | None = None):
+    """
+    Stores the `timing` of a test run of the test `key`. If the run failed, `failed` is
+    the timestamp of the run, otherwise the test is no longer considered failed. The
+    change is only written to disk by `save`.
+    """
+    with self.lock:
+      self.timing[key] = timing
+      if failed is not None:
+        self.failed[key] = failed
+      else:
+        self.failed.pop(key, None)
+
+
+  def save(self):
+    """
+    Writes the timing and the failures of all tests to disk.
+    """
+    with self.lock:
+      with open(self.path, "w") as f:
+        json.dump({ "timing": self.timing, "failed": self.failed }, f, indent=2)
+
+
+  def expected_timing(self, key: str) -> float:
+    """
+    Returns the number of seconds that the test `key` is expected to take. For tests that
+    have not been run before, the average of all known tests is used.
+    """
+    if key in self.timing:
+      return self.timing[key]
+    elif len(self.timing) > 0:
+      return sum(self.timing.values()) / len(self.timing)
+    else:
+      return 0.0
+
+
+
+def order_tests(tests: list[str], keys: list[str], history: History,
+                policy: str) -> list[str]:
+  """
+  Returns the `tests` in the order in which they should be run according to the `policy`.
+  The `keys` contain the group and name of each test in the same order as the `tests`.
+  The available policies are:
+    - `default`: The order in which the tests were provided
+    - `longest`: The tests that take the longest are run first. When running tests in
+                 parallel, this reduces the time at the end of the run where only few
+                 instances are still busy
+    - `failed`: The tests that failed the last time they were run come first, ordered by
+                how recently they failed, followed by all other tests
+  """
+  entries = list(zip(tests, keys))
+  match policy:
+    case "default":
+      pass
+    case "longest":
+      entries.sort(key=lambda e: history.expected_timing(e[1]), reverse=True)
+    case "failed":
+      failed = [e for e in entries if e[1] in history.failed]
+      failed.sort(key=lambda e: history.failed[e[1]], reverse=True)
+      entries = failed + [e for e in entries if e[1] not in history.failed]
+    case _:
+      raise Exception(f"Unknown ordering policy '{policy}'")
+  return [e[0] for e in entries]
+
+
+
+def predict_duration(keys: list[str], history: History, jobs: int) -> float:
+  """
+  Returns the number of seconds that running the tests `keys` in this order is expected to
+  take with `jobs` instances running at the same time. Every test is given to the
+  instance that becomes available first, the same as when the tests are run.
+  """
+  instances = [0.0] * max(jobs, 1)
+  for key in keys:
+    i = instances.index(min(instances))
+    instances[i] += history.expected_timing(key)
+  return max(instances)
@@ -0,0 +1,219 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import hashlib
+import io
+import os
+import zlib
+from .constants import png_compression_level
+
+# Pillow and NumPy are only needed for the image functions and are optional otherwise
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+
+
+def pixel_hash(data: bytes) -> str | None:
+  """
+  Returns the hash of the pixels of the PNG image with the encoded `data` as it is
+  computed by the regression server. The hash is the SHA-256 of the image size in the form
+  `{width}x{height}` followed by a newline and the 8-bit RGBA values of all pixels. As the
+  hash does not depend on how the image was encoded, the server can use it to recognize
+  an image it already has without decoding it. If Pillow is not installed, `None` is
+  returned and the server computes the hash instead.
+  """
+  if Image is None:
+    return None
+
+  with Image.open(io.BytesIO(data)) as image:
+    rgba = image.convert("RGBA")
+    hash = hashlib.sha256(f"{rgba.width}x{rgba.height}\n".encode())
+    hash.update(rgba.tobytes())
+    return hash.hexdigest()
+
+
+
+# The signature at the start of every PNG file
+Png_Signature = b"\x89PNG\r\n\x1a\n"
+
+# The chunks that are kept when compressing a PNG image. All other chunks are ancillary
+# chunks with information such as the creation time or color profiles that don't affect
+# the pixel values. `tRNS` is ancillary as well, but changes the pixel values
+Png_Kept_Chunks = [ b"IHDR", b"PLTE", b"tRNS", b"IDAT", b"IEND" ]
+
+
+
+def png_chunk(type: bytes, body: bytes) -> bytes:
+  """
+  Returns the encoded PNG chunk with the provided `type` and `body`.
+  """
+  crc = zlib.crc32(type + body)
+  return len(body).to_bytes(4, "big") + type + body + crc.to_bytes(4, "big")
+
+
+
+def compress_png(data: bytes) -> bytes:
+  """
+  Returns the PNG image with the encoded `data` compressed losslessly with the
+  `png_compression_level`. The image data is compressed again without changing the
+  filters of its rows and all ancillary chunks that don't influence the pixel values are
+  removed. If the image can not be made smaller or is not a valid PNG image, the `data`
+  is returned unchanged.
+  """
+  if not data.startswith(Png_Signature):
+    return data
+
+  chunks = []
+  idat = []
+  offset = len(Png_Signature)
+  while offset + 12 <= len(data):
+    length = int.from_bytes(data[offset:offset + 4], "big")
+    type = data[offset + 4:offset + 8]
+    body = data[offset + 8:offset + 8 + length]
+    offset = offset + 12 + length
+    if type == b"IDAT":
+      # All image data is written into a single chunk at the position of the first one
+      if len(idat) == 0:
+        chunks.append((type, None))
+      idat.append(body)
+    elif type in Png_Kept_Chunks:
+      chunks.append((type, body))
+
+  try:
+    pixels = zlib.decompress(b"".join(idat))
+  except zlib.error:
+    return data
+  compressed = zlib.compress(pixels, png_compression_level)
+
+  result = [Png_Signature]
+  for type, body in chunks:
+    result.append(png_chunk(type, compressed if type == b"IDAT" else body))
+  result = b"".join(result)
+  return result if len(result) < len(data) else data
+
+
+
+def can_compare_images() -> bool:
+  """
+  Returns whether the packages that are needed for `compare_images` and `pixel_error`
+  are installed.
+  """
+  return Image is not None and np is not None
+
+
+
+def yiq(rgba):
+  """
+  Converts an array of RGBA pixels into the Y, I, and Q components of the YIQ color
+  space. Transparent pixels are blended with a white background first.
+  """
+  rgb = rgba[..., :3].astype(np.float64)
+  alpha = rgba[..., 3:4].astype(np.float64) / 255.0
+  rgb = 255.0 + (rgb - 255.0) * alpha
+  r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+  y = r * 0.29889531 + g * 0.58662247 + b * 0.11448223
+  i = r * 0.59597799 - g * 0.27417610 - b * 0.32180189
+  q = r * 0.21147017 - g * 0.52261711 + b * 0.31114694
+  return y, i, q
+
+
+
+def different_pixels(reference, candidate, threshold: float):
+  """
+  Returns an array that is `True` for every pixel that differs between the `reference`
+  and `candidate` arrays of RGBA pixels, which have to be of the same size. Two pixels
+  are considered different if the perceived distance of their colors in the YIQ color
+  space is larger than `threshold`, which is a value between 0 and 1.
+  """
+  y1, i1, q1 = yiq(reference)
+  y2, i2, q2 = yiq(candidate)
+  delta = 0.5053 * (y1 - y2)**2 + 0.299 * (i1 - i2)**2 + 0.1957 * (q1 - q2)**2
+  # 35215 is the largest possible value of `delta` between two colors
+  return delta > 35215 * threshold * threshold
+
+
+
+def pixel_error(reference: str, candidate: str, threshold: float) -> float | None:
+  """
+  Returns the ratio of the pixels that differ between the `reference` and the `candidate`
+  image files in the same way as `compare_images`, but without creating a difference
+  image. Returns `None` if the images have a different size.
+  """
+  with Image.open(reference) as image:
+    ref = np.asarray(image.convert("RGBA"))
+  with Image.open(candidate) as image:
+    cand = np.asarray(image.convert("RGBA"))
+  if ref.shape != cand.shape:
+    return None
+
+  different = different_pixels(ref, cand, threshold)
+  return float(np.count_nonzero(different) / different.size)
+
+
+
+def compare_images(reference: str, candidate: str, difference: str,
+                   threshold: float, thumbnail_scale: int) -> float | None:
+  """
+  Compares the `reference` image with the `candidate` image in the same way as the
+  regression server does and stores the resulting difference image at `difference`,
+  together with a thumbnail that is reduced in size by `thumbnail_scale`. Two pixels are
+  considered different if the perceived distance of their colors in the YIQ color space
+  is larger than `threshold`, which is a value between 0 and 1. Differing pixels are
+  drawn in red, all other pixels are drawn as a faded grayscale version of the reference
+  image. Unlike the server, anti-aliased pixels are not detected separately.
+
+  Returns the ratio of differing pixels to all pixels or `None` if the images have a
+  different size.
+  """
+  with Image.open(reference) as image:
+    ref = np.asarray(image.convert("RGBA"))
+  with Image.open(candidate) as image:
+    cand = np.asarray(image.convert("RGBA"))
+  if ref.shape != cand.shape:
+    return None
+
+  different = different_pixels(ref, cand, threshold)
+
+  rgb = ref[..., :3].astype(np.float64)
+  gray = rgb[..., 0] * 0.29889531 + rgb[..., 1] * 0.58662247 + rgb[..., 2] * 0.11448223
+  gray = 255.0 + (gray - 255.0) * 0.1 * ref[..., 3] / 255.0
+  result = np.empty(ref.shape, dtype=np.uint8)
+  result[..., 0] = np.where(different, 255, gray)
+  result[..., 1] = np.where(different, 0, gray)
+  result[..., 2] = np.where(different, 0, gray)
+  result[..., 3] = 255
+
+  image = Image.fromarray(result, "RGBA")
+  image.save(difference)
+  size = (max(image.width // thumbnail_scale, 1), max(image.height // thumbnail_scale, 1))
+  base, ext = os.path.splitext(difference)
+  image.resize(size).save(f"{base}-thumbnail{ext}")
+
+  return np.count_nonzero(different) / different.size
@@ -22,7 +22,17 @@
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
 ##########################################################################################
 
+import asyncio
+import glob
+import os
 import time
+from .constants import screenshot_timeout
+from .trace import tracer
+
+
+
+# The last 12 bytes of every valid PNG file, consisting of the empty IEND chunk
+Png_Trailer = bytes.fromhex("0000000049454e44ae426082")
 
 
 
@@ -42,6 +52,97 @@ Allowed_Types = [
 
 
 
+async def wait_for_screenshot(folder: str, existing: list[str]) -> str:
+  """
+  Waits until a new image has been completely written into the provided `folder` and
+  returns the path to that image. An image is new if it is not in the list of `existing`
+  images. It is considered completely written once it ends with the PNG trailer and its
+  size did not change between two checks. An Exception is raised if no image was written
+  within `screenshot_timeout` seconds.
+  """
+  deadline = time.perf_counter() + screenshot_timeout
+  sizes = {}
+  while time.perf_counter() < deadline:
+    for file in glob.glob(f"{folder}/*.png"):
+      if file in existing:
+        continue
+
+      try:
+        size = os.path.getsize(file)
+        with open(file, "rb") as f:
+          f.seek(max(size - len(Png_Trailer), 0))
+          trailer = f.read()
+      except OSError:
+        # The file might not be accessible while OpenSpace is still writing it
+        continue
+
+      if trailer == Png_Trailer and sizes.get(file) == size:
+        return file
+      sizes[file] = size
+
+    await asyncio.sleep(0.02)
+
+  raise Exception(f"No screenshot was written within {screenshot_timeout} seconds")
+
+
+
+def lua_value(value) -> str:
+  """
+  Converts the provided Python `value` into its representation as a Lua literal. Lists
+  are converted into Lua arrays and dictionaries into Lua tables.
+  """
+  if value is None:
+    return "nil"
+  elif isinstance(value, bool):
+    return "true" if value else "false"
+  elif isinstance(value, (int, float)):
+    return repr(value)
+  elif isinstance(value, str):
+    escaped = value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return f"\"{escaped}\""
+  elif isinstance(value, list):
+    return "{ " + ", ".join([lua_value(v) for v in value]) + " }"
+  elif isinstance(value, dict):
+    # Lua arrays are transmitted as tables with 1-based string keys, which have to be
+    # turned back into numbers to be treated as array indices by Lua again
+    keys = [int(k) if isinstance(k, str) and k.isdigit() else k for k in value.keys()]
+    entries = [f"[{lua_value(k)}] = {lua_value(v)}" for k, v in zip(keys, value.values())]
+    return "{ " + ", ".join(entries) + " }"
+  else:
+    raise Exception(f"Value '{value}' can not be converted to Lua")
+
+
+
+def is_timeout(value) -> bool:
+  """
+  Returns whether the provided `value` from a test file is a valid number of seconds for a
+  timeout.
+  """
+  return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+
+async def run_lua(openspace, statements: list[str]):
+  """
+  Runs all of the provided Lua `statements` as a single script in OpenSpace and waits
+  until the script has been executed. Each statement is protected individually, so that
+  an error in one statement does not prevent the following statements from running. The
+  error messages of all failed statements are printed.
+  """
+  script = "local errors = {}\n"
+  for statement in statements:
+    script += f"local ok, e = pcall(function() {statement}\nend)\n"
+    script += "if not ok then errors[#errors + 1] = tostring(e) end\n"
+  script += "return errors"
+
+  result = await openspace.__api__.executeLuaScript(script, True, False)
+  if result and result.get("1"):
+    errors = result["1"]
+    for error in errors.values() if isinstance(errors, dict) else errors:
+      print(f"    Lua error: {error}")
+
+
+
 class Instruction:
   """
   This object represents an individual test instruction. An entire test is made up of many
@@ -67,6 +168,12 @@ class Instruction:
 
     self.value = obj["value"]
 
+    # The number of seconds this instruction can take before it is considered to hang, or
+    # `None` to use the timeout of the test
+    self.timeout = obj.get("timeout")
+    if self.timeout is not None and not is_timeout(self.timeout):
+      raise Exception(f"Invalid timeout '{self.timeout}'")
+
 
 
   def __repr__(self):
@@ -82,12 +189,123 @@ class Instruction:
 
 
 
-  async def run(self, openspace):
+  def screenshot_name(self) -> str | None:
+    """
+    Returns the name of a screenshot instruction, which is provided as its `value`, or
+    `None` if the screenshot was not named.
+    """
+    return self.value if isinstance(self.value, str) else None
+
+
+
+  def allowed_time(self, default: float) -> float:
+    """
+    Returns the number of seconds after which this instruction is considered to hang. This
+    is the `timeout` of this instruction or the `default` if it has none. A wait
+    instruction additionally gets the time it is supposed to wait.
+    """
+    timeout = self.timeout if self.timeout is not None else default
+    if self.type == "wait":
+      timeout = timeout + float(self.value)
+    return timeout
+
+
+
+  def is_asynchronous(self):
+    """
+    Returns whether the effect of this instruction continues after OpenSpace has handled
+    it, which is the case for adding assets and starting playbacks, as these finish over
+    multiple frames.
+    """
+    return self.type in [ "asset", "recording" ]
+
+
+
+  def is_acknowledged(self):
+    """
+    Returns whether OpenSpace has finished handling this instruction once `run` returns.
+    This is the case for all instructions that call a function of the OpenSpace API, as
+    these wait for the function's return value, except for asynchronous instructions.
+    Scripts are sent without waiting for a return value.
+    """
+    return not self.is_asynchronous() and self.type != "script"
+
+
+
+  def can_batch(self):
+    """
+    Returns whether this instruction only changes the state of OpenSpace and can thus be
+    combined with neighboring instructions into a single Lua script.
+    """
+    return self.type not in [ "screenshot", "wait" ]
+
+
+
+  def navigation_state(self):
+    """
+    Returns the navigation state table for a `navigationstate` instruction.
+    """
+    v = {
+      "Anchor": self.value["anchor"],
+      "Position": self.value["position"]
+    }
+    if "aim" in self.value:
+      v["Aim"] = self.value["aim"]
+    if "referenceFrame" in self.value:
+      v["ReferenceFrame"] = self.value["referenceFrame"]
+    if "up" in self.value:
+      v["Up"] = self.value["up"]
+    if "yaw" in self.value:
+      v["Yaw"] = self.value["yaw"]
+    if "pitch" in self.value:
+      v["Pitch"] = self.value["pitch"]
+    if "timestamp" in self.value:
+      v["Timestamp"] = self.value["timestamp"]
+    return v
+
+
+
+  def to_lua(self):
+    """
+    Returns the Lua code that has the same effect as running this instruction. This is
+    only possible for instructions that can be batched, for all others an Exception is
+    raised.
+    """
+    match self.type:
+      case "action":
+        return f"openspace.action.triggerAction({lua_value(self.value)})"
+      case "asset":
+        return f"openspace.asset.add({lua_value(self.value)})"
+      case "deltatime":
+        return f"openspace.time.setDeltaTime({lua_value(self.value)})"
+      case "navigationstate":
+        state = lua_value(self.navigation_state())
+        timestamp = lua_value("timestamp" in self.value)
+        return f"openspace.navigation.setNavigationState({state}, {timestamp})"
+      case "pause":
+        return f"openspace.time.setPause({lua_value(self.value)})"
+      case "property":
+        prop = lua_value(self.value["property"])
+        val = lua_value(self.value["value"])
+        return f"openspace.setPropertyValue({prop}, {val})"
+      case "recording":
+        return f"openspace.sessionRecording.startPlayback({lua_value(self.value)})"
+      case "script":
+        return self.value
+      case "time":
+        return f"openspace.time.setTime({lua_value(self.value)})"
+      case _:
+        raise Exception(f"Instruction type '{self.type}' can not be converted to Lua")
+
+
+
+  async def run(self, openspace) -> str | None:
     """
     Runs this instruction against the OpenSpace API object `openspace` that was passed to
     this function. If this instruction is not a valid instruction, either because it has
     a type that is not recognized, or it is missing essential parameters, an Exception is
-    raised.
+    raised. For screenshot instructions, the path to the image that was written by this
+    instruction is returned, for all other instructions `None`.
     """
 
     match self.type:
@@ -104,23 +322,7 @@ class Instruction:
         await openspace.time.setDeltaTime(self.value)
 
       case "navigationstate":
-        v = {
-          "Anchor": self.value["anchor"],
-          "Position": self.value["position"]
-        }
-        if "aim" in self.value:
-          v["Aim"] = self.value["aim"]
-        if "referenceFrame" in self.value:
-          v["ReferenceFrame"] = self.value["referenceFrame"]
-        if "up" in self.value:
-          v["Up"] = self.value["up"]
-        if "yaw" in self.value:
-          v["Yaw"] = self.value["yaw"]
-        if "pitch" in self.value:
-          v["Pitch"] = self.value["pitch"]
-        if "timestamp" in self.value:
-          v["Timestamp"] = self.value["timestamp"]
-
+        v = self.navigation_state()
         print(f"    NavigationState: {v}")
         await openspace.navigation.setNavigationState(v, "timestamp" in self.value)
 
@@ -139,14 +341,17 @@ class Instruction:
         await openspace.sessionRecording.startPlayback(self.value)
 
       case "screenshot":
-        print("    Take Screenshot")
+        name = self.screenshot_name()
+        print(f"    Take Screenshot: {name}" if name else "    Take Screenshot")
+        folder = openspace.__screenshots__
+        existing = glob.glob(f"{folder}/*.png")
         await openspace.takeScreenshot()
-        # Give the screenshot writing some time to finish. It will be a maximum of two
-        # frames to write a screenshot + whatever time it takes to write the actual
-        # screenshot. The writing should be on the order of 100 ms + about 35 ms for two
-        # frames get us to 135 ms. Lets be on the safe side with a 15x margin and go for
-        # a wait of 2 seconds
-        time.sleep(2)
+        # Writing the screenshot takes up to two frames plus the time it takes to encode
+        # the image, so we wait until the new image appears in the screenshot folder
+        with tracer.span("screenshot wait", "instruction"):
+          file = await wait_for_screenshot(folder, existing)
+        print(f"    Screenshot written: {file}")
+        return file
 
       case "script":
         print(f"    Script: {self.value}")
@@ -158,7 +363,7 @@ class Instruction:
 
       case "wait":
         print(f"    Wait: {self.value}")
-        time.sleep(int(self.value))
+        await asyncio.sleep(float(self.value))
 
       case _:
         raise Exception(f"Unrecognized instruction type '{type}'")
@@ -0,0 +1,128 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import collections
+import re
+import threading
+from .constants import log_buffer_size, log_line_size
+
+# OpenSpace writes the level of each log message in parentheses in front of the message
+Error_Pattern = re.compile(r"\((Error|Fatal)\)")
+Warning_Pattern = re.compile(r"\(Warning\)")
+
+
+
+class Log:
+  """
+  The part of OpenSpace's error stream that was written during a test. It has the
+  following members:
+    - `text`: The content of the error stream. If more than `log_buffer_size` characters
+              were written, only the last lines are contained. Of every line, only the
+              first `log_line_size` characters are contained
+    - `lines`: The number of non-empty lines that were written, including the lines that
+               are not contained in `text`
+    - `errors`: The number of lines that contained an error message
+    - `warnings`: The number of lines that contained a warning message
+  """
+  def __init__(self, text: str = "", lines: int = 0, errors: int = 0, warnings: int = 0):
+    self.text = text
+    self.lines = lines
+    self.errors = errors
+    self.warnings = warnings
+
+
+
+class LogCapture:
+  """
+  Collects the lines of OpenSpace's error stream while they are being written. Errors and
+  warnings are counted as the lines arrive, but only the last `log_buffer_size` characters
+  and only the first `log_line_size` characters of each line are kept in memory, so that
+  an instance that logs a lot or writes without newlines does not use an unbounded
+  amount of memory. The lines are added from the thread that reads the error stream and
+  taken from the thread that runs the tests.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self._reset()
+
+
+  def _reset(self):
+    self.buffer = collections.deque()
+    self.size = 0
+    self.omitted = 0
+    self.shortened = 0
+    self.lines = 0
+    self.errors = 0
+    self.warnings = 0
+
+
+  def append(self, line: str):
+    """
+    Adds a single `line` of the error stream. If the `line` does not end with a newline,
+    it is only the first part of a long line and the following calls add its remainder.
+    """
+    with self.lock:
+      if len(self.buffer) > 0 and not self.buffer[-1].endswith("\n"):
+        # The line continues the latest line, which has already been counted
+        previous = self.buffer.pop()
+        self.size -= len(previous)
+        line = previous + line
+      else:
+        if line.strip() != "":
+          self.lines += 1
+        if Error_Pattern.search(line):
+          self.errors += 1
+        elif Warning_Pattern.search(line):
+          self.warnings += 1
+
+      if len(line) > log_line_size:
+        # Keep the start of the line, which contains the level of the message, and its
+        # newline so that the next line is not considered part of this one
+        newline = "\n" if line.endswith("\n") else ""
+        kept = log_line_size - len(newline)
+        self.shortened += len(line) - len(newline) - kept
+        line = line[:kept] + newline
+
+      self.buffer.append(line)
+      self.size += len(line)
+      # Drop the oldest lines, but always keep the latest line even if it is too long
+      while self.size > log_buffer_size and len(self.buffer) > 1:
+        self.size -= len(self.buffer.popleft())
+        self.omitted += 1
+
+
+  def take(self) -> Log:
+    """
+    Returns everything that was written to the error stream since the last time this
+    function was called.
+    """
+    with self.lock:
+      text = "".join(self.buffer)
+      if self.shortened > 0:
+        text = f"[{self.shortened} characters of long lines were omitted]\n{text}"
+      if self.omitted > 0:
+        text = f"[{self.omitted} earlier lines were omitted]\n{text}"
+      log = Log(text, self.lines, self.errors, self.warnings)
+      self._reset()
+      return log
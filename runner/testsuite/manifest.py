@@ -0,0 +1,150 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import hashlib
+import json
+import os
+import threading
+from .test import Test
+
+
+
+def hash_file(hash, path: str):
+  """
+  Adds the contents of the file at `path` to the `hash`. If the file does not exist, only
+  its path is added, so that a file that is created later changes the hash as well.
+  """
+  hash.update(path.encode())
+  if not os.path.isfile(path):
+    return
+
+  with open(path, "rb") as f:
+    while chunk := f.read(1024 * 1024):
+      hash.update(chunk)
+
+
+
+def find_data_file(base_path: str, folder: str, name: str, extension: str) -> str:
+  """
+  Returns the path of a profile or asset with the provided `name` inside the OpenSpace
+  folder `base_path`. Files in the `user` folder take precedence over the files that are
+  shipped with OpenSpace, the same as when OpenSpace is loading them.
+  """
+  user = f"{base_path}/user/data/{folder}/{name}{extension}"
+  return user if os.path.isfile(user) else f"{base_path}/data/{folder}/{name}{extension}"
+
+
+
+def test_fingerprint(test: Test, base_path: str) -> str:
+  """
+  Returns a hash over all files that influence the result of the `test` except for the
+  OpenSpace executable itself. These are the test file, the profile that is used by the
+  test, the assets that are loaded by the profile, and the assets that are added by the
+  test.
+  """
+  hash = hashlib.sha256()
+  hash_file(hash, test.test_path)
+
+  profile = find_data_file(base_path, "profiles", test.profile, ".profile")
+  hash_file(hash, profile)
+  assets = []
+  if os.path.isfile(profile):
+    try:
+      with open(profile) as f:
+        assets += json.load(f).get("assets", [])
+    except json.JSONDecodeError:
+      # Older profiles are not stored as JSON, but their contents are part of the hash
+      pass
+
+  assets += [i.value for i in test.instructions if i.type == "asset"]
+  for asset in assets:
+    hash_file(hash, find_data_file(base_path, "assets", asset, ".asset"))
+
+  return hash.hexdigest()
+
+
+
+def executable_fingerprint(executable: str) -> str:
+  """
+  Returns a hash of the OpenSpace `executable`. The commit of OpenSpace is only known once
+  OpenSpace is running, so the binary itself is used to detect whether OpenSpace changed
+  before deciding which tests have to run.
+  """
+  hash = hashlib.sha256()
+  hash_file(hash, executable)
+  return hash.hexdigest()
+
+
+
+class Manifest:
+  """
+  Remembers the inputs of every test at the time it was last run successfully, which
+  makes it possible to only run the tests whose inputs have changed since then. For each
+  test, the manifest stores the fingerprint of the test's files, the fingerprint of the
+  OpenSpace executable, and the OpenSpace commit that was reported by the test run. A
+  test counts as successful once its image was submitted to the server or, if no server
+  is configured, was stored locally.
+
+   - `path`: The path to the JSON file in which the manifest is stored
+  """
+  def __init__(self, path: str):
+    self.path = path
+    self.entries = {}
+    self.lock = threading.Lock()
+    if os.path.isfile(path):
+      with open(path) as f:
+        self.entries = json.load(f)
+
+
+  def is_current(self, key: str, fingerprint: str, executable: str) -> bool:
+    """
+    Returns whether the test `key` was last run successfully with the same test
+    `fingerprint` and `executable` fingerprint.
+    """
+    entry = self.entries.get(key)
+    if entry is None:
+      return False
+    return entry["test"] == fingerprint and entry["executable"] == executable
+
+
+  def update(self, key: str, fingerprint: str, executable: str, commit: str):
+    """
+    Records that the test `key` was run successfully with the provided fingerprints on
+    the OpenSpace `commit`. The change is only written to disk by `save`.
+    """
+    with self.lock:
+      self.entries[key] = {
+        "test": fingerprint,
+        "executable": executable,
+        "commit": commit
+      }
+
+
+  def save(self):
+    """
+    Writes the manifest to disk.
+    """
+    with self.lock:
+      with open(self.path, "w") as f:
+        json.dump(self.entries, f, indent=2)
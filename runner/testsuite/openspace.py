@@ -23,12 +23,29 @@
 ##########################################################################################
 
 import asyncio
+import datetime
 import glob
 import os
+import queue
+import shutil
 import subprocess
+import threading
 import time
 from openspace import Api
-from .test import Test, TestResult
+from .constants import (instruction_timeout, log_line_size, shutdown_timeout,
+  startup_timeout, terminate_timeout, test_timeout)
+from .instruction import lua_value, run_lua
+from .display import DisplayPool
+from .log import Log, LogCapture
+from .test import Test, TestResult, measure_stability
+from .trace import tracer
+from .worker import Port_Variable, Screenshots_Variable, Worker
+
+
+
+# The first line of the override files written by `write_configuration_overwrite`, which
+# distinguishes them from override files that were written by the user
+Override_Marker = "-- Written by the visual testing runner\n"
 
 
 
@@ -36,17 +53,36 @@ def write_configuration_overwrite(base_path, data_path):
   """
   Creates a openspace.cfg override file that sets up a common testing environment. These
   are mostly for enabling caching to reduce the amount of testing and removing as much of
-  the logging as possible which would otherwise pollute the usage results
+  the logging as possible which would otherwise pollute the usage results. If `data_path`
+  is `None`, the caching is not changed. An existing override file that was not written
+  by the runner is moved aside and put back by `restore_configuration_overwrite`
   """
-  with open(f"{base_path}/openspace.cfg.override", "w") as f:
-    # Use a common sync folder outside of the build to prevent redownloading of data
-    sync_location = f"{data_path}/sync"
-    f.write(f"Paths.SYNC = [[{sync_location}]]\n")
-
-    # Enable MRF caching for the same reason and to reduce dependency on external servers
-    mrf_location = f"{data_path}/mrf"
-    f.write("ModuleConfigurations.GlobeBrowsing.MRFCacheEnabled = true\n")
-    f.write(f"ModuleConfigurations.GlobeBrowsing.MRFCacheLocation = [[{mrf_location}]]\n")
+  path = f"{base_path}/openspace.cfg.override"
+  backup = f"{path}.backup"
+  if os.path.exists(path):
+    with open(path) as f:
+      written_by_runner = f.readline() == Override_Marker
+    if not written_by_runner:
+      if os.path.exists(backup):
+        raise Exception(f"Both '{path}' and '{backup}' exist. Remove the one that is not "
+          "needed anymore")
+      os.replace(path, backup)
+
+  with open(path, "w") as f:
+    f.write(Override_Marker)
+
+    if data_path is not None:
+      # Use a common sync folder outside of the build to prevent redownloading of data
+      sync_location = f"{data_path}/sync"
+      f.write(f"Paths.SYNC = [[{sync_location}]]\n")
+
+      # Enable MRF caching for the same reason and to reduce dependency on external
+      # servers
+      mrf_location = f"{data_path}/mrf"
+      f.write("ModuleConfigurations.GlobeBrowsing.MRFCacheEnabled = true\n")
+      f.write(
+        f"ModuleConfigurations.GlobeBrowsing.MRFCacheLocation = [[{mrf_location}]]\n"
+      )
 
     # Disable the UI as it contains different time-dependent content
     f.write(f"ModuleConfigurations.CefWebGui.Enabled = false\n")
@@ -60,58 +96,541 @@ def write_configuration_overwrite(base_path, data_path):
     # We can reduce the amount of time that we have to wait for OpenSpace to shut down
     f.write("ShutdownCountdown = 0.25\n")
 
+    # When running multiple instances at the same time, each instance needs its own ports
+    # and screenshot folder. These are passed as environment variables by the runner
+    f.write(f"""
+local port = os.getenv("{Port_Variable}")
+if port then
+  for _, interface in ipairs(ModuleConfigurations.Server.Interfaces) do
+    if interface.Type == "TcpSocket" then
+      interface.Port = tonumber(port)
+    else
+      interface.Port = tonumber(port) + 1
+    end
+  end
+end
+local screenshots = os.getenv("{Screenshots_Variable}")
+if screenshots then
+  Paths.SCREENSHOTS = screenshots
+end
+""")
+
+
+
+def restore_configuration_overwrite(base_path):
+  """
+  Removes the openspace.cfg override file that was created by
+  `write_configuration_overwrite` and puts back the override file that existed before.
+  """
+  path = f"{base_path}/openspace.cfg.override"
+  if os.path.exists(f"{path}.backup"):
+    os.replace(f"{path}.backup", path)
+  elif os.path.exists(path):
+    os.remove(path)
+
+
+
+def setup_test_statements():
+  """
+  Returns the Lua statements that setup settings that are common to all test runs. These
+  are, in general, settings that are reasonably different between runs of OpenSpace,
+  such as the local time, the commit hash, and others
+  """
+  return [
+    # We always want to start paused to prevent some timing-related inconsistencies
+    "openspace.time.setPause(true)",
+
+    # Unless explicitly added, we don't want display elements that show variable content
+    #  Dashboard: Framerate
+    #  ScreenLog: Log message retention
+    #  Version: Contains the commit hash
+    #  Camera: Not technically needed, but results in a cleaner time
+    "openspace.setPropertyValueSingle('Dashboard.IsEnabled', false)",
+    "openspace.setPropertyValueSingle('RenderEngine.ShowLog', false)",
+    "openspace.setPropertyValueSingle('RenderEngine.ShowVersion', false)",
+    "openspace.setPropertyValueSingle('RenderEngine.ShowCamera', false)"
+  ]
+
 
 
 async def setup_test_run(openspace):
   """
-  Setup settings that are common to all test runs. These are, in general, settings that
-  are reasonably different between runs of OpenSpace, such as the local time, the commit
-  hash, and others
+  Applies the settings from `setup_test_statements` in a single roundtrip to OpenSpace.
   """
-  # We always want to start paused to prevent some timing-related inconsistencies
-  await openspace.time.setPause(True)
+  await run_lua(openspace, setup_test_statements())
+
 
-  # Unless explicitly added, we don't want display elements that show variable content
-  #  Dashboard: Framerate
-  #  ScreenLog: Log message retention
-  #  Version: Contains the commit hash
-  #  Camera: Not technically needed, but results in a cleaner time
-  await openspace.setPropertyValueSingle("Dashboard.IsEnabled", False)
-  await openspace.setPropertyValueSingle("RenderEngine.ShowLog", False)
-  await openspace.setPropertyValueSingle("RenderEngine.ShowVersion", False)
-  await openspace.setPropertyValueSingle("RenderEngine.ShowCamera", False)
+
+async def store_initial_state(openspace):
+  """
+  Retrieves the parts of OpenSpace's state that tests commonly modify and that are not
+  covered by `setup_test_run`, such as the simulation time and the camera position. The
+  returned object can be passed to `reset_test_run` to return to this state later.
+  """
+  return {
+    "time": await openspace.time.currentTimeUTC(),
+    "deltatime": await openspace.time.deltaTime(),
+    "navigationstate": await openspace.navigation.getNavigationState()
+  }
 
 
 
-async def internal_run(openspace, test):
+async def reset_test_run(openspace, state, assets):
   """
-  This function runs the actual test with the library object passed into it. It first sets
-  up default values, then runs the individual instructions for the test, and retrieves
-  other information such as the screenshot location, and the commit hash from OpenSpace.
+  Resets a running OpenSpace instance after a test has finished so that the next test
+  can run in the same instance. The `assets` that were added by the previous test are
+  removed again, the simulation time and camera are restored from the `state` that was
+  retrieved by `store_initial_state`, and the common settings are reapplied.
+  """
+  # Remove the assets in reverse order so that dependent assets are removed first
+  statements = [f"openspace.asset.remove({lua_value(a)})" for a in reversed(assets)]
+
+  navigation_state = lua_value(state["navigationstate"])
+  statements += [
+    f"openspace.time.setTime({lua_value(state['time'])})",
+    f"openspace.time.setDeltaTime({lua_value(state['deltatime'])})",
+    f"openspace.navigation.setNavigationState({navigation_state}, false)"
+  ]
+
+  # Everything is sent as a single script to avoid one roundtrip per statement
+  await run_lua(openspace, statements + setup_test_statements())
+
+
 
-  This function assumes that the `openspace` library object is already authenticated and
-  connected to the OpenSpace instance and is ready to take commands.
+class Timeouts:
   """
-  print(f"  Starting test")
-  await setup_test_run(openspace)
-  await test.run(openspace)
-  print("  Finished test")
+  The number of seconds after which a test is considered to hang and is aborted. These
+  are the defaults for all tests that can be overwritten by the individual test files.
+   - `test`: The maximum number of seconds a test can take, excluding starting OpenSpace
+   - `instruction`: The maximum number of seconds a single instruction can take in
+                    addition to the time it waits on purpose
+  """
+  def __init__(self, test: float = test_timeout,
+               instruction: float = instruction_timeout):
+    self.test = test
+    self.instruction = instruction
 
-  # Get the location of the screenshot folder from OpenSpace. It should always be the
-  # same but this is just to make sure it will work
-  screenshot_folder = await openspace.absPath("${SCREENSHOTS}")
 
-  # Get the commit hash from OpenSpace itself
-  version = await openspace.version()
-  commit = version["Commit"]
 
-  await openspace.toggleShutdown()
+class Instance:
+  """
+  A running OpenSpace process that was started with a specific profile together with the
+  API connection to it. A single instance can run any number of tests that require the
+  same profile one after another, which saves the time to start OpenSpace and load the
+  profile for all but the first test.
+
+   - `executable`: The path to the OpenSpace executable that should be run
+   - `profile`: The name of the profile with which OpenSpace is started
+   - `worker`: The worker whose ports and folders are used by this instance. If this is
+               `None`, the default settings are used
+   - `timeouts`: The `Timeouts` for the tests that run in this instance. If this is
+                 `None`, the default timeouts are used
+   - `repeat`: The number of times the state at the end of each test is captured to
+               measure the test's stability. No stability is measured if this is 1
+  """
+  def __init__(self, executable: str, profile: str, worker: Worker | None = None,
+               timeouts: Timeouts | None = None, repeat: int = 1):
+    self.executable = executable
+    self.profile = profile
+    self.worker = worker if worker is not None else Worker()
+    self.timeouts = timeouts if timeouts is not None else Timeouts()
+    self.repeat = repeat
+    self.loop = asyncio.new_event_loop()
+    self.process = None
+    self.openspace = None
+    self.commit = ""
+    self.phases = {}
+    self.running = False
+    self.tests_run = 0
+    self.added_assets = []
+
+    # The lines written to the error stream that have not yet been attributed to a test
+    self.log = LogCapture()
+
+
+  def start(self):
+    """
+    Starts OpenSpace as a subprocess using a known configuration file and the profile of
+    this instance and establishes a connection using the Python API.
+    """
+    print(f"  Starting OpenSpace with profile '{self.profile}'")
+    with tracer.span("launch", "openspace", profile=self.profile) as launch:
+      # The executable is resolved as OpenSpace is started in the folder that contains it
+      self.process = subprocess.Popen(
+        [
+          os.path.abspath(self.executable),
+          "--config", self.worker.window_config,
+          "--profile", self.profile,
+          "--bypassLauncher"
+        ],
+        cwd=os.path.dirname(self.executable),
+        env=self.worker.environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+      )
+
+      # The error stream is read continuously so that the log can be attributed to the
+      # individual tests that run in this instance
+      self.log_reader = threading.Thread(target=self._read_log, daemon=True)
+      self.log_reader.start()
+      self.running = True
+
+      self.loop.run_until_complete(self._wait_for_server())
+
+    with tracer.span("connect", "openspace") as connect:
+      self.loop.run_until_complete(self._connect())
+
+    # These phases are attributed to the first test that runs in this instance
+    self.phases = {
+      "startup": launch.duration,
+      "connect": connect.duration
+    }
+
+
+  async def _wait_for_server(self):
+    """
+    Waits until OpenSpace accepts connections on its API port. Instead of waiting for a
+    fixed amount of time, the connection is retried with an exponentially increasing delay
+    between attempts. An Exception is raised if the OpenSpace process exits or if it does
+    not accept a connection within `startup_timeout` seconds.
+    """
+    deadline = time.perf_counter() + startup_timeout
+    delay = 0.1
+    while True:
+      try:
+        port = self.worker.api_port
+        _, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.close()
+        await writer.wait_closed()
+        return
+      except OSError:
+        pass
+
+      if self.process.poll() is not None:
+        code = self.process.returncode
+        raise Exception(f"OpenSpace exited with code {code} while starting up")
+      if time.perf_counter() + delay > deadline:
+        raise Exception(f"OpenSpace did not start within {startup_timeout} seconds")
+
+      await asyncio.sleep(delay)
+      delay = min(delay * 2, 2.0)
+
+
+  async def _while_running(self, coroutine, timeout: float):
+    """
+    Waits for the provided `coroutine` to finish while making sure that the OpenSpace
+    process is still running. An Exception is raised if the process exits or if the
+    `coroutine` has not finished after `timeout` seconds.
+    """
+    task = asyncio.ensure_future(coroutine)
+    deadline = time.perf_counter() + timeout
+    while True:
+      done, _ = await asyncio.wait([task], timeout=0.25)
+      if task in done:
+        return task.result()
+
+      if self.process.poll() is not None:
+        task.cancel()
+        code = self.process.returncode
+        raise Exception(f"OpenSpace exited with code {code}")
+      if time.perf_counter() > deadline:
+        task.cancel()
+        raise TimeoutError(f"OpenSpace did not respond within {timeout} seconds")
+
+
+  def is_running(self) -> bool:
+    """
+    Returns whether this instance has been started and its OpenSpace process is still
+    running. This is not the case anymore after a test failed and OpenSpace was killed.
+    """
+    return self.running and self.process.poll() is None
 
-  return screenshot_folder, commit
 
+  def kill(self):
+    """
+    Stops the OpenSpace process without asking it to shut down, which is used when it is
+    not responding anymore. The process is first asked to terminate and is killed if it
+    has not exited after `terminate_timeout` seconds.
+    """
+    if self.process is None or self.process.poll() is not None:
+      return
+
+    self.process.terminate()
+    try:
+      self.process.wait(timeout=terminate_timeout)
+    except subprocess.TimeoutExpired:
+      print(f"  OpenSpace did not terminate within {terminate_timeout} seconds")
+      self.process.kill()
+      self.process.wait()
+
+
+  def _read_log(self):
+    # Long lines are read in parts, so that a line is never read entirely into memory
+    for line in iter(lambda: self.process.stderr.readline(log_line_size), b""):
+      self.log.append(line.decode(errors="replace"))
 
 
-def run_single_test(test_path, executable) -> TestResult:
+  def take_log(self) -> Log:
+    """
+    Returns the part of the error log that has been written since the last time this
+    function was called.
+    """
+    return self.log.take()
+
+
+  async def _connect(self):
+    """
+    Connects to the OpenSpace instance and retrieves the information that is shared
+    between all tests running in this instance.
+    """
+    print("  Connecting...")
+    self.api = Api("localhost", self.worker.api_port)
+    self.api.connect()
+    # The Python API connects using a blocking socket, which would stall the event loop
+    # while waiting for a message with the selector-based event loop used outside Windows
+    self.api._socket._client.setblocking(False)
+    # OpenSpace only handles messages from the API in its main loop, which starts running
+    # after the profile has finished loading. The first answered request therefore tells
+    # us that OpenSpace is ready to run the test instructions
+    library = self.api.singleReturnLibrary()
+    self.openspace = await self._while_running(library, startup_timeout)
+    # Injecting the main API into the library as we use it in some test instructions
+    self.openspace.__api__ = self.api
+    print("  Connected to OpenSpace")
+
+    # Get the location of the screenshot folder from OpenSpace. It should always be the
+    # same but this is just to make sure it will work
+    self.screenshot_folder = await self.openspace.absPath("${SCREENSHOTS}")
+    # Injecting the folder as the screenshot instructions wait for their image to appear
+    self.openspace.__screenshots__ = self.screenshot_folder
+
+    # Get the commit hash from OpenSpace itself
+    version = await self.openspace.version()
+    self.commit = version["Commit"]
+
+    self.initial_state = await store_initial_state(self.openspace)
+
+
+  def run_test(self, test: Test, clear_screenshots: bool = False) -> TestResult:
+    """
+    Runs the provided `test` in this instance. If another test has been run in this
+    instance before, OpenSpace is reset to the state it had directly after starting up.
+    If `clear_screenshots` is `True`, all images in the screenshot folder are removed
+    before the test runs, so that the images of previous tests do not accumulate. Each
+    image that is written during the test is attributed to the screenshot instruction
+    that was waiting for it, so other images in the folder are never collected.
+
+    If the final state of the test was captured repeatedly, these images are compared to
+    each other for the `stability` of the result and removed afterwards.
+    """
+    if clear_screenshots:
+      for file in glob.glob(f"{self.screenshot_folder}/*.png"):
+        os.remove(file)
+
+    timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    timeout = test.timeout if test.timeout is not None else self.timeouts.test
+    failure = ""
+    with tracer.span("test", "test", test=f"{test.group}/{test.name}") as span:
+      try:
+        run = self._while_running(self._run(test), timeout)
+        phases = self.loop.run_until_complete(run)
+      except TimeoutError:
+        failure = f"Test did not finish within {timeout} seconds"
+      except Exception as e:
+        failure = str(e)
+    self.tests_run = self.tests_run + 1
+
+    if failure != "":
+      print(f"  Test failed: {failure}")
+      # OpenSpace is in an unknown state and might not answer anymore, so it can neither
+      # be shut down regularly nor run any other test
+      self.kill()
+      phases = {}
+
+    stability = None
+    if failure == "" and self.repeat > 1:
+      with tracer.span("stability", "test"):
+        stability = measure_stability(test.final_captures())
+      print(f"  Stability: {stability}")
+    for file in test.repeats:
+      os.remove(file)
+
+    screenshots = test.screenshots
+    folder = None
+    if self.worker.is_isolated():
+      # Move the images out of the screenshot folder so that they are attributed to this
+      # test even if the next test is already running when the result is processed
+      folder = self.worker.result_folder()
+      for screenshot in screenshots:
+        screenshot.file = shutil.move(screenshot.file, folder)
+    print(f"Test images: {screenshots}")
+
+    result = TestResult()
+    result.group = test.group
+    result.name = test.name
+    result.timestamp = timestamp
+    result.screenshots = screenshots + test.untaken_screenshots()
+    result.folder = folder
+    result.timing = span.duration
+    result.phases = self.phases | { "test": span.duration } | phases
+    self.phases = {}
+    result.commit = self.commit
+    result.add_log(self.take_log())
+    result.failure = failure
+    result.stability = stability
+    return result
+
+
+  def failed_result(self, test: Test, failure: str) -> TestResult:
+    """
+    Returns the result for a `test` that could not be run in this instance at all, for
+    example because OpenSpace did not start. None of its screenshots were taken and the
+    result contains everything that was logged so far.
+    """
+    print(f"  Test failed: {failure}")
+    result = TestResult()
+    result.group = test.group
+    result.name = test.name
+    result.timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    test.screenshots = []
+    result.screenshots = test.untaken_screenshots()
+    result.timing = 0.0
+    result.phases = self.phases
+    self.phases = {}
+    result.commit = self.commit
+    result.add_log(self.take_log())
+    result.failure = failure
+    return result
+
+
+  async def _run(self, test: Test) -> dict[str, float]:
+    """
+    This function runs the actual test with the library object of this instance. It first
+    sets up default values, then runs the individual instructions for the test. Returns
+    the number of seconds spent in the phases of the test.
+    """
+    phases = {}
+    if self.tests_run > 0:
+      print("  Resetting OpenSpace")
+      with tracer.span("reset", "test") as span:
+        await reset_test_run(self.openspace, self.initial_state, self.added_assets)
+      phases["reset"] = span.duration
+
+    print(f"  Starting test")
+    with tracer.span("setup", "test") as span:
+      await setup_test_run(self.openspace)
+    phases["setup"] = span.duration
+    durations = await test.run(self.openspace, self._while_running,
+      self.timeouts.instruction, self.repeat)
+    print("  Finished test")
+
+    self.added_assets = [i.value for i in test.instructions if i.type == "asset"]
+    return phases | { f"instruction.{k}": v for k, v in durations.items() }
+
+
+  def stop(self):
+    """
+    Shuts down the OpenSpace instance and waits for the process to finish. Calling this
+    function on an instance that is not running does nothing.
+    """
+    if not self.running:
+      return
+    self.running = False
+
+    with tracer.span("shutdown", "openspace") as span:
+      # OpenSpace is no longer running if it crashed or was killed after a failed test
+      if self.openspace is not None and self.process.poll() is None:
+        async def shutdown():
+          try:
+            # OpenSpace might already exit before it answers this request
+            shutdown = self.openspace.toggleShutdown()
+            await self._while_running(shutdown, shutdown_timeout)
+          except Exception as e:
+            print(f"  {e}")
+
+        self.loop.run_until_complete(shutdown())
+
+        # Wait for OpenSpace to finish shutting down instead of waiting a fixed time
+        try:
+          self.process.wait(timeout=shutdown_timeout)
+        except subprocess.TimeoutExpired:
+          print(f"  OpenSpace did not shut down within {shutdown_timeout} seconds")
+      if self.openspace is not None:
+        self.api.disconnect()
+
+      # Stop the OpenSpace subprocess if it is still running, for example if we never
+      # managed to connect to it
+      self.kill()
+
+      # Cancel the tasks that the API left behind, such as the one receiving messages
+      tasks = asyncio.all_tasks(self.loop)
+      for task in tasks:
+        task.cancel()
+      # Gathering no tasks would create a future that belongs to a different loop
+      if len(tasks) > 0:
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+      self.loop.close()
+
+      # The error stream is closed when the OpenSpace subprocess is finished
+      self.log_reader.join()
+
+    # This phase is attributed to the last test that ran in this instance
+    self.phases = { "shutdown": span.duration }
+
+
+
+def start_instance(instance: Instance) -> str:
+  """
+  Starts the provided `instance` and returns an empty string if it is ready to run tests.
+  If OpenSpace crashed or did not finish loading its profile in time, it is killed and
+  the reason is returned instead, so that the tests that needed it can be reported as
+  failed. If OpenSpace could not be launched at all, the Exception is raised.
+  """
+  try:
+    instance.start()
+    return ""
+  except Exception as e:
+    if instance.process is None:
+      raise
+    instance.kill()
+    return f"OpenSpace did not start: {e}"
+
+
+
+def prewarm(test_paths, executable, worker: Worker | None = None):
+  """
+  Starts OpenSpace once with every profile that is used by the tests provided by
+  `test_paths` and shuts it down again as soon as the profile has finished loading. This
+  fills the caches with the data that is downloaded while loading the profile, so that
+  these downloads are not part of the timing of the first test that uses the profile.
+  OpenSpace failing to start is only reported, as the tests will fail the same way.
+
+   - `test_paths`: The paths to the ostest files whose profiles should be loaded
+   - `executable`: The path to the OpenSpace executable that should be run
+   - `worker`: The worker whose ports and folders are used for running OpenSpace. If this
+               is `None`, the default settings are used
+  """
+  profiles = []
+  for test_path in test_paths:
+    profile = Test(test_path).profile
+    if profile not in profiles:
+      profiles.append(profile)
+
+  for profile in profiles:
+    print(f"Prewarming the caches for profile '{profile}'")
+    instance = Instance(executable, profile, worker)
+    with tracer.span("prewarm", "openspace", profile=profile):
+      try:
+        failure = start_instance(instance)
+        if failure != "":
+          print(f"  {failure}")
+      finally:
+        instance.stop()
+
+
+
+def run_single_test(test_path, executable, worker: Worker | None = None,
+                    timeouts: Timeouts | None = None, repeat: int = 1) -> TestResult:
   """
   Run the single test provided by `test_path` using the OpenSpace executable provided by
   `executable`. This will include starting OpenSpace as a subprocess using a known
@@ -121,68 +640,184 @@ def run_single_test(test_path, executable) -> TestResult:
 
    - `test_path`: The path to the ostest file that should be run. This file must exist
    - `executable`: The path to the OpenSpace executable that should be run for the tests
+   - `worker`: The worker whose ports and folders are used for running the test. If this
+               is `None`, the default settings are used
+   - `timeouts`: The `Timeouts` after which the test is aborted. If this is `None`, the
+                 default timeouts are used
+   - `repeat`: The number of times the final state of the test is captured to measure
+               its stability, see `Instance`
   """
   print(f"Running test: {test_path}")
   test = Test(test_path)
 
+  timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat()
   start_time = time.perf_counter()
-  print("  Starting OpenSpace")
-  process = subprocess.Popen(
-    [
-      executable,
-      "--config", f"{os.getcwd()}/1920-1080.json",
-      "--profile", test.profile,
-      "--bypassLauncher"
-    ],
-    cwd=os.path.dirname(executable),
-    stdout=subprocess.DEVNULL,
-    stderr=subprocess.PIPE
-  )
-
-  # Add a sleeping time instead of repeatedly trying to reconnect. Starting up OpenSpace
-  # in general takes longer than this, so we don't actually lose any time
-  time.sleep(10)
-
-
-  async def mainLoop():
-    """
-    The main loop of an async event loop that is needed for the OpenSpace Python API to
-    work correctly. This will connect to OpenSpace, which then triggers the rest of the
-    test run
-    """
-    print("  Connecting...")
-    os_api = Api("localhost", 4681)
-    os_api.connect()
-    openspace = await os_api.singleReturnLibrary()
-    # Injecting the main API into the library as we use it in some test instructions
-    openspace.__api__ = os_api
-    print("  Connected to OpenSpace")
-    screenshot_folder, commit = await asyncio.create_task(internal_run(openspace, test))
-    os_api.disconnect()
-    return screenshot_folder, commit
-
-  screenshot_folder, commit = asyncio.new_event_loop().run_until_complete(mainLoop())
-
-
-  # Another wait while OpenSpace is shutting down
-  time.sleep(2)
-
-  # Get the error log from the OpenSpace subprocess
-  error_log = process.stderr.read().decode()
-
-  # Kill the OpenSpace subprocess
-  process.kill()
+  instance = Instance(executable, test.profile, worker, timeouts, repeat)
+  try:
+    failure = start_instance(instance)
+    if failure == "":
+      # An isolated screenshot folder only ever contains the images of the current test
+      result = instance.run_test(test, clear_screenshots=instance.worker.is_isolated())
+    else:
+      result = instance.failed_result(test, failure)
+  finally:
+    instance.stop()
   end_time = time.perf_counter()
 
-  # Collect all screenshots taken by the test
-  files = glob.glob(f"{screenshot_folder}/*.png")
-  print(f"Test images: {files}")
-
-  result = TestResult()
-  result.group = test.group
-  result.name = test.name
-  result.files = files
+  # Add everything that was logged while OpenSpace was shutting down
+  result.add_log(instance.take_log())
+  result.phases.update(instance.phases)
+  result.timestamp = timestamp
   result.timing = end_time - start_time
-  result.commit = commit
-  result.error = error_log
   return result
+
+
+
+def run_test_session(test_paths, executable, worker: Worker | None = None,
+                     timeouts: Timeouts | None = None, repeat: int = 1):
+  """
+  Runs all of the tests provided by `test_paths` using the OpenSpace executable provided
+  by `executable`. Instead of starting a new OpenSpace instance for every test, the tests
+  are grouped by their profile and all tests of a group are run in the same instance.
+  Between two tests, the instance is reset into a known state and the screenshot folder
+  is cleared. This function is a generator that yields the `TestResult` of each test as
+  soon as that test is finished. The `timing` of each result only contains the time it
+  took to run the test itself, not the time it took to start OpenSpace. If a test fails
+  and OpenSpace has to be killed, a new instance is started for the remaining tests.
+
+   - `test_paths`: The paths to the ostest files that should be run. These files must
+                   exist
+   - `executable`: The path to the OpenSpace executable that should be run for the tests
+   - `worker`: The worker whose ports and folders are used for running the tests. If this
+               is `None`, the default settings are used
+   - `timeouts`: The `Timeouts` after which a test is aborted. If this is `None`, the
+                 default timeouts are used
+   - `repeat`: The number of times the final state of each test is captured to measure
+               its stability, see `Instance`
+  """
+  sessions = {}
+  for test_path in test_paths:
+    test = Test(test_path)
+    sessions.setdefault(test.profile, []).append(test)
+
+  for profile, tests in sessions.items():
+    print(f"Starting session for profile '{profile}' with {len(tests)} tests")
+    instance = None
+    try:
+      for i, test in enumerate(tests):
+        if instance is None:
+          instance = Instance(executable, profile, worker, timeouts, repeat)
+          failure = start_instance(instance)
+
+        print(f"Running test: {test.test_path}")
+        if failure == "":
+          result = instance.run_test(test, clear_screenshots=True)
+        else:
+          result = instance.failed_result(test, failure)
+
+        if i == len(tests) - 1 or not instance.is_running():
+          # Shut down the instance before handing out the last result of the session so
+          # that the result also contains everything that was logged during the shutdown.
+          # The same applies to an instance that was killed after a failed test
+          instance.stop()
+          result.add_log(instance.take_log())
+          result.phases.update(instance.phases)
+          instance = None
+        yield result
+    finally:
+      if instance is not None:
+        instance.stop()
+
+
+
+def run_parallel(test_paths, executable, jobs: int, session: bool,
+                 timeouts: Timeouts | None = None, displays: DisplayPool | None = None,
+                 repeat: int = 1):
+  """
+  Runs all of the tests provided by `test_paths` using the OpenSpace executable provided
+  by `executable` in `jobs` OpenSpace instances at the same time. Each instance belongs to
+  a separate `Worker` that takes the next test from a shared queue whenever it has
+  finished its previous test. If `session` is `True`, the tests are grouped by their
+  profile and each group is handed to a worker as a whole, see `run_test_session`.
+
+  This function is a generator that yields the `TestResult` of each test as soon as that
+  test is finished. The images referenced by a result are valid until the generator is
+  finished. A test that hangs or crashes OpenSpace is reported as a failed result, see
+  `Timeouts`. If a test fails with an exception, the remaining tests are not started and
+  the exception is raised once all running tests have finished.
+
+  Without `session`, `test_paths` can also be an iterator that provides the next test
+  only when a worker asks for it, such as the tests leased from the server's work queue.
+
+  If a `DisplayPool` is provided as `displays`, every worker renders on a virtual display
+  of its own that is returned to the pool once the tests have finished. The `timeouts`
+  and `repeat` are passed on to each test, see `run_single_test`.
+  """
+  if session:
+    sessions = {}
+    for test_path in test_paths:
+      sessions.setdefault(Test(test_path).profile, []).append(test_path)
+    work = iter(list(sessions.values()))
+    count = len(sessions)
+  else:
+    work = ([test_path] for test_path in test_paths)
+    count = len(test_paths) if hasattr(test_paths, "__len__") else jobs
+  # The workers take turns taking the next tests as the iterator is not thread-safe
+  work_lock = threading.Lock()
+
+  results = queue.Queue()
+  abort = threading.Event()
+
+  def run_worker(worker):
+    try:
+      while not abort.is_set():
+        with work_lock:
+          paths = next(work, None)
+        if paths is None:
+          break
+
+        if session:
+          for result in run_test_session(paths, executable, worker, timeouts, repeat):
+            results.put(result)
+        else:
+          results.put(run_single_test(paths[0], executable, worker, timeouts, repeat))
+    except Exception as e:
+      abort.set()
+      results.put(e)
+    finally:
+      # Signal that this worker has finished
+      results.put(None)
+
+  workers = []
+  threads = []
+  for index in range(min(jobs, count)):
+    worker = Worker(index)
+    worker.create(displays.acquire() if displays is not None else None)
+    workers.append(worker)
+    name = f"worker-{index}"
+    thread = threading.Thread(target=run_worker, args=(worker,), name=name)
+    thread.start()
+    threads.append(thread)
+
+  try:
+    error = None
+    running = len(threads)
+    while running > 0:
+      result = results.get()
+      if result is None:
+        running = running - 1
+      elif isinstance(result, Exception):
+        error = result
+      else:
+        yield result
+
+    if error is not None:
+      raise error
+  finally:
+    abort.set()
+    for thread in threads:
+      thread.join()
+    for worker in workers:
+      if worker.display is not None:
+        displays.release(worker.display)
+      worker.destroy()
@@ -0,0 +1,177 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import json
+import os
+import re
+import shutil
+from .image import pixel_hash
+from .test import Screenshot, TestResult
+
+
+
+class SpoolEntry:
+  """
+  A single submission that is stored in the spool. An entry is a folder that contains the
+  candidate image as `image.png`, the log of the test run as `log.txt`, and everything
+  else that is needed to submit the image in a `metadata.json`. The name of the folder is
+  derived from the group, name, hardware, and timestamp of the test, which are also the
+  values that identify a test on the server. If the test failed before the image was
+  written, there is no `image.png` and the metadata contains the `failure` instead.
+  """
+  def __init__(self, folder: str, image: bytes | None = None):
+    self.folder = folder
+    with open(f"{folder}/metadata.json") as f:
+      self.metadata = json.load(f)
+    # The contents of the image if they have already been read when the entry was added
+    self._image = image
+
+
+  def __repr__(self):
+    return f"{self.metadata['group']}/{self.metadata['name']}"
+
+
+  def image(self) -> bytes:
+    """
+    Returns the contents of the candidate image of this entry. The image is only read from
+    the spool if it was not already read when the entry was added.
+    """
+    if self._image is not None:
+      return self._image
+    with open(f"{self.folder}/image.png", "rb") as f:
+      return f.read()
+
+
+  def log(self) -> bytes:
+    """
+    Returns the contents of the log of the test run of this entry.
+    """
+    with open(f"{self.folder}/log.txt", "rb") as f:
+      return f.read()
+
+
+
+class Spool:
+  """
+  An on-disk queue of submissions that have not been delivered to the server yet. Every
+  image is written to the spool before it is submitted and is only removed once the
+  server has accepted it. Submissions that could not be delivered, for example because
+  the server was restarting, stay in the spool and can be delivered later by running
+  `drain.py`. Submissions that the server rejected are moved into the `rejected` subfolder
+  so that they are not sent again, but are still available for inspection.
+
+   - `folder`: The folder in which the spooled submissions are stored
+  """
+  def __init__(self, folder: str):
+    self.folder = folder
+    os.makedirs(self.folder, exist_ok=True)
+
+
+  def add(self, result: TestResult, screenshot: Screenshot, hardware: str,
+          run: str | None = None) -> SpoolEntry:
+    """
+    Adds the `screenshot` that was taken by the test `result` on the provided `hardware`
+    to the spool and returns the new entry. If the test was leased from the work queue of
+    a `run`, the name of the run is stored so that the server finishes the test in it. If the spool already contains an entry for
+    the same screenshot, it is replaced. The group and name of the test that took the
+    screenshot are stored as `test`, as they differ from the screenshot's for tests with
+    multiple screenshots. A `screenshot` without a file is added as a failure without an
+    image. The `stability` of the result is added to the test's last screenshot, which
+    shows the state at the end of the test whose stability was measured.
+
+    The image file is moved into the spool instead of being copied. It is read only once
+    and the returned entry keeps its contents, so that the pixel hash and the upload are
+    both based on the same buffer.
+    """
+    file = screenshot.file
+    key = f"{screenshot.group}-{screenshot.name}-{hardware}-{result.timestamp}"
+    destination = f"{self.folder}/{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}"
+
+    # The entry is written to a temporary folder first and then renamed, so that a runner
+    # that is interrupted while writing never leaves a partial entry behind
+    temporary = f"{destination}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    image = None
+    if file is not None:
+      with open(file, "rb") as f:
+        image = f.read()
+      shutil.move(file, f"{temporary}/image.png")
+    with open(f"{temporary}/log.txt", "w") as f:
+      f.write(result.error)
+    with open(f"{temporary}/metadata.json", "w") as f:
+      metadata = {
+        "group": screenshot.group,
+        "name": screenshot.name,
+        "test": f"{result.group}/{result.name}",
+        "hardware": hardware,
+        "timestamp": result.timestamp,
+        "timing": result.timing,
+        "commitHash": result.commit,
+        "nErrors": result.log_lines,
+        "phases": result.phases,
+        "pixelHash": pixel_hash(image) if image is not None else None
+      }
+      if file is None:
+        metadata["failure"] = result.failure
+      if run is not None:
+        metadata["run"] = run
+      if result.stability is not None and screenshot is result.screenshots[-1]:
+        metadata["stability"] = result.stability.to_json()
+      json.dump(metadata, f, indent=2)
+
+    shutil.rmtree(destination, ignore_errors=True)
+    os.rename(temporary, destination)
+    return SpoolEntry(destination, image)
+
+
+  def entries(self) -> list[SpoolEntry]:
+    """
+    Returns all entries that are waiting to be delivered, ordered by their name.
+    """
+    entries = []
+    for name in sorted(os.listdir(self.folder)):
+      path = f"{self.folder}/{name}"
+      if name.endswith(".tmp") or not os.path.isfile(f"{path}/metadata.json"):
+        continue
+      entries.append(SpoolEntry(path))
+    return entries
+
+
+  def remove(self, entry: SpoolEntry):
+    """
+    Removes an `entry` after it has been delivered to the server.
+    """
+    shutil.rmtree(entry.folder, ignore_errors=True)
+
+
+  def reject(self, entry: SpoolEntry):
+    """
+    Moves an `entry` that the server did not accept into the `rejected` subfolder.
+    """
+    rejected = f"{self.folder}/rejected"
+    os.makedirs(rejected, exist_ok=True)
+    destination = f"{rejected}/{os.path.basename(entry.folder)}"
+    shutil.rmtree(destination, ignore_errors=True)
+    os.rename(entry.folder, destination)
@@ -22,36 +22,187 @@
 # OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
 ##########################################################################################
 
+import asyncio
 import json
 import os
-import time
-from .instruction import Instruction
-from .constants import test_base_dir
+import re
+import shutil
+from .image import can_compare_images, pixel_error
+from .instruction import Instruction, is_timeout, run_lua
+from .constants import comparison_threshold, test_base_dir
+from .trace import tracer
+
+
+
+# The characters that are allowed in the name of a screenshot, as it becomes part of the
+# test name and thus of file and folder names
+Screenshot_Name_Pattern = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+
+class Screenshot:
+  """
+  A single image that was written by a screenshot instruction of a test. Every image is
+  submitted as a separate result with the following members:
+    - `group`: The group under which the image is submitted
+    - `name`: The name under which the image is submitted
+    - `file`: The path to the image file, or `None` if the test failed before the image
+              was written
+  """
+  def __init__(self, group: str, name: str, file: str | None):
+    self.group = group
+    self.name = name
+    self.file = file
+
+
+  def __repr__(self):
+    return f"{self.group}/{self.name}: {self.file}"
+
+
+
+class Stability:
+  """
+  Describes whether a test renders the same image every time, which is measured by
+  capturing the state at the end of the test multiple times within the same run. It has
+  the following members:
+    - `captures`: The number of images that were taken of the final state
+    - `differing`: The number of images that differ from the first of these images
+    - `max_error`: The largest pixel error of an image compared to the first image, or
+                   `None` if the images were only checked for being identical as Pillow
+                   and NumPy are not installed
+  """
+  def __init__(self, captures: int, differing: int, max_error: float | None):
+    self.captures = captures
+    self.differing = differing
+    self.max_error = max_error
+
+
+  def __repr__(self):
+    return f"{self.score():.0%} ({self.differing} of {self.captures} captures differ)"
+
+
+  def score(self) -> float:
+    """
+    Returns the ratio of the repeated images that are the same as the first image, which
+    is 1 for a stable test and 0 if every repeated image was different.
+    """
+    return 1.0 - self.differing / (self.captures - 1)
+
+
+  def to_json(self) -> dict:
+    """
+    Returns this stability as it is submitted to the regression server.
+    """
+    return {
+      "captures": self.captures,
+      "differing": self.differing,
+      "maxError": self.max_error
+    }
+
+
+
+def measure_stability(files: list[str]) -> Stability:
+  """
+  Compares the images in `files`, which were all taken of the same state, against the
+  first of them. An image differs if any of its pixels differs in the same way as on the
+  regression server. If Pillow and NumPy are not installed, the images have to be
+  identical instead, which is the case for the same pixels as OpenSpace always encodes
+  them in the same way.
+  """
+  differing = 0
+  max_error = 0.0 if can_compare_images() else None
+  for file in files[1:]:
+    if max_error is not None:
+      # Images of a different size are as different as they can be
+      error = pixel_error(files[0], file, comparison_threshold)
+      error = error if error is not None else 1.0
+      max_error = max(max_error, error)
+      different = error > 0.0
+    else:
+      with open(files[0], "rb") as first, open(file, "rb") as f:
+        different = first.read() != f.read()
+    if different:
+      differing = differing + 1
+  return Stability(len(files), differing, max_error)
+
+
 
 class TestResult:
   """
   Stores the result of a single test run. It has the following members:
     - `group`: The name of the group for which this is the test result
     - `name`: The name of the test for which is the result
-    - `files`: The list of screenshots that were taken during the test. Each entry in this
-               list is a path to an image file
+    - `timestamp`: The time at which the test was started as an ISO 8601 string in UTC
+    - `screenshots`: The list of `Screenshot`s that were taken during the test in the
+                     order of their instructions
+    - `folder`: The runner-owned folder into which the images of this test were moved,
+                or `None` if they are still in OpenSpace's screenshot folder
     - `timing`: The number of seconds it took to execute the test
+    - `phases`: The number of seconds spent in the individual phases of the test, such as
+                `startup`, `connect`, `test`, and `shutdown`. Phases that were not part of
+                this test, for example starting OpenSpace for a test that was not the
+                first in a session, are not included. The time spent on each type of
+                instruction is included as `instruction.<type>`, which is part of `test`
     - `commit`: The commit hash for OpenSpace that was used to run the test
-    - `error`: The contents of the error stream that was captured during the test run
+    - `error`: The contents of the error stream that was captured during the test run. If
+               the test logged a lot, only the last part of the error stream is kept
+    - `log_lines`: The number of non-empty lines written to the error stream
+    - `log_errors`: The number of error messages written to the error stream
+    - `log_warnings`: The number of warning messages written to the error stream
+    - `failure`: The reason why the test did not run to completion, for example because
+                 OpenSpace crashed or did not finish within the timeout, or an empty
+                 string if it succeeded. The screenshots that were not taken before the
+                 failure have no `file`
+    - `stability`: The `Stability` of the final state of the test if it was captured
+                   repeatedly, or `None` otherwise
   """
   group: str
   name: str
-  files = list[str]
+  timestamp: str
+  screenshots: list[Screenshot]
+  folder: str | None = None
   timing: float
+  phases: dict[str, float]
   commit: str
-  error: str
+  error: str = ""
+  log_lines: int = 0
+  log_errors: int = 0
+  log_warnings: int = 0
+  failure: str = ""
+  stability: Stability | None = None
+
+
+  def add_log(self, log):
+    """
+    Adds the `Log` of (a part of) the test run to this result.
+    """
+    self.error = self.error + log.text
+    self.log_lines = self.log_lines + log.lines
+    self.log_errors = self.log_errors + log.errors
+    self.log_warnings = self.log_warnings + log.warnings
+
+
+  def remove_images(self):
+    """
+    Removes the images of this result once they have been spooled or stored, which
+    usually moved them elsewhere already, together with the `folder` that contained them.
+    """
+    for screenshot in self.screenshots:
+      if screenshot.file is not None and os.path.exists(screenshot.file):
+        os.remove(screenshot.file)
+    if self.folder is not None:
+      shutil.rmtree(self.folder, ignore_errors=True)
+
+
 
 class Test:
   """
   This class represents an entire test run, consisting of multiple Instructions and a
   profile that should be used.
 
-  For now only a single screenshot instruction is supported.
+  A test can take multiple screenshots, in which case every screenshot instruction needs
+  a unique name as its value. Each named screenshot is a separate result, see
+  `screenshot_result`.
   """
   def __init__(self, path: str):
     assert(os.path.isfile(path))
@@ -64,6 +215,19 @@ class Test:
       raise f"Missing 'profile' in test {path}'"
     self.profile = content["profile"]
 
+    # The number of seconds to wait after an instruction whose effect has not been
+    # acknowledged by OpenSpace before the next instruction is run
+    self.delay = content.get("delay", 0.25)
+
+    # The number of seconds that the entire test and each of its instructions can take
+    # before they are considered to hang, or `None` to use the runner's defaults
+    self.timeout = content.get("timeout")
+    if self.timeout is not None and not is_timeout(self.timeout):
+      raise Exception(f"Invalid 'timeout' in test {path}")
+    self.instruction_timeout = content.get("instructionTimeout")
+    if self.instruction_timeout is not None and not is_timeout(self.instruction_timeout):
+      raise Exception(f"Invalid 'instructionTimeout' in test {path}")
+
     if content["commands"] is None:
       raise Exception(f"Missing 'commands' in test {path}")
 
@@ -74,15 +238,21 @@ class Test:
       except Exception as error:
         raise Exception(f"Error loading test {path}: {error}")
 
-    number_screenshot_instruction = 0
-    for instruction in self.instructions:
-      if instruction.type == "screenshot":
-        number_screenshot_instruction = number_screenshot_instruction + 1
-
-    if number_screenshot_instruction == 0:
+    screenshots = [i for i in self.instructions if i.is_screenshot()]
+    if len(screenshots) == 0:
       raise Exception(f"Error loading test {path}: No screenshot instruction")
-    if number_screenshot_instruction != 1:
-      raise Exception(f"Error loading test {path}: Only a single screenshot supported")
+
+    names = [screenshot.screenshot_name() for screenshot in screenshots]
+    for name in names:
+      if name is None and len(screenshots) > 1:
+        raise Exception(
+          f"Error loading test {path}: Every screenshot needs a name if there are "
+          "multiple"
+        )
+      if name is not None and not Screenshot_Name_Pattern.fullmatch(name):
+        raise Exception(f"Error loading test {path}: Invalid screenshot name '{name}'")
+    if len(set(names)) != len(names):
+      raise Exception(f"Error loading test {path}: Screenshot names are not unique")
 
 
     # Get the testname by removing everything before (and including) "test/visual" and
@@ -95,12 +265,141 @@ class Test:
     self.group = "-".join(parts[0:-1])
     self.name = parts[-1]
 
+    # The screenshots that were taken during the last run of this test. This is filled
+    # while the test is running, so that the images are kept when the test is aborted
+    self.screenshots = []
+    # The additional images of the final state that were taken during the last run
+    self.repeats = []
+
+
+  def screenshot_result(self, instruction, file: str | None) -> Screenshot:
+    """
+    Returns the `Screenshot` for the `file` that was written by the screenshot
+    `instruction` of this test. An unnamed screenshot is submitted with the group and name
+    of the test. For named screenshots, the test file is treated like another folder, so
+    its name becomes part of the group and the screenshot's name is used as the name.
+    """
+    name = instruction.screenshot_name()
+    if name is None:
+      return Screenshot(self.group, self.name, file)
+    group = f"{self.group}-{self.name}" if self.group != "" else self.name
+    return Screenshot(group, name, file)
+
+
+  def untaken_screenshots(self) -> list[Screenshot]:
+    """
+    Returns a `Screenshot` without a file for every screenshot instruction that did not
+    write an image during the last run of this test, for example because it was aborted.
+    """
+    taken = [(screenshot.group, screenshot.name) for screenshot in self.screenshots]
+    untaken = []
+    for instruction in self.instructions:
+      if instruction.is_screenshot():
+        screenshot = self.screenshot_result(instruction, None)
+        if (screenshot.group, screenshot.name) not in taken:
+          untaken.append(screenshot)
+    return untaken
+
 
-  async def run(self, openspace):
+  def batches(self):
     """
-    Runs the actual instructions on the provided OpenSpace API instance. There is a
-    mandatory 250ms wait time between every instructions
+    Splits the instructions of this test into batches that are run together. Consecutive
+    instructions that only change the state of OpenSpace are combined into a single
+    batch, all other instructions form a batch of their own. A batch ends after an
+    asynchronous instruction, as the following instructions might depend on its effect
+    and have to wait for the `delay` after it.
     """
+    batches = []
     for instruction in self.instructions:
-      await instruction.run(openspace)
-      time.sleep(0.25)
+      previous = batches[-1][-1] if len(batches) > 0 else None
+      if (previous is not None and previous.can_batch() and instruction.can_batch() and
+          not previous.is_asynchronous()):
+        batches[-1].append(instruction)
+      else:
+        batches.append([instruction])
+    return batches
+
+
+  def final_captures(self) -> list[str]:
+    """
+    Returns the images of the state at the end of the last run of this test, which are
+    the `repeats` preceded by the test's last screenshot if that is its last instruction.
+    """
+    last = self.screenshots[-1] if len(self.screenshots) > 0 else None
+    if self.instructions[-1].is_screenshot() and last is not None:
+      return [last.file] + self.repeats
+    return self.repeats
+
+
+  async def run(self, openspace, watch, instruction_timeout: float,
+                repeat: int = 1) -> dict[str, float]:
+    """
+    Runs the actual instructions on the provided OpenSpace API instance. The instructions
+    of a batch are combined into a single Lua script that is sent to OpenSpace at once.
+    If the batch contained an instruction that was not acknowledged by OpenSpace or whose
+    effect continues after it was handled, there is a wait of `delay` seconds before the
+    next batch to give it time to take effect.
+
+    Each batch is run through `watch`, which is called with the coroutine of the batch and
+    the number of seconds the batch can take and raises an Exception if the batch takes
+    longer. Instructions without their own timeout use the `instructionTimeout` of this
+    test or, if it has none, the provided `instruction_timeout`.
+
+    If `repeat` is larger than 1, the state at the end of the test is captured until there
+    are `repeat` images of it, which are stored in `repeats` and are not submitted. If the
+    test ends with a screenshot, that image is the first of them.
+
+    The `Screenshot`s that were taken by the test are stored in `screenshots`. Returns the
+    total number of seconds that were spent on each type of instruction. A batch of
+    multiple instructions is counted as `batch` and the waits after instructions that
+    were not acknowledged are counted as `delay`, and the repeated images as `repeat`.
+    """
+    if self.instruction_timeout is not None:
+      instruction_timeout = self.instruction_timeout
+
+    self.screenshots = []
+    self.repeats = []
+    durations = {}
+    for batch in self.batches():
+      timeout = max([i.allowed_time(instruction_timeout) for i in batch])
+      if len(batch) == 1:
+        type = batch[0].type
+        with tracer.span(type, "instruction", value=str(batch[0].value)) as span:
+          try:
+            file = await watch(batch[0].run(openspace), timeout)
+          except Exception as e:
+            raise Exception(f"Instruction {batch[0]} failed: {e}")
+        if batch[0].is_screenshot():
+          self.screenshots.append(self.screenshot_result(batch[0], file))
+        acknowledged = batch[0].is_acknowledged()
+      else:
+        type = "batch"
+        print(f"    Batch of {len(batch)} instructions")
+        for instruction in batch:
+          print(f"      {instruction}")
+        types = [instruction.type for instruction in batch]
+        with tracer.span(type, "instruction", types=types) as span:
+          script = run_lua(openspace, [instruction.to_lua() for instruction in batch])
+          try:
+            await watch(script, timeout)
+          except Exception as e:
+            raise Exception(f"Batch of {len(batch)} instructions failed: {e}")
+        acknowledged = not any([instruction.is_asynchronous() for instruction in batch])
+      durations[type] = durations.get(type, 0.0) + span.duration
+
+      if not acknowledged:
+        with tracer.span("delay", "instruction") as span:
+          await asyncio.sleep(self.delay)
+        durations["delay"] = durations.get("delay", 0.0) + span.duration
+
+    capture = Instruction({ "type": "screenshot" })
+    timeout = capture.allowed_time(instruction_timeout)
+    while repeat > 1 and len(self.final_captures()) < repeat:
+      with tracer.span("repeat", "instruction") as span:
+        try:
+          self.repeats.append(await watch(capture.run(openspace), timeout))
+        except Exception as e:
+          raise Exception(f"Repeated screenshot {len(self.repeats) + 1} failed: {e}")
+      durations["repeat"] = durations.get("repeat", 0.0) + span.duration
+
+    return durations
@@ -0,0 +1,123 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import json
+import os
+import threading
+import time
+
+
+
+class Span:
+  """
+  A single timed section of the test run that is recorded in the `Tracer` when it ends.
+  Spans are used as context managers and can be used in both regular and asynchronous
+  code. After the span has ended, its `duration` contains the number of seconds it took.
+  """
+  def __init__(self, tracer, name: str, category: str, args: dict):
+    self.tracer = tracer
+    self.name = name
+    self.category = category
+    self.args = args
+    self.duration = 0.0
+
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    end = time.perf_counter()
+    self.duration = end - self.start
+    if exc_type is not None:
+      self.args = self.args | { "error": str(exc_value) }
+    self.tracer._record(self, end)
+    return False
+
+
+
+class Tracer:
+  """
+  Records the spans of a run of the test suite, such as starting OpenSpace, connecting
+  to it, running the individual instructions, and uploading the results, from all
+  threads. The recorded spans can be saved in the Chrome trace event format, which can
+  be opened with `chrome://tracing` or https://ui.perfetto.dev.
+  """
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.events = []
+    self.threads = {}
+    self.start = time.perf_counter()
+
+
+  def span(self, name: str, category: str, **args) -> Span:
+    """
+    Returns a new span with the provided `name` and `category` that starts when it is
+    entered. The `args` are shown together with the span in the trace viewer.
+    """
+    return Span(self, name, category, args)
+
+
+  def _record(self, span: Span, end: float):
+    thread = threading.current_thread()
+    with self.lock:
+      if thread.ident not in self.threads:
+        self.threads[thread.ident] = thread.name
+      self.events.append({
+        "name": span.name,
+        "cat": span.category,
+        "ph": "X",
+        "ts": (span.start - self.start) * 1e6,
+        "dur": (end - span.start) * 1e6,
+        "pid": os.getpid(),
+        "tid": thread.ident,
+        "args": span.args
+      })
+
+
+  def save(self, path: str):
+    """
+    Writes all spans that have been recorded so far to the file at `path` as a JSON file
+    in the Chrome trace event format.
+    """
+    with self.lock:
+      # Name the threads so that the spans of different workers can be told apart
+      names = [
+        {
+          "name": "thread_name",
+          "ph": "M",
+          "pid": os.getpid(),
+          "tid": ident,
+          "args": { "name": name }
+        }
+        for ident, name in self.threads.items()
+      ]
+      with open(path, "w") as f:
+        json.dump({ "traceEvents": names + self.events }, f)
+
+
+
+# The tracer that records the spans of the current run of the test suite
+tracer = Tracer()
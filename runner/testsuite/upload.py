@@ -0,0 +1,276 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import json
+import queue
+import requests
+import threading
+import time
+from .constants import upload_queue_size, upload_retries, upload_workers
+from .image import compress_png
+from .spool import Spool, SpoolEntry
+from .trace import tracer
+
+
+
+class Uploader:
+  """
+  Submits spooled candidate images to the server in the background so that uploading the
+  results of one test overlaps with running the next test. Spool entries are put into a
+  bounded queue from which a number of worker threads take them. Each worker keeps its
+  own HTTP session, which keeps the connection to the server alive between submissions.
+  If the queue is full, `submit` blocks until a worker has finished a submission. Entries
+  are removed from the spool once the server has accepted them and moved to the rejected
+  entries if the server refused them. Entries that could not be delivered stay in the
+  spool.
+
+   - `url`: The URL of the server's `submit-test` endpoint
+   - `runner`: The identifier of this runner that is sent with every submission
+   - `spool`: The spool that contains the entries that are submitted
+   - `workers`: The number of submissions that are uploaded at the same time
+   - `delivered`: An optional function that is called from a worker thread with every
+                  entry that was accepted by the server
+   - `abandoned`: An optional function that is called from a worker thread with every
+                  entry that was refused by the server or could not be delivered
+  """
+  def __init__(self, url: str, runner: str, spool: Spool, workers: int = upload_workers,
+               delivered = None, abandoned = None):
+    self.url = url
+    self.runner = runner
+    self.spool = spool
+    self.delivered = delivered
+    self.abandoned = abandoned
+    self.queue = queue.Queue(maxsize=upload_queue_size)
+    self.failed = []
+    self.lock = threading.Lock()
+    self.threads = [
+      threading.Thread(target=self._work, name=f"upload-{i}") for i in range(workers)
+    ]
+    for thread in self.threads:
+      thread.start()
+
+
+  def submit(self, entry: SpoolEntry):
+    """
+    Queues the spool `entry` for submission.
+    """
+    self.queue.put(entry)
+
+
+  def flush(self):
+    """
+    Waits until all queued submissions have either been submitted or have failed.
+    """
+    self.queue.join()
+
+
+  def close(self):
+    """
+    Waits for all queued submissions and stops the worker threads. The uploader can not
+    be used anymore afterwards. Returns the list of entries that could not be delivered
+    and are still in the spool.
+    """
+    self.flush()
+    for _ in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+    return self.failed
+
+
+  def _work(self):
+    """
+    The loop of a single worker thread that submits queued images until it receives a
+    `None` sentinel.
+    """
+    with requests.Session() as session:
+      while True:
+        entry = self.queue.get()
+        if entry is None:
+          self.queue.task_done()
+          return
+
+        try:
+          key = f"{entry.metadata['group']}/{entry.metadata['name']}"
+          with tracer.span("upload", "upload", test=key):
+            status = self._post(session, entry)
+          if status == 200:
+            self.spool.remove(entry)
+            if self.delivered is not None:
+              self.delivered(entry)
+          elif status is not None and status < 500:
+            self.spool.reject(entry)
+            self._abandon(entry)
+          else:
+            with self.lock:
+              self.failed.append(entry)
+            self._abandon(entry)
+        except Exception as e:
+          # Any other error, for example a broken connection while receiving the answer
+          # or another process moving the spool entry, must not stop this worker, as the
+          # remaining entries would otherwise never be taken from the queue
+          print(f"Image submission of '{entry}' failed: {e}")
+          with self.lock:
+            self.failed.append(entry)
+          self._abandon(entry)
+        finally:
+          self.queue.task_done()
+
+
+  def _abandon(self, entry: SpoolEntry):
+    """
+    Reports that the spool `entry` will not be delivered by this uploader.
+    """
+    if self.abandoned is None:
+      return
+    try:
+      self.abandoned(entry)
+    except Exception as e:
+      print(f"Handling the undelivered image '{entry}' failed: {e}")
+
+
+  def _post(self, session: requests.Session, entry: SpoolEntry) -> int | None:
+    """
+    Sends a single spool `entry` to the server. If the pixel hash of the image is known,
+    the entry is first submitted without the image, which the server accepts if it
+    already has an image with the same pixels for the test. Only if the server asks for
+    the image, it is compressed with `compress_png` and submitted. Returns the status code
+    of the last request or `None` if no connection to the server could be established.
+    """
+    metadata = entry.metadata
+    data = {
+      "group": metadata["group"],
+      "name": metadata["name"],
+      "hardware": metadata["hardware"],
+      "runnerID": self.runner,
+      "timestamp": metadata["timestamp"],
+      "timing": metadata["timing"],
+      "commitHash": metadata["commitHash"]
+    }
+    # The hash is missing if Pillow was not available when the entry was spooled
+    if metadata.get("pixelHash") is not None:
+      data["pixelHash"] = metadata["pixelHash"]
+    # The number of log lines was counted while the log was captured and also includes
+    # lines that might have been omitted from the log
+    if metadata.get("nErrors") is not None:
+      data["nErrors"] = metadata["nErrors"]
+    # The test that took the screenshot, which finishes the test in the server's queue
+    if metadata.get("test") is not None:
+      data["test"] = metadata["test"]
+    if metadata.get("run") is not None:
+      data["run"] = metadata["run"]
+    # The summary of how long the phases of the test took, see `TestResult.phases`
+    if metadata.get("phases") is not None:
+      data["phases"] = json.dumps(metadata["phases"])
+    # How many repeated captures of the test's final state differed, see `Stability`
+    if metadata.get("stability") is not None:
+      data["stability"] = json.dumps(metadata["stability"])
+    files = { "log": entry.log() }
+
+    if metadata.get("failure") is not None:
+      # A test that failed before the screenshot was taken is submitted without an image
+      data["failure"] = metadata["failure"]
+      return self._report(entry, self._send(session, entry, data, files))
+
+    if "pixelHash" in data:
+      res = self._send(session, entry, data, files)
+      # The server answers with 409 if it does not know the image yet. Servers that do not
+      # support submissions without an image reject them with other client errors
+      if res is None or res.status_code == 200 or res.status_code >= 500:
+        return self._report(entry, res)
+      # The server lists the formats in which it accepts the image with its 409 answer
+      formats = self._formats(res) if res.status_code == 409 else ["png"]
+      if "png" not in formats:
+        print(f"Image submission of '{entry}' failed as the server only accepts the "
+          f"formats {formats}")
+        return res.status_code
+      print(f"Uploading image '{entry}' as the server does not have it yet")
+
+    with tracer.span("compress", "upload"):
+      image = compress_png(entry.image())
+    data["format"] = "png"
+    files["file"] = (f"{metadata['name']}.png", image, "image/png")
+    return self._report(entry, self._send(session, entry, data, files))
+
+
+  def _formats(self, res: requests.Response) -> list[str]:
+    """
+    Returns the image formats that the server accepts according to its answer `res` to a
+    submission without an image. Servers that do not list them only accept PNG images.
+    """
+    try:
+      formats = res.json().get("formats")
+    except (ValueError, AttributeError):
+      formats = None
+    return formats if isinstance(formats, list) else ["png"]
+
+
+  def _send(self, session: requests.Session, entry: SpoolEntry, data: dict,
+            files: dict) -> requests.Response | None:
+    """
+    Sends a single request for the spool `entry` to the server. Connection errors and
+    server errors are retried with an exponentially increasing delay as they are usually
+    temporary, for example while the server is restarting. Client errors are not retried
+    as sending the same request again would lead to the same error. Returns the response
+    to the last attempt or `None` if no connection to the server could be established.
+    """
+    res = None
+    delay = 1.0
+    for attempt in range(upload_retries + 1):
+      if attempt > 0:
+        time.sleep(delay)
+        delay *= 2
+
+      try:
+        res = session.post(
+          self.url,
+          data = data,
+          files = files
+        )
+      except (requests.ConnectionError, requests.Timeout) as e:
+        print(f"Image submission of '{entry}' failed: {e}")
+        res = None
+        continue
+
+      if res.status_code < 500:
+        return res
+      print(f"Image submission of '{entry}' failed with error {res.status_code}")
+
+    return res
+
+
+  def _report(self, entry: SpoolEntry, res: requests.Response | None) -> int | None:
+    """
+    Prints the outcome of the last request for the spool `entry` and returns its status
+    code or `None` if there was no response.
+    """
+    if res is None:
+      return None
+
+    if res.status_code == 200:
+      print(f"Image '{entry}' submitted successfully")
+    elif res.status_code < 500:
+      print(f"Image submission of '{entry}' failed with error {res.status_code}")
+      print(res.text)
+    return res.status_code
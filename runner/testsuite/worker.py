@@ -0,0 +1,123 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+import json
+import os
+import shutil
+import tempfile
+from .constants import api_port, sgct_port
+from .display import Display
+
+
+
+# The names of the environment variables through which the `openspace.cfg.override`
+# file receives the settings that are different for every instance
+Port_Variable = "OPENSPACE_VISUALTESTING_PORT"
+Screenshots_Variable = "OPENSPACE_VISUALTESTING_SCREENSHOTS"
+
+
+
+class Worker:
+  """
+  Describes the resources that a single OpenSpace instance uses, which have to be
+  different for instances that are running at the same time on the same machine. A
+  worker that was not `create`d uses the default settings of OpenSpace and the runner. A
+  created worker has its own API port, its own SGCT port and window configuration, and
+  an isolated screenshot folder, all of which are derived from the `index` of the
+  worker. It also owns a folder into which the images of finished tests are moved, so
+  that they can't be confused with the images of the test that is currently running. A
+  worker can also be given a virtual `Display` on which OpenSpace renders without a GPU.
+
+  These settings only take effect if the `openspace.cfg.override` file was written by
+  `write_configuration_overwrite`.
+  """
+  def __init__(self, index: int = 0):
+    self.index = index
+    self.api_port = api_port
+    self.window_config = f"{os.getcwd()}/1920-1080.json"
+    self.environment = None
+    self.folder = None
+    self.screenshot_folder = None
+    self.display = None
+    self.results = 0
+
+
+  def create(self, display: Display | None = None):
+    """
+    Creates the folder for this worker and the window configuration that uses the SGCT
+    port of this worker. The windows of different workers are placed next to each other
+    to prevent them from overlapping, unless the worker has its own virtual `display`.
+    """
+    # Every instance uses the TCP socket port and the following port for the web socket
+    self.api_port = api_port + 2 * self.index
+    self.folder = tempfile.mkdtemp(prefix=f"openspace-worker-{self.index}-")
+    self.screenshot_folder = f"{self.folder}/screenshots"
+    os.makedirs(self.screenshot_folder)
+
+    with open(f"{os.getcwd()}/1920-1080.json") as f:
+      config = json.load(f)
+    node = config["nodes"][0]
+    node["port"] = sgct_port + self.index
+    window = node["windows"][0]
+    if display is None:
+      window["pos"]["x"] = (self.index % 2) * window["size"]["x"]
+      window["pos"]["y"] = (self.index // 2) * window["size"]["y"]
+    self.window_config = f"{self.folder}/window.json"
+    with open(self.window_config, "w") as f:
+      json.dump(config, f, indent=2)
+
+    self.environment = os.environ | {
+      Port_Variable: str(self.api_port),
+      Screenshots_Variable: self.screenshot_folder
+    }
+    if display is not None:
+      self.display = display
+      self.environment = self.environment | display.environment()
+
+
+  def is_isolated(self) -> bool:
+    """
+    Returns whether this worker has been `create`d and thus has its own screenshot folder.
+    """
+    return self.folder is not None
+
+
+  def result_folder(self) -> str:
+    """
+    Returns a new, empty folder into which the images of a finished test can be moved.
+    The folder is removed by `TestResult.remove_images` once the result was processed.
+    """
+    self.results = self.results + 1
+    path = f"{self.folder}/results/{self.results}"
+    os.makedirs(path)
+    return path
+
+
+  def destroy(self):
+    """
+    Removes the folder of this worker and all of the files inside it.
+    """
+    if self.folder is not None:
+      shutil.rmtree(self.folder, ignore_errors=True)
+      self.folder = None
@@ -0,0 +1,187 @@
+##########################################################################################
+#                                                                                        #
+# OpenSpace Visual Testing                                                               #
+#                                                                                        #
+# Copyright (c) 2024                                                                     #
+#                                                                                        #
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this   #
+# software and associated documentation files (the "Software"), to deal in the Software  #
+# without restriction, including without limitation the rights to use, copy, modify,     #
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to     #
+# permit persons to whom the Software is furnished to do so, subject to the following    #
+# conditions:                                                                            #
+#                                                                                        #
+# The above copyright notice and this permission notice shall be included in all copies  #
+# or substantial portions of the Software.                                               #
+#                                                                                        #
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,    #
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A          #
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT     #
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF   #
+# CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE   #
+# OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.                                          #
+##########################################################################################
+
+
+import requests
+import threading
+import time
+
+
+
+class WorkQueue:
+  """
+  Takes part in a test run whose tests are distributed by the server among all runners
+  with the same hardware. After registering its tests, the runner leases one test at a
+  time from the server. While a test is leased, its lease is renewed in the background
+  until the result of the test has been delivered to the server, which finishes the test
+  on the server. If a runner stops renewing its lease, for example because it crashed,
+  the test is returned to the queue once the lease has expired and given to another
+  runner.
+
+   - `url`: The URL of the server
+   - `runner`: The identifier of this runner
+   - `hardware`: The hardware of this runner, which has to be the same for all runners
+                 taking part in the run
+   - `run`: The name of the test run, which has to be the same for all runners taking
+            part in the run, for example the date of a nightly run
+  """
+  def __init__(self, url: str, runner: str, hardware: str, run: str):
+    self.url = url
+    self.runner = runner
+    self.hardware = hardware
+    self.run = run
+    self.lease_duration = 0
+    # The leases that are currently held by this runner, by the test they belong to
+    self.leases = {}
+    self.lock = threading.Lock()
+    self.session = requests.Session()
+    self.stopped = threading.Event()
+    self.renewer = threading.Thread(target=self._renew, name="lease-renewal", daemon=True)
+
+
+  def _post(self, session: requests.Session, endpoint: str, data: dict = {}):
+    """
+    Sends a request to the work queue `endpoint` of the server and returns the response.
+    """
+    body = { "runnerID": self.runner, "hardware": self.hardware, "run": self.run }
+    return session.post(f"{self.url}/api/queue/{endpoint}", json=body | data)
+
+
+  def register(self, tests: list[str]) -> int:
+    """
+    Registers this runner for the test run with the `tests` it wants to run, each in the
+    form `group/name`, and starts renewing the leases. Returns the number of tests that
+    remain to be run by all runners.
+    """
+    with self.lock:
+      res = self._post(self.session, "register", { "tests": tests })
+    if res.status_code != 200:
+      raise Exception(f"Registering for run '{self.run}' failed with error "
+        f"{res.status_code}: {res.text}")
+    answer = res.json()
+    self.lease_duration = answer["leaseDuration"]
+    self.renewer.start()
+    return answer["remaining"]
+
+
+  def tests(self, paths: dict[str, str]):
+    """
+    A generator that leases the next test from the server and yields the path of its test
+    file, which is looked up in `paths` by the test's `group/name`. If all remaining tests
+    are leased by other runners, the server is asked again until they have either been
+    finished or returned to the queue. Tests that this runner does not have are skipped,
+    so that their lease expires and another runner can run them.
+    """
+    # Check for returned tests often enough to notice them soon after their lease expired
+    interval = min(self.lease_duration / 3, 10.0)
+    while True:
+      with self.lock:
+        res = self._post(self.session, "next")
+      if res.status_code != 200:
+        raise Exception(f"Requesting the next test failed with error "
+          f"{res.status_code}: {res.text}")
+      answer = res.json()
+
+      test = answer["test"]
+      if test is None:
+        if answer["remaining"] == 0:
+          return
+        print(f"Waiting for {answer['remaining']} leased tests to be finished")
+        time.sleep(interval)
+        continue
+
+      if test not in paths:
+        print(f"Skipping test '{test}' that is not available on this runner")
+        continue
+
+      print(f"Leased test '{test}'")
+      with self.lock:
+        self.leases[test] = answer["lease"]
+      yield paths[test]
+
+
+  def finish(self, test: str):
+    """
+    Stops renewing the lease of the provided `test` once its result was delivered, which
+    has finished the test on the server.
+    """
+    with self.lock:
+      self.leases.pop(test, None)
+
+
+  def abandon(self, test: str):
+    """
+    Gives up the provided `test` on the server if its result was refused by the server or
+    could not be delivered. Running the test again on another runner would not help, and
+    the test would otherwise be handed out again every time its lease expires while all
+    runners wait for it. If the server can not be reached, the lease is only released and
+    the test is returned to the queue once the lease has expired.
+    """
+    with self.lock:
+      lease = self.leases.pop(test, None)
+      if lease is None:
+        return
+      try:
+        res = self._post(self.session, "abandon", { "lease": lease })
+      except (requests.ConnectionError, requests.Timeout) as e:
+        print(f"Giving up the test '{test}' failed: {e}")
+        return
+    if res.status_code not in (200, 404):
+      print(f"Giving up the test '{test}' failed with error {res.status_code}")
+
+
+  def close(self):
+    """
+    Stops renewing all leases. The tests whose results have not been delivered are
+    returned to the queue by the server once their leases expire.
+    """
+    self.stopped.set()
+    if self.renewer.is_alive():
+      self.renewer.join()
+    self.session.close()
+
+
+  def _renew(self):
+    """
+    The loop of the thread that renews all leases that this runner currently holds. The
+    leases are renewed three times per lease duration, so that a single failed renewal
+    does not lose the lease.
+    """
+    with requests.Session() as session:
+      while not self.stopped.wait(self.lease_duration / 3):
+        with self.lock:
+          leases = list(self.leases.items())
+
+        for test, lease in leases:
+          try:
+            res = self._post(session, "renew", { "lease": lease })
+          except (requests.ConnectionError, requests.Timeout) as e:
+            print(f"Renewing the lease for '{test}' failed: {e}")
+            continue
+
+          if res.status_code == 404:
+            # The test was finished or has been given to another runner
+            self.finish(test)
+          elif res.status_code != 200:
+            print(f"Renewing the lease for '{test}' failed with error {res.status_code}")